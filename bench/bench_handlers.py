@@ -0,0 +1,262 @@
+"""Offline benchmark and load replay for the command handlers and the db layer.
+
+Drives the real register_*_handler callbacks against a stub bot that records sends, on a
+temporary garden.db, and reports throughput and p50/p95/p99 latency per command.
+Results are stored as JSON so runs can be compared across commits:
+
+    python bench/bench_handlers.py --users 5000 --flowers 20 --senders 8 --ops 5000 \
+        --mix add=0.8,top=0.15,backup=0.05 --chats 50
+    python bench/bench_handlers.py --compare bench/results/<old>.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_ID: int = -1000000000001
+ADMIN_ID: int = 1
+
+# Модули бота читают конфигурацию при импорте, поэтому окружение задаём до них
+os.environ.setdefault("TOKEN", "0:offline-benchmark")
+os.environ["ALLOWED_CHAT_ID"] = str(CHAT_ID)
+os.environ["ADMIN_ID"] = str(ADMIN_ID)
+sys.path.insert(0, ROOT)
+
+import telebot  # noqa: E402
+from loguru import logger  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+from flowers import sample_flowers  # noqa: E402
+
+class StubBot:
+    """Stand-in for telebot.TeleBot: collects handlers and records sends instead of calling Telegram."""
+
+    def __init__(self) -> None:
+        self.handlers: Dict[str, Callable[[telebot.types.Message], None]] = {}
+        self.sends: int = 0
+        self.sent_bytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def message_handler(self, commands: List[str], **kwargs: Any) -> Callable:
+        def decorator(handler: Callable[[telebot.types.Message], None]) -> Callable:
+            for command in commands:
+                self.handlers[command] = handler
+            return handler
+        return decorator
+
+    def _record(self, size: int) -> None:
+        with self._lock:
+            self.sends += 1
+            self.sent_bytes += size
+
+    def send_message(self, chat_id: int, text: str, *args: Any, **kwargs: Any) -> None:
+        self._record(len(text.encode('utf-8')))
+
+    def reply_to(self, message: telebot.types.Message, text: str, *args: Any, **kwargs: Any) -> None:
+        self._record(len(text.encode('utf-8')))
+
+    def send_document(self, chat_id: int, document: Any, *args: Any, **kwargs: Any) -> None:
+        _, file = document
+        self._record(len(file.read()))
+
+class MessageFactory:
+    """Builds synthetic telebot Message objects with unique message ids."""
+
+    def __init__(self) -> None:
+        self._next_id: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def __call__(self, text: str, user_id: int, chat_id: int = CHAT_ID) -> telebot.types.Message:
+        with self._lock:
+            self._next_id += 1
+            message_id: int = self._next_id
+        return telebot.types.Message.de_json({
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Зимний сад"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Участник {user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        })
+
+def chat_ids(chats: int) -> List[int]:
+    """Returns the ids of the benchmark gardens."""
+    return [CHAT_ID - i for i in range(chats)]
+
+def prefill(users: int, flowers: int, chats: int, seed: int) -> None:
+    """Fills the temporary database with `users` users having `flowers` flowers each, spread over `chats` gardens."""
+    rng: random.Random = random.Random(seed)
+    gardens: List[int] = chat_ids(chats)
+    conn = db.get_connection()
+    conn.executemany(
+        'INSERT INTO users (chat_id, season, user_id, name, stitches) VALUES (?, 1, ?, ?, ?)',
+        [(gardens[user_id % chats], user_id, f"Участник {user_id}", flowers * 500 + rng.randint(0, 499))
+         for user_id in range(1, users + 1)],
+    )
+    conn.executemany(
+        'INSERT INTO user_flower_counts (chat_id, season, user_id, flower_name, count) VALUES (?, 1, ?, ?, ?)',
+        [(gardens[user_id % chats], user_id, flower, count)
+         for user_id in range(1, users + 1) for flower, count in sample_flowers(0, flowers, rng).items()],
+    )
+    conn.commit()
+    db.backfill_bouquets()
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index: int = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parses 'add=0.8,top=0.15,backup=0.05' into normalized weights."""
+    weights: Dict[str, float] = {}
+    for item in mix.split(','):
+        command, _, weight = item.partition('=')
+        weights[command.strip()] = float(weight)
+    total: float = sum(weights.values())
+    return {command: weight / total for command, weight in weights.items()}
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs one benchmark and returns the result document."""
+    workdir: str = tempfile.mkdtemp(prefix="garden-bench-")
+    db.DB_NAME = os.path.join(workdir, "garden.db")
+    migrations.init_db()
+    prefill(args.users, args.flowers, args.chats, args.seed)
+    gardens: List[int] = chat_ids(args.chats)
+    os.environ["ALLOWED_CHAT_IDS"] = ",".join(str(chat_id) for chat_id in gardens)
+
+    from handlers.add import register_add_handler
+    from handlers.top import register_top_handler
+    from handlers.me import register_me_handler
+    from handlers.backup import register_backup_handler
+
+    bot: StubBot = StubBot()
+    register_add_handler(bot)
+    register_top_handler(bot)
+    register_me_handler(bot)
+    register_backup_handler(bot)
+
+    mix: Dict[str, float] = parse_mix(args.mix)
+    unknown: List[str] = [command for command in mix if command not in bot.handlers]
+    if unknown:
+        raise SystemExit(f"Неизвестные команды в --mix: {unknown}")
+
+    rng: random.Random = random.Random(args.seed)
+    make_message: MessageFactory = MessageFactory()
+    plan: List[Tuple[str, telebot.types.Message]] = []
+    for _ in range(args.ops):
+        command: str = rng.choices(list(mix), weights=list(mix.values()))[0]
+        user_id: int = rng.randint(1, max(1, args.users))
+        text: str = f"/add {rng.randint(1, 1500)}" if command == "add" else f"/{command}"
+        plan.append((command, make_message(text, user_id, gardens[user_id % args.chats])))
+
+    latencies: Dict[str, List[float]] = {command: [] for command in mix}
+    latencies_lock: threading.Lock = threading.Lock()
+    cursor: List[int] = [0]
+
+    def sender() -> None:
+        while True:
+            with latencies_lock:
+                if cursor[0] >= len(plan):
+                    return
+                command, message = plan[cursor[0]]
+                cursor[0] += 1
+            started: float = time.perf_counter()
+            bot.handlers[command](message)
+            elapsed: float = time.perf_counter() - started
+            with latencies_lock:
+                latencies[command].append(elapsed)
+
+    threads: List[threading.Thread] = [threading.Thread(target=sender) for _ in range(args.senders)]
+    started: float = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall: float = time.perf_counter() - started
+
+    results: Dict[str, Dict[str, float]] = {}
+    for command, values in latencies.items():
+        values.sort()
+        results[command] = {
+            "count": len(values),
+            "throughput_per_s": len(values) / wall if wall else 0.0,
+            "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+            "p50_ms": 1000 * percentile(values, 0.50),
+            "p95_ms": 1000 * percentile(values, 0.95),
+            "p99_ms": 1000 * percentile(values, 0.99),
+        }
+
+    db.close_connections()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "out")},
+        "wall_s": wall,
+        "total_throughput_per_s": args.ops / wall if wall else 0.0,
+        "sends": bot.sends,
+        "results": results,
+    }
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(document: Dict[str, Any], baseline: Dict[str, Any] | None = None) -> None:
+    """Prints the results, with the relative change against `baseline` if given."""
+    print(f"commit {document['commit']}, {document['params']}")
+    print(f"всего: {document['total_throughput_per_s']:.1f} оп/с за {document['wall_s']:.2f} с")
+    print(f"{'команда':<8} {'кол-во':>7} {'оп/с':>9} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    for command, stats in document["results"].items():
+        line: str = (f"/{command:<7} {stats['count']:>7} {stats['throughput_per_s']:>9.1f} "
+                     f"{stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f}")
+        old: Dict[str, float] | None = (baseline or {}).get("results", {}).get(command)
+        if old and old["p50_ms"]:
+            line += f"   p50 {100 * (stats['p50_ms'] / old['p50_ms'] - 1):+.1f}% к {baseline['commit']}"
+        print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк обработчиков и слоя базы данных.")
+    parser.add_argument("--users", type=int, default=1000, help="число участников в базе")
+    parser.add_argument("--flowers", type=int, default=10, help="цветочков у каждого участника")
+    parser.add_argument("--chats", type=int, default=1, help="число садов, между которыми делятся участники")
+    parser.add_argument("--senders", type=int, default=4, help="число параллельных отправителей")
+    parser.add_argument("--ops", type=int, default=2000, help="сколько команд выполнить")
+    parser.add_argument("--mix", default="add=0.8,top=0.15,backup=0.05", help="доли команд")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"), help="каталог для JSON-результатов")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    # Журнал обработчиков не должен засорять вывод бенчмарка
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    document: Dict[str, Any] = run(args)
+    baseline: Dict[str, Any] | None = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_report(document, baseline)
+
+    os.makedirs(args.out, exist_ok=True)
+    path: str = os.path.join(args.out, f"{document['timestamp'].replace(':', '')}-{document['commit']}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""Local stand-in for the Telegram Bot API, for end-to-end load tests without Telegram.
+
+Implements getMe, getUpdates, setWebhook, deleteWebhook, sendMessage and sendDocument well
+enough for the bot from main.py: point TELEGRAM_API_URL at it and the whole polling (or
+webhook) and sending path runs offline. Every request can be delayed by a configurable
+latency, and a share of the sends can be answered with 429 and a retry_after. Updates are
+queued with FakeBotApi.enqueue, or generated by ChatTraffic at a given rate:
+
+    python bench/fake_bot_api.py --port 8081 --rate 50 --users 500 --chats 5
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} ALLOWED_CHAT_IDS=-1000000000001,... python main.py
+
+bench/replay_e2e.py runs both and measures end-to-end command latency.
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+CHAT_ID: int = -1000000000001
+# Сколько доставок webhook идут одновременно, если setWebhook не задал max_connections (как у Telegram)
+WEBHOOK_CONNECTIONS: int = 40
+# Пауза перед повтором доставки webhook, на которую сервер бота ответил ошибкой
+WEBHOOK_RETRY_DELAY: float = 1.0
+
+# Наблюдатель за отправками: (метод, chat_id, текст или None для документа, время по time.monotonic())
+SendObserver = Callable[[str, int, str | None, float], None]
+
+class FakeBotApi:
+    """Threaded HTTP server that answers Bot API calls from in-memory state.
+
+    Updates wait in a list until getUpdates confirms them by asking for a higher offset, as
+    in Telegram; once a webhook is set they are POSTed to it instead (getUpdates then fails
+    with 409) and redelivered after a delay while the bot answers with an error.
+    """
+
+    def __init__(self, host: str, port: int, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_429: float = 0.0, retry_after: int = 1, seed: int = 1,
+                 on_send: SendObserver | None = None) -> None:
+        """Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on; 0 picks a free one (see `url`).
+            latency_ms (float): Delay added to every request.
+            jitter_ms (float): Random extra delay of up to this much.
+            rate_429 (float): The share of sendMessage/sendDocument calls answered with 429.
+            retry_after (int): The retry_after, in seconds, of those answers.
+            seed (int): Seed for the jitter and the 429 draws.
+            on_send (SendObserver | None): Called for every accepted send.
+        """
+        self.latency: float = latency_ms / 1000
+        self.jitter: float = jitter_ms / 1000
+        self.rate_429: float = rate_429
+        self.retry_after: int = retry_after
+        self.on_send: SendObserver | None = on_send
+        self.ready: threading.Event = threading.Event()  # первый getUpdates или setWebhook с адресом
+        self.counters: Dict[str, int] = {}
+        self._rng: random.Random = random.Random(seed)
+        self._cond: threading.Condition = threading.Condition()
+        self._updates: List[Dict[str, Any]] = []
+        self._next_update_id: int = 1
+        self._next_message_id: int = 1
+        self._webhook: Tuple[str, str] | None = None  # (адрес, секрет)
+        self._deliveries: queue.Queue[Dict[str, Any]] = queue.Queue()
+        self._delivery_threads: List[threading.Thread] = []
+        self._closed: bool = False
+        self._httpd: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """The API_URL template for telebot, e.g. http://127.0.0.1:8081/bot{0}/{1}."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self) -> None:
+        """Serves requests on a background thread."""
+        threading.Thread(target=self._httpd.serve_forever, name="fake-bot-api", daemon=True).start()
+
+    def close(self) -> None:
+        """Stops the server and releases waiting getUpdates calls."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def enqueue(self, message: Dict[str, Any]) -> int:
+        """Queues an update carrying `message`.
+
+        Args:
+            message (Dict[str, Any]): The message JSON; message_id is filled in if missing.
+
+        Returns:
+            int: The update_id.
+        """
+        with self._cond:
+            update_id: int = self._next_update_id
+            self._next_update_id += 1
+            if "message_id" not in message:
+                message["message_id"] = self._next_message_id
+                self._next_message_id += 1
+            update: Dict[str, Any] = {"update_id": update_id, "message": message}
+            if self._webhook is None:
+                self._updates.append(update)
+                self._cond.notify_all()
+                return update_id
+        self._deliveries.put(update)
+        return update_id
+
+    def pending(self) -> int:
+        """Returns the number of updates not yet confirmed or delivered."""
+        with self._cond:
+            return len(self._updates) + self._deliveries.unfinished_tasks
+
+    def _count(self, name: str) -> None:
+        with self._cond:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _delay(self) -> None:
+        delay: float = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    # ---------------- Методы Bot API ----------------
+
+    def get_me(self, token: str, params: Dict[str, str]) -> Any:
+        return {"id": int(token.split(":", 1)[0]), "is_bot": True, "first_name": "Зимний сад", "username": "fake_garden_bot"}
+
+    def get_updates(self, token: str, params: Dict[str, str]) -> Any:
+        offset: int = int(params.get("offset") or 0)
+        limit: int = min(100, int(params.get("limit") or 100))
+        deadline: float = time.monotonic() + float(params.get("timeout") or 0)
+        self.ready.set()
+        with self._cond:
+            if self._webhook is not None:
+                raise _ApiError(409, "Conflict: can't use getUpdates method while webhook is active")
+            # Запрос с offset подтверждает все обновления до него
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and not self._closed:
+                left: float = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            return self._updates[:limit]
+
+    def set_webhook(self, token: str, params: Dict[str, str]) -> Any:
+        url: str = params.get("url", "")
+        with self._cond:
+            if not url:
+                self._webhook = None
+                return True
+            self._webhook = (url, params.get("secret_token", ""))
+            backlog, self._updates = self._updates, []
+            connections: int = int(params.get("max_connections") or WEBHOOK_CONNECTIONS)
+            while len(self._delivery_threads) < connections:
+                thread: threading.Thread = threading.Thread(target=self._deliver, name="fake-webhook", daemon=True)
+                thread.start()
+                self._delivery_threads.append(thread)
+        for update in backlog:
+            self._deliveries.put(update)
+        self.ready.set()
+        return True
+
+    def delete_webhook(self, token: str, params: Dict[str, str]) -> Any:
+        return self.set_webhook(token, {})
+
+    def send_message(self, token: str, params: Dict[str, str]) -> Any:
+        return self._send("sendMessage", token, params, {"text": params.get("text", "")})
+
+    def send_document(self, token: str, params: Dict[str, str]) -> Any:
+        name: str = params.get("_file_name", "document")
+        return self._send("sendDocument", token, params, {"document": {
+            "file_id": f"fake-{name}", "file_unique_id": f"fake-{name}", "file_name": name,
+            "file_size": int(params.get("_file_size", 0)),
+        }})
+
+    def _send(self, method: str, token: str, params: Dict[str, str], content: Dict[str, Any]) -> Any:
+        if self.rate_429 and self._rng.random() < self.rate_429:
+            raise _ApiError(429, f"Too Many Requests: retry after {self.retry_after}",
+                            {"retry_after": self.retry_after})
+        chat_id: int = int(params["chat_id"])
+        with self._cond:
+            message_id: int = self._next_message_id
+            self._next_message_id += 1
+        if self.on_send is not None:
+            self.on_send(method, chat_id, content.get("text"), time.monotonic())
+        return {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup"},
+            "from": self.get_me(token, params), **content,
+        }
+
+    def _deliver(self) -> None:
+        """Webhook delivery loop: POSTs queued updates to the bot until it accepts them."""
+        while True:
+            update: Dict[str, Any] = self._deliveries.get()
+            try:
+                with self._cond:
+                    webhook: Tuple[str, str] | None = self._webhook
+                    if webhook is None:
+                        # Webhook сняли: обновление снова ждёт getUpdates
+                        self._updates.append(update)
+                        self._updates.sort(key=lambda item: item["update_id"])
+                        self._cond.notify_all()
+                        continue
+                url, secret = webhook
+                request: urllib.request.Request = urllib.request.Request(
+                    url, data=json.dumps(update).encode(), method="POST",
+                    headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+                )
+                try:
+                    with urllib.request.urlopen(request, timeout=10):
+                        pass
+                    self._count("webhook_delivered")
+                except (urllib.error.URLError, OSError, ValueError):
+                    # Как Telegram: неподтверждённое обновление доставляется снова
+                    self._count("webhook_retries")
+                    time.sleep(WEBHOOK_RETRY_DELAY)
+                    self._deliveries.put(update)
+            finally:
+                self._deliveries.task_done()
+
+    def _make_request_handler(self) -> type:
+        """Builds the request handler class bound to this server."""
+        server: FakeBotApi = self
+        methods: Dict[str, Callable[[str, Dict[str, str]], Any]] = {
+            "getme": self.get_me, "getupdates": self.get_updates, "setwebhook": self.set_webhook,
+            "deletewebhook": self.delete_webhook, "sendmessage": self.send_message,
+            "senddocument": self.send_document,
+        }
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у api.telegram.org
+            # Заголовки и тело уходят отдельными write: без этого Nagle и отложенный ACK добавляют 40 мс к вызову
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                self._handle()
+
+            def do_POST(self) -> None:
+                self._handle()
+
+            def _handle(self) -> None:
+                url: urllib.parse.SplitResult = urllib.parse.urlsplit(self.path)
+                params: Dict[str, str] = dict(urllib.parse.parse_qsl(url.query))
+                params.update(self._read_body())
+                prefix, _, method = url.path[1:].partition("/")
+                token: str = prefix[3:] if prefix.startswith("bot") else ""
+                server._delay()
+                handler: Callable[[str, Dict[str, str]], Any] | None = methods.get(method.lower())
+                server._count(method or "?")
+                if handler is None or ":" not in token:
+                    self._respond(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                try:
+                    self._respond(200, {"ok": True, "result": handler(token, params)})
+                except _ApiError as e:
+                    server._count(f"{method}_{e.code}")
+                    document: Dict[str, Any] = {"ok": False, "error_code": e.code, "description": e.description}
+                    if e.parameters:
+                        document["parameters"] = e.parameters
+                    self._respond(e.code, document)
+                except (KeyError, ValueError) as e:
+                    self._respond(400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"})
+
+            def _read_body(self) -> Dict[str, str]:
+                """Returns the form fields of the body; a file field is reported as _file_name and _file_size."""
+                length: int = int(self.headers.get("Content-Length") or 0)
+                if length <= 0:
+                    return {}
+                body: bytes = self.rfile.read(length)
+                content_type: str = self.headers.get("Content-Type", "")
+                if content_type.startswith("application/x-www-form-urlencoded"):
+                    return dict(urllib.parse.parse_qsl(body.decode()))
+                if content_type.startswith("application/json"):
+                    return {key: str(value) for key, value in json.loads(body).items()}
+                if not content_type.startswith("multipart/form-data"):
+                    return {}
+                fields: Dict[str, str] = {}
+                form = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode() + body
+                )
+                for part in form.iter_parts():
+                    payload: bytes = part.get_payload(decode=True) or b""
+                    if part.get_filename() is not None:
+                        fields["_file_name"] = part.get_filename()
+                        fields["_file_size"] = str(len(payload))
+                    else:
+                        fields[part.get_param("name", header="content-disposition")] = payload.decode()
+                return fields
+
+            def _respond(self, status: int, document: Dict[str, Any]) -> None:
+                body: bytes = json.dumps(document, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # бот закрыл соединение, не дождавшись ответа (например, при остановке)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return RequestHandler
+
+class _ApiError(Exception):
+    """An error answer of the Bot API."""
+
+    def __init__(self, code: int, description: str, parameters: Dict[str, Any] | None = None) -> None:
+        super().__init__(description)
+        self.code: int = code
+        self.description: str = description
+        self.parameters: Dict[str, Any] | None = parameters
+
+class ChatTraffic:
+    """Generates chat traffic resembling a real garden: a few regulars write most of the
+    commands (user activity follows a Zipf law), and messages arrive as a Poisson process.
+    """
+
+    def __init__(self, users: int, chats: int, mix: Dict[str, float], admin_id: int, seed: int = 1,
+                 zipf: float = 1.1) -> None:
+        """Args:
+            users (int): The number of distinct participants.
+            chats (int): The number of gardens they are spread over.
+            mix (Dict[str, float]): Command weights, e.g. {"add": 0.8, "top": 0.1, "me": 0.1}.
+            admin_id (int): The user who sends /backup, which only the admin may use.
+            seed (int): The random seed.
+            zipf (float): The Zipf exponent of user activity; 0 makes everyone equally active.
+        """
+        self.users: int = users
+        self.chats: List[int] = [CHAT_ID - i for i in range(chats)]
+        self.admin_id: int = admin_id
+        self._commands: List[str] = list(mix)
+        self._weights: List[float] = list(mix.values())
+        self._rng: random.Random = random.Random(seed)
+        self._activity: List[float] = [1 / rank ** zipf for rank in range(1, users + 1)]
+
+    def next(self) -> Tuple[str, int, int, Dict[str, Any]]:
+        """Returns the next (command, chat_id, user_id, message JSON)."""
+        command: str = self._rng.choices(self._commands, weights=self._weights)[0]
+        user_id: int = self.admin_id if command == "backup" else \
+            self._rng.choices(range(1, self.users + 1), weights=self._activity)[0]
+        # /backup работает только в основном саду
+        chat_id: int = self.chats[0] if command == "backup" else self.chats[user_id % len(self.chats)]
+        text: str = f"/add {self._rng.randint(1, 1500)}" if command == "add" else f"/{command}"
+        return command, chat_id, user_id, {
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Зимний сад"},
+            "from": {"id": user_id, "is_bot": False, "first_name": user_name(user_id)},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        }
+
+    def pause(self, rate: float) -> float:
+        """Returns the exponentially distributed gap before the next message at `rate` messages per second."""
+        return self._rng.expovariate(rate)
+
+def user_name(user_id: int) -> str:
+    """Returns the first name given to a generated participant."""
+    return f"Участник {user_id}"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API для нагрузочных тестов.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждого запроса")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля отправок, отклоняемых с 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--rate", type=float, default=0.0, help="сообщений в секунду от ChatTraffic (0 — не генерировать)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=1)
+    parser.add_argument("--admin-id", type=int, default=1)
+    parser.add_argument("--mix", default="add=0.8,top=0.1,me=0.1", help="доли команд")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sends: List[int] = [0]
+    api: FakeBotApi = FakeBotApi(args.host, args.port, args.latency_ms, args.jitter_ms, args.rate_429,
+                                 args.retry_after, args.seed, on_send=lambda *_: sends.__setitem__(0, sends[0] + 1))
+    api.start()
+    print(f"Bot API: TELEGRAM_API_URL={api.url}")
+    print(f"Сады: ALLOWED_CHAT_IDS={','.join(str(CHAT_ID - i) for i in range(args.chats))}")
+    mix: Dict[str, float] = {command: float(weight) for command, _, weight in
+                             (item.partition("=") for item in args.mix.split(","))}
+    traffic: ChatTraffic = ChatTraffic(args.users, args.chats, mix, args.admin_id, args.seed)
+    try:
+        next_report: float = time.monotonic() + 5
+        while True:
+            if args.rate > 0:
+                api.enqueue(traffic.next()[3])
+                time.sleep(traffic.pause(args.rate))
+            else:
+                time.sleep(1)
+            if time.monotonic() >= next_report:
+                next_report += 5
+                print(f"ожидают доставки: {api.pending()}, отправок: {sends[0]}, вызовы: {api.counters}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""End-to-end load replay: the whole bot from main.py against the local fake Bot API.
+
+Starts bench/fake_bot_api.py in this process and main.py as a subprocess pointed at it via
+TELEGRAM_API_URL, replays generated chat traffic at a given rate, and matches the bot's
+sends back to the commands they answer. Reports end-to-end latency per command (from the
+update becoming available to getUpdates or the webhook, to the reply reaching the API)
+and the number of sends per second the bot sustained:
+
+    python bench/replay_e2e.py --ops 3000 --rate 100 --users 2000 --chats 10 --latency-ms 30
+    python bench/replay_e2e.py --mode webhook --rate-429 0.02 --env OUTBOX_GLOBAL_RATE=100
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from bench_handlers import ROOT, percentile, parse_mix, _git_commit
+from fake_bot_api import FakeBotApi, ChatTraffic, user_name
+from messages import M
+
+TOKEN: str = "123456:offline-e2e"
+ADMIN_ID: int = 1
+# Сколько ждать, пока бот начнёт опрашивать API или зарегистрирует webhook
+STARTUP_TIMEOUT: float = 30.0
+
+# Начало ответа, по которому он узнаётся среди отправок в чат, для команд с именем участника в ответе
+_MARKERS: Dict[str, str] = {
+    "add": M["add_success"].partition("{stitches}")[0],
+    "me": M["me_rank"].partition("{rank}")[0],
+}
+
+class ReplyTracker:
+    """Matches the bot's sends to the commands waiting for a reply in each chat.
+
+    Replies that name their sender (/add, /me) are matched by name, which also finds each
+    part of a message the outbox coalesced from several /add replies. Any other text answers
+    the oldest waiting command without such a marker (/top, /start), or else the oldest
+    waiting command of the chat; a document answers the oldest waiting /backup.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.sends: List[float] = []
+        self._waiting: Dict[int, List[Tuple[str, int, float]]] = {}  # чат -> (команда, участник, время)
+        self._lock: threading.Lock = threading.Lock()
+
+    def expect(self, command: str, chat_id: int, user_id: int, created: float) -> None:
+        with self._lock:
+            self._waiting.setdefault(chat_id, []).append((command, user_id, created))
+            self.latencies.setdefault(command, [])
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return sum(len(waiting) for waiting in self._waiting.values())
+
+    def unanswered(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for waiting in self._waiting.values():
+                for command, _, _ in waiting:
+                    counts[command] = counts.get(command, 0) + 1
+            return counts
+
+    def on_send(self, method: str, chat_id: int, text: str | None, now: float) -> None:
+        with self._lock:
+            self.sends.append(now)
+            waiting: List[Tuple[str, int, float]] = self._waiting.get(chat_id, [])
+            answered: List[int] = []
+            if text is None:
+                answered = [index for index, item in enumerate(waiting) if item[0] == "backup"][:1]
+            else:
+                found: Dict[str, int] = {}
+                for index, (command, user_id, _) in enumerate(waiting):
+                    marker: str | None = _MARKERS.get(command)
+                    if marker is None:
+                        continue
+                    marker = marker.format(name=user_name(user_id))
+                    if found.setdefault(marker, text.count(marker)) > 0:
+                        found[marker] -= 1
+                        answered.append(index)
+                if not answered:
+                    answered = [index for index, item in enumerate(waiting) if item[0] not in _MARKERS][:1] or \
+                        ([0] if waiting else [])
+            for index in reversed(answered):
+                command, _, created = waiting.pop(index)
+                self.latencies[command].append(now - created)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs one replay and returns the result document."""
+    workdir: str = tempfile.mkdtemp(prefix="garden-e2e-")
+    tracker: ReplyTracker = ReplyTracker()
+    api: FakeBotApi = FakeBotApi("127.0.0.1", 0, args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after,
+                                 args.seed, on_send=tracker.on_send)
+    api.start()
+    traffic: ChatTraffic = ChatTraffic(args.users, args.chats, parse_mix(args.mix), ADMIN_ID, args.seed)
+
+    env: Dict[str, str] = dict(
+        os.environ, TOKEN=TOKEN, ADMIN_ID=str(ADMIN_ID), ALLOWED_CHAT_ID=str(traffic.chats[0]),
+        ALLOWED_CHAT_IDS=",".join(str(chat_id) for chat_id in traffic.chats), TELEGRAM_API_URL=api.url,
+        UPDATE_MODE=args.mode, LOG_FILE=os.path.join(workdir, "bot.log"), LOG_CONSOLE_LEVEL="ERROR",
+        METRICS_PORT="0", SNAPSHOT_INTERVAL="0",
+    )
+    if args.mode == "webhook":
+        port: int = _free_port()
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{port}/telegram", WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(port))
+    env.update(item.split("=", 1) for item in args.env)
+
+    with open(os.path.join(workdir, "stderr.txt"), "wb") as stderr:
+        process: subprocess.Popen = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=workdir,
+                                                     env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+    try:
+        deadline: float = time.monotonic() + STARTUP_TIMEOUT
+        while not api.ready.wait(0.1):
+            if process.poll() is not None or time.monotonic() > deadline:
+                with open(os.path.join(workdir, "stderr.txt"), encoding="utf-8", errors="replace") as file:
+                    raise SystemExit(f"Бот не запустился (код {process.poll()}):\n{file.read()[-3000:]}")
+
+        started: float = time.monotonic()
+        next_at: float = started
+        for _ in range(args.ops):
+            command, chat_id, user_id, message = traffic.next()
+            now: float = time.monotonic()
+            if next_at > now:
+                time.sleep(next_at - now)
+            tracker.expect(command, chat_id, user_id, time.monotonic())
+            api.enqueue(message)
+            next_at += traffic.pause(args.rate)
+        offered: float = time.monotonic() - started
+
+        deadline = time.monotonic() + args.drain
+        while tracker.outstanding() and time.monotonic() < deadline and process.poll() is None:
+            time.sleep(0.05)
+        wall: float = time.monotonic() - started
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)  # KeyboardInterrupt: бот дошлёт очередь и закроет базу
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        api.close()
+
+    results: Dict[str, Dict[str, float]] = {}
+    unanswered: Dict[str, int] = tracker.unanswered()
+    for command, values in tracker.latencies.items():
+        values.sort()
+        results[command] = {
+            "count": len(values) + unanswered.get(command, 0),
+            "answered": len(values),
+            "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+            "p50_ms": 1000 * percentile(values, 0.50),
+            "p95_ms": 1000 * percentile(values, 0.95),
+            "p99_ms": 1000 * percentile(values, 0.99),
+        }
+    sends: List[float] = tracker.sends
+    send_span: float = sends[-1] - sends[0] if len(sends) > 1 else 0.0
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "out", "keep")},
+        "offered_per_s": args.ops / offered if offered else 0.0,
+        "wall_s": wall,
+        "sends": len(sends),
+        "sends_per_s": (len(sends) - 1) / send_span if send_span else 0.0,
+        "rejected_429": sum(count for name, count in api.counters.items() if name.endswith("_429")),
+        "api_calls": dict(api.counters),
+        "workdir": workdir if args.keep else None,
+        "results": results,
+    }
+
+def print_report(document: Dict[str, Any], baseline: Dict[str, Any] | None = None) -> None:
+    """Prints the results, with the relative change against `baseline` if given."""
+    print(f"commit {document['commit']}, {document['params']}")
+    print(f"подано: {document['offered_per_s']:.1f} команд/с; отправок: {document['sends']}, "
+          f"{document['sends_per_s']:.1f}/с; отклонено с 429: {document['rejected_429']}")
+    print(f"{'команда':<8} {'кол-во':>7} {'ответов':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    for command, stats in document["results"].items():
+        line: str = (f"/{command:<7} {stats['count']:>7} {stats['answered']:>8} "
+                     f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+        old: Dict[str, float] | None = (baseline or {}).get("results", {}).get(command)
+        if old and old["p50_ms"]:
+            line += f"   p50 {100 * (stats['p50_ms'] / old['p50_ms'] - 1):+.1f}% к {baseline['commit']}"
+        print(line)
+    if document["workdir"]:
+        print(f"База и журнал бота: {document['workdir']}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный прогон бота на локальной замене Bot API.")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling", help="UPDATE_MODE бота")
+    parser.add_argument("--ops", type=int, default=2000, help="сколько команд отправить")
+    parser.add_argument("--rate", type=float, default=50.0, help="команд в секунду (пуассоновский поток)")
+    parser.add_argument("--users", type=int, default=1000, help="число участников")
+    parser.add_argument("--chats", type=int, default=5, help="число садов")
+    parser.add_argument("--mix", default="add=0.8,top=0.1,me=0.1", help="доли команд")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждого запроса к API")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля отправок, отклоняемых с 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--drain", type=float, default=60.0, help="сколько ждать оставшиеся ответы, с")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="переменная окружения бота")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="не удалять каталог с базой и журналом бота")
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"), help="каталог для JSON-результатов")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    document: Dict[str, Any] = run(args)
+    baseline: Dict[str, Any] | None = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_report(document, baseline)
+
+    os.makedirs(args.out, exist_ok=True)
+    path: str = os.path.join(args.out, f"e2e-{document['timestamp'].replace(':', '')}-{document['commit']}.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from typing import Any, Callable
+from typing import Any, Callable, FrozenSet
 
 """Configuration settings for the Winter Garden Telegram Bot.
 
@@ -9,6 +9,16 @@ This module loads environment variables for sensitive data and configurable para
 
 load_dotenv()
 
+def _to_bool(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(value)
+
+def _to_int_set(value: str) -> FrozenSet[int]:
+    return frozenset(int(item) for item in value.replace(' ', '').split(',') if item)
+
 def _get_env_variable(key: str, default: Any = None, type_cast: Callable = str) -> Any:
     value = os.getenv(key)
     if value is None and default is None:
@@ -21,6 +31,107 @@ def _get_env_variable(key: str, default: Any = None, type_cast: Callable = str)
         raise ValueError(f"Не удалось преобразовать переменную окружения '{key}' ('{value}') к типу {type_cast.__name__}.")
 
 TOKEN: str = _get_env_variable("TOKEN")
-ALLOWED_CHAT_ID: int = _get_env_variable("ALLOWED_CHAT_ID", type_cast=int)
+# Чаты-сады, которые обслуживает бот. ALLOWED_CHAT_ID — сад, которому принадлежат данные
+# из базы времён одного сада; ALLOWED_CHAT_IDS — остальные сады через запятую
+ALLOWED_CHAT_ID: int = _get_env_variable("ALLOWED_CHAT_ID", default=0, type_cast=int)
+ALLOWED_CHAT_IDS: FrozenSet[int] = _get_env_variable("ALLOWED_CHAT_IDS", default=frozenset(), type_cast=_to_int_set) \
+    | ({ALLOWED_CHAT_ID} if ALLOWED_CHAT_ID else set())
+if not ALLOWED_CHAT_IDS:
+    raise ValueError("Переменная окружения 'ALLOWED_CHAT_ID' или 'ALLOWED_CHAT_IDS' не установлена.")
 ADMIN_ID: int = _get_env_variable("ADMIN_ID", type_cast=int)
-FLOWER_THRESHOLD: int = _get_env_variable("FLOWER_THRESHOLD", default=500, type_cast=int)
+FLOWER_THRESHOLD: int = _get_env_variable("FLOWER_THRESHOLD", default=500, type_cast=int)  # если у сада нет своего в chat_settings
+if FLOWER_THRESHOLD < 1:
+    raise ValueError(f"FLOWER_THRESHOLD должен быть не меньше 1, получено {FLOWER_THRESHOLD}.")
+# Вести ли журнал выдачи цветочков (user_flowers); букеты считаются по счётчикам и без него
+FLOWER_AWARD_LOG: bool = _get_env_variable("FLOWER_AWARD_LOG", default=True, type_cast=_to_bool)
+# Вести ли журнал добавлений крестиков (stitch_events) со сводками по дням и неделям для /stats garden
+STITCH_EVENT_LOG: bool = _get_env_variable("STITCH_EVENT_LOG", default=True, type_cast=_to_bool)
+# Смещение от UTC в часах, по которому сводки делят добавления на дни (3 — московское время)
+STATS_UTC_OFFSET: float = _get_env_variable("STATS_UTC_OFFSET", default=3.0, type_cast=float)
+
+# Защита от повторной обработки сообщений: "memory" или "sqlite" (переживает перезапуск)
+DEDUP_BACKEND: str = _get_env_variable("DEDUP_BACKEND", default="memory")
+DEDUP_CAPACITY: int = _get_env_variable("DEDUP_CAPACITY", default=10000, type_cast=int)
+DEDUP_TTL: float = _get_env_variable("DEDUP_TTL", default=86400.0, type_cast=float)
+
+# Режим работы: "sync" — telebot.TeleBot с пулом потоков, "async" — AsyncTeleBot на asyncio
+BOT_MODE: str = _get_env_variable("BOT_MODE", default="sync")
+
+# Получение обновлений: "polling" — long polling, "webhook" — встроенный HTTP-сервер
+UPDATE_MODE: str = _get_env_variable("UPDATE_MODE", default="polling")
+WEBHOOK_URL: str = _get_env_variable("WEBHOOK_URL", default="")  # публичный HTTPS-адрес, например https://bot.example.org/telegram
+WEBHOOK_LISTEN: str = _get_env_variable("WEBHOOK_LISTEN", default="0.0.0.0")
+WEBHOOK_PORT: int = _get_env_variable("WEBHOOK_PORT", default=8080, type_cast=int)
+WEBHOOK_SECRET: str = _get_env_variable("WEBHOOK_SECRET", default="")
+WEBHOOK_QUEUE_SIZE: int = _get_env_variable("WEBHOOK_QUEUE_SIZE", default=1000, type_cast=int)
+WEBHOOK_WORKERS: int = _get_env_variable("WEBHOOK_WORKERS", default=4, type_cast=int)
+# Адрес Bot API в формате telebot, например http://127.0.0.1:8081/bot{0}/{1} — собственный сервер
+# Bot API или bench/fake_bot_api.py; пустой — api.telegram.org
+TELEGRAM_API_URL: str = _get_env_variable("TELEGRAM_API_URL", default="")
+
+# Отложенная запись /add: пачка коммитится раз в WRITE_BEHIND_MAX_DELAY_MS мс или по WRITE_BEHIND_MAX_BATCH операций
+WRITE_BEHIND: bool = _get_env_variable("WRITE_BEHIND", default=False, type_cast=_to_bool)
+WRITE_BEHIND_MAX_BATCH: int = _get_env_variable("WRITE_BEHIND_MAX_BATCH", default=100, type_cast=int)
+WRITE_BEHIND_MAX_DELAY_MS: int = _get_env_variable("WRITE_BEHIND_MAX_DELAY_MS", default=20, type_cast=int)
+if WRITE_BEHIND and BOT_MODE == "async":
+    # Асинхронные обработчики работают с базой через общий DB_EXECUTOR, а ожидание пачки
+    # отложенной записи занимало бы его потоки и под нагрузкой останавливало все запросы к базе
+    raise ValueError("WRITE_BEHIND поддерживается только с BOT_MODE=sync.")
+
+# Формат /backup (csv, jsonl или wgb) и сжатие gzip
+BACKUP_FORMAT: str = _get_env_variable("BACKUP_FORMAT", default="csv")
+BACKUP_GZIP: bool = _get_env_variable("BACKUP_GZIP", default=False, type_cast=_to_bool)
+
+# Снимки базы через SQLite backup API; SNAPSHOT_INTERVAL в минутах, 0 — отключено
+SNAPSHOT_DIR: str = _get_env_variable("SNAPSHOT_DIR", default="snapshots")
+SNAPSHOT_INTERVAL: int = _get_env_variable("SNAPSHOT_INTERVAL", default=0, type_cast=int)
+SNAPSHOT_KEEP: int = _get_env_variable("SNAPSHOT_KEEP", default=24, type_cast=int)
+SNAPSHOT_GZIP: bool = _get_env_variable("SNAPSHOT_GZIP", default=False, type_cast=_to_bool)
+
+# Замеры времени обработчиков, запросов к базе и к Telegram (/stats); METRICS_PORT — порт
+# Prometheus-эндпоинта /metrics на localhost, 0 — отключён
+METRICS_ENABLED: bool = _get_env_variable("METRICS_ENABLED", default=True, type_cast=_to_bool)
+METRICS_PORT: int = _get_env_variable("METRICS_PORT", default=0, type_cast=int)
+
+# Очередь исходящих сообщений с учётом лимитов Telegram: OUTBOX_CHAT_RATE сообщений в минуту
+# на чат (до OUTBOX_CHAT_BURST подряд), OUTBOX_GLOBAL_RATE в секунду на всего бота;
+# OUTBOX_COALESCE объединяет ожидающие ответы на /add в одном чате в одно сообщение.
+# При WORKERS > 1 у каждого воркера своя очередь и доля 1/WORKERS от этих лимитов; подряд в один
+# чат при этом может уйти до max(OUTBOX_CHAT_BURST, WORKERS) сообщений
+OUTBOX_ENABLED: bool = _get_env_variable("OUTBOX_ENABLED", default=True, type_cast=_to_bool)
+OUTBOX_CHAT_RATE: float = _get_env_variable("OUTBOX_CHAT_RATE", default=20.0, type_cast=float)
+OUTBOX_CHAT_BURST: int = _get_env_variable("OUTBOX_CHAT_BURST", default=3, type_cast=int)
+OUTBOX_GLOBAL_RATE: float = _get_env_variable("OUTBOX_GLOBAL_RATE", default=30.0, type_cast=float)
+OUTBOX_COALESCE: bool = _get_env_variable("OUTBOX_COALESCE", default=True, type_cast=_to_bool)
+
+# Пакетные заполнения данных после миграций: строк на транзакцию и пауза между пачками в мс
+BACKFILL_BATCH_SIZE: int = _get_env_variable("BACKFILL_BATCH_SIZE", default=500, type_cast=int)
+BACKFILL_PAUSE_MS: int = _get_env_variable("BACKFILL_PAUSE_MS", default=50, type_cast=int)
+
+# Журнал: JSON-строки в LOG_FILE пишет фоновый поток; в консоль — записи от LOG_CONSOLE_LEVEL.
+# LOG_QUEUE_SIZE — сколько записей ждёт записи, лишние отбрасываются и считаются в /stats;
+# LOG_EVENT_RATE — сколько записей в секунду пропускать для каждого шумного события (повторы и т. п.)
+LOG_FILE: str = _get_env_variable("LOG_FILE", default="bot.log")
+LOG_LEVEL: str = _get_env_variable("LOG_LEVEL", default="INFO")
+LOG_CONSOLE_LEVEL: str = _get_env_variable("LOG_CONSOLE_LEVEL", default="INFO")
+LOG_ROTATION_MB: int = _get_env_variable("LOG_ROTATION_MB", default=5, type_cast=int)
+LOG_QUEUE_SIZE: int = _get_env_variable("LOG_QUEUE_SIZE", default=10000, type_cast=int)
+LOG_EVENT_RATE: int = _get_env_variable("LOG_EVENT_RATE", default=5, type_cast=int)
+
+# Несколько процессов над одной базой. WORKERS > 1 (только с UPDATE_MODE=webhook) — принимающий
+# процесс раздаёт обновления WORKERS процессам-воркерам, все обновления одного участника попадают
+# в один воркер. SHARED_DB — база общая с другими экземплярами бота (например, несколько контейнеров
+# за балансировщиком): кэши сезонов и порогов не используются, а лидерборды раз в
+# LEADERBOARD_SYNC_MS мс подтягивают изменения других процессов.
+WORKERS: int = _get_env_variable("WORKERS", default=1, type_cast=int)
+SHARED_DB: bool = _get_env_variable("SHARED_DB", default=False, type_cast=_to_bool) or WORKERS > 1
+LEADERBOARD_SYNC_MS: int = _get_env_variable("LEADERBOARD_SYNC_MS", default=1000, type_cast=int)
+if SHARED_DB and DEDUP_BACKEND != "sqlite":
+    # Повторная доставка может прийти в другой процесс, поэтому отметки об обработке должны быть в базе
+    raise ValueError("При WORKERS > 1 или SHARED_DB нужно DEDUP_BACKEND=sqlite.")
+
+# Опрос Telegram (UPDATE_MODE=polling, BOT_MODE=sync): обновлений за один getUpdates (до 100),
+# тайм-аут long polling в секундах и сколько участников обрабатываются параллельно
+POLL_BATCH_SIZE: int = _get_env_variable("POLL_BATCH_SIZE", default=100, type_cast=int)
+POLL_TIMEOUT: int = _get_env_variable("POLL_TIMEOUT", default=60, type_cast=int)
+POLL_WORKERS: int = _get_env_variable("POLL_WORKERS", default=8, type_cast=int)
@@ -1,230 +1,1229 @@
+import asyncio
+import contextvars
+import datetime
+import functools
+import re
 import sqlite3
-from typing import Callable, Any, Tuple, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from typing import Callable, Any, Dict, Iterator, Tuple, List, NamedTuple
+from flowers import ALL_FLOWERS, sample_flowers, render_bouquet
+from leaderboard import LeaderboardCache, LeaderboardRow
+import metrics
+from metrics import METRICS
+
+UserKey = Tuple[int, int, int]  # (chat_id, season, user_id)
+
+# Запросы используют UPSERT с RETURNING (SQLite 3.35+) и iif() (3.32+)
+MIN_SQLITE_VERSION: Tuple[int, int, int] = (3, 35, 0)
+if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+    raise SystemExit(f"Нужен SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} или новее, "
+                     f"у Python {sqlite3.sqlite_version}. Обновите образ или сборку Python.")
 
 DB_NAME: str = 'garden.db'
+DB_TIMEOUT: float = 30.0
+DB_CACHED_STATEMENTS: int = 256
+# Писать ли журнал выдачи цветочков (user_flowers); счётчики в user_flower_counts ведутся всегда
+FLOWER_AWARD_LOG: bool = True
+# Писать ли журнал stitch_events и сводки по дням и неделям для /stats garden
+STITCH_EVENT_LOG: bool = True
+# Смещение от UTC в часах, по которому добавления относятся к дням сводок (по умолчанию московское время)
+STATS_UTC_OFFSET: float = 3.0
+# В базу пишут и другие процессы (см. enable_shared_mode): кэши процесса сверяются с базой
+SHARED: bool = False
+
+# Одно долгоживущее соединение на поток: telebot обрабатывает апдейты в пуле потоков,
+# а sqlite3.Connection нельзя разделять между потоками.
+_local: threading.local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock: threading.Lock = threading.Lock()
+
+# Пишущие транзакции процесса выстраиваются в очередь на этой блокировке, а не крутятся
+# в busy-ожидании SQLite с растущими паузами; время ожидания попадает в метрики.
+_WRITE_LOCK: threading.Lock = threading.Lock()
+# Пишущий оператор может стоять и после общих табличных выражений: WITH ... INSERT/UPDATE/DELETE
+_WRITE_STATEMENT: re.Pattern = re.compile(
+    r'\s*(?:WITH\b.*?\b)?(INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP|BEGIN\s+IMMEDIATE)\b',
+    re.IGNORECASE | re.DOTALL
+)
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that counts statements and takes the process write lock before the first write."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        super().__init__(conn)
+        self.queries: int = 0
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        self.queries += 1
+        if not _local.write_locked and _WRITE_STATEMENT.match(sql):
+            _acquire_write_lock()
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> sqlite3.Cursor:
+        self.queries += 1
+        if not _local.write_locked and _WRITE_STATEMENT.match(sql):
+            _acquire_write_lock()
+        return super().executemany(sql, seq_of_parameters)
+
+def _acquire_write_lock() -> None:
+    """Takes the process write lock for the rest of the current transaction."""
+    started: float = time.perf_counter()
+    _WRITE_LOCK.acquire()
+    _local.write_locked = True
+    if metrics.ENABLED:
+        METRICS.observe("db_lock_wait_seconds", _local.function, time.perf_counter() - started)
+
+def _open_connection() -> sqlite3.Connection:
+    """Opens a new connection to DB_NAME and applies the connection pragmas.
+
+    Returns:
+        sqlite3.Connection: The configured connection.
+    """
+    # check_same_thread=False только ради close_connections при выходе: в работе
+    # соединением пользуется лишь поток-владелец
+    conn: sqlite3.Connection = sqlite3.connect(
+        DB_NAME, timeout=DB_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False
+    )
+    # WAL позволяет читать (/top, /backup) параллельно с записью,
+    # а synchronous=NORMAL в режиме WAL не делает fsync на каждый коммит.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+def get_connection() -> sqlite3.Connection:
+    """Returns the connection owned by the current thread, opening it on first use.
+
+    The connection is reopened if DB_NAME has changed since it was created.
+
+    Returns:
+        sqlite3.Connection: The connection for the current thread.
+    """
+    conn: sqlite3.Connection | None = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'db_name', None) != DB_NAME:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.db_name = DB_NAME
+        _local.depth = 0
+        _local.after_commit = []
+        _local.write_locked = False
+        _local.function = ""
+    return conn
+
+def close_connections() -> None:
+    """Closes every connection opened by this module, e.g. on shutdown."""
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    _local.__dict__.clear()
+
+# Пул для асинхронного режима: все обращения к базе из корутин идут через него,
+# каждый поток пула держит своё соединение.
+DB_EXECUTOR_WORKERS: int = 4
+DB_EXECUTOR: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+async def run_db(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Runs a blocking database function on DB_EXECUTOR without blocking the event loop.
+
+    Args:
+        func (Callable): The function to call, e.g. one decorated with with_db_connection.
+        *args (Any): Positional arguments for the function.
+        **kwargs (Any): Keyword arguments for the function.
+
+    Returns:
+        Any: The function's result.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    # Переносим contextvars, чтобы записи журнала из пула сохраняли поля обработчика (handler, chat_id, user_id)
+    context: contextvars.Context = contextvars.copy_context()
+    return await loop.run_in_executor(DB_EXECUTOR, functools.partial(context.run, func, *args, **kwargs))
+
+def _after_commit(callback: Callable[[], None]) -> None:
+    """Schedules a callback to run once the current transaction has been committed.
+
+    Callbacks are dropped if the transaction is rolled back.
+
+    Args:
+        callback (Callable[[], None]): The function to call after commit.
+    """
+    _local.after_commit.append(callback)
+
+def _begin_immediate(c: sqlite3.Cursor, conn: sqlite3.Connection) -> None:
+    """In shared mode, opens the transaction with BEGIN IMMEDIATE unless one is already open.
+
+    The database write lock is then held from the first statement, so reads made before
+    the first write (the current season, a processed-message check) cannot be changed
+    by another process before the transaction commits.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+    """
+    if SHARED and not conn.in_transaction:
+        c.execute('BEGIN IMMEDIATE')
 
 def with_db_connection(func: Callable) -> Callable:
     """Decorator to manage database connection for a function.
 
+    The wrapped function receives the cursor and the long-lived connection of the
+    current thread. The outermost decorated call commits on success and rolls back
+    on error; nested decorated calls join the outer transaction. Callbacks registered
+    with _after_commit run after the outermost commit, still under the write lock; an
+    error in one is logged and does not fail the call, whose data is already stored.
+
+    Each call is timed and its statements counted in metrics.METRICS; the first
+    write statement of a transaction waits for the process write lock, and that wait
+    is recorded as lock-wait time.
+
     Args:
         func (Callable): The function to wrap.
 
     Returns:
         Callable: The wrapped function.
     """
+    name: str = func.__name__
+
+    @functools.wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> Any:
-        conn: sqlite3.Connection = sqlite3.connect(DB_NAME)
-        cursor: sqlite3.Cursor = conn.cursor()
+        conn: sqlite3.Connection = get_connection()
+        cursor: _InstrumentedCursor = conn.cursor(_InstrumentedCursor)
+        outermost: bool = _local.depth == 0
+        if outermost:
+            _local.function = name
+        _local.depth += 1
+        started: float = time.perf_counter()
+        committed: bool = False
         try:
             result: Any = func(cursor, conn, *args, **kwargs)
-            conn.commit()
-            return result
+            if outermost:
+                conn.commit()
+                committed = True
         except Exception as e:
-            conn.rollback()
+            if outermost:
+                conn.rollback()
+                _local.after_commit = []
             raise e
         finally:
-            conn.close()
+            _local.depth -= 1
+            cursor.close()
+            if committed:
+                # Под блокировкой записи, чтобы кэши обновлялись в порядке коммитов
+                _run_after_commit()
+            if outermost and _local.write_locked:
+                _local.write_locked = False
+                _WRITE_LOCK.release()
+            if metrics.ENABLED:
+                METRICS.observe("db_call_seconds", name, time.perf_counter() - started)
+                METRICS.increment("db_queries", name, cursor.queries)
+        return result
     return wrapper
 
+def _run_after_commit() -> None:
+    """Runs the callbacks of the transaction that has just been committed.
+
+    The data is already stored, so a failing callback is only logged: the caller still gets
+    its result and the remaining callbacks still run.
+    """
+    callbacks: List[Callable[[], None]] = _local.after_commit
+    _local.after_commit = []
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error("Ошибка в обработчике после коммита {callback}: {error}", callback=callback, error=e,
+                         exc_info=True)
+
+def _load_flower_counts(c: sqlite3.Cursor, chat_id: int, season: int, user_id: int) -> Dict[str, int]:
+    """Reads a user's per-flower counters for one season.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        chat_id (int): The ID of the chat.
+        season (int): The season.
+        user_id (int): The ID of the user.
+
+    Returns:
+        Dict[str, int]: The number of each flower the user has.
+    """
+    c.execute('SELECT flower_name, count FROM user_flower_counts WHERE chat_id = ? AND season = ? AND user_id = ?',
+              (chat_id, season, user_id))
+    return dict(c.fetchall())
+
+def _load_all_flower_counts(c: sqlite3.Cursor) -> Dict[UserKey, Dict[str, int]]:
+    """Reads the per-flower counters of every user in every season, keyed by (chat_id, season, user_id)."""
+    counts: Dict[UserKey, Dict[str, int]] = {}
+    c.execute('SELECT chat_id, season, user_id, flower_name, count FROM user_flower_counts')
+    for chat_id, season, user_id, flower_name, count in c:
+        counts.setdefault((chat_id, season, user_id), {})[flower_name] = count
+    return counts
+
+# Сколько участников пересчитывает одна транзакция фонового заполнения букетов
+BACKFILL_BATCH_SIZE: int = 500
+# Ключ, меньший любого (chat_id, season, user_id)
+_FIRST_KEY: UserKey = (-2 ** 63, -2 ** 63, -2 ** 63)
+
+@with_db_connection
+def backfill_bouquets_batch(c: sqlite3.Cursor, conn: sqlite3.Connection, after: UserKey | None,
+                            batch_size: int = BACKFILL_BATCH_SIZE) -> Tuple[UserKey | None, int]:
+    """Rebuilds users.flower_count and users.bouquet from user_flower_counts for one batch of users.
+
+    Users are walked in (chat_id, season, user_id) order, so a backfill can stop after any batch
+    and resume from the returned key. A row that an award rewrote after it was read here
+    is left alone: the award has already rendered it from the current counters.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        after (UserKey | None): The (chat_id, season, user_id) the previous batch ended at; None to start.
+        batch_size (int): How many users to look at.
+
+    Returns:
+        Tuple[UserKey | None, int]: The key to resume from (None once every user is done)
+        and the number of users updated.
+    """
+    start: UserKey = tuple(after or _FIRST_KEY)
+    c.execute('''SELECT chat_id, season, user_id, flower_count, bouquet FROM users
+                 WHERE (chat_id, season, user_id) > (?, ?, ?)
+                 ORDER BY chat_id, season, user_id LIMIT ?''', (*start, batch_size))
+    users: List[Tuple[int, int, int, int, str]] = c.fetchall()
+    if not users:
+        return None, 0
+    end: UserKey = users[-1][:3]
+    counts: Dict[UserKey, Dict[str, int]] = {}
+    c.execute('''SELECT chat_id, season, user_id, flower_name, count FROM user_flower_counts
+                 WHERE (chat_id, season, user_id) > (?, ?, ?) AND (chat_id, season, user_id) <= (?, ?, ?)''',
+              (*start, *end))
+    for chat_id, season, user_id, flower_name, count in c:
+        counts.setdefault((chat_id, season, user_id), {})[flower_name] = count
+
+    updates: List[Tuple[int, str, int, int, int, int, str]] = []
+    for chat_id, season, user_id, flower_count, bouquet in users:
+        user_counts: Dict[str, int] = counts.get((chat_id, season, user_id), {})
+        new_count: int = sum(user_counts.values())
+        new_bouquet: str = render_bouquet(user_counts)
+        if (new_count, new_bouquet) != (flower_count, bouquet):
+            updates.append((new_count, new_bouquet, chat_id, season, user_id, flower_count, bouquet))
+    c.executemany('''UPDATE users SET flower_count = ?, bouquet = ?, updated_at = CURRENT_TIMESTAMP
+                     WHERE chat_id = ? AND season = ? AND user_id = ? AND flower_count = ? AND bouquet = ?''',
+                  updates)
+    for chat_id in {update[2] for update in updates}:
+        _after_commit(functools.partial(LEADERBOARDS.invalidate, chat_id))
+    return (end if len(users) == batch_size else None), len(updates)
+
+def backfill_bouquets(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Rebuilds users.flower_count and users.bouquet from user_flower_counts, in every chat.
+
+    Each batch is committed separately, so the bot keeps serving while this runs.
+
+    Args:
+        batch_size (int): How many users to look at per transaction.
+
+    Returns:
+        int: The number of users updated.
+    """
+    after: UserKey | None = None
+    total: int = 0
+    while True:
+        after, updated = backfill_bouquets_batch(after, batch_size)
+        total += updated
+        if after is None:
+            return total
+
+@with_db_connection
+def check_bouquet_consistency(c: sqlite3.Cursor, conn: sqlite3.Connection) -> List[UserKey]:
+    """Finds users whose denormalized flower_count or bouquet disagrees with user_flower_counts.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+
+    Returns:
+        List[UserKey]: (chat_id, season, user_id) of the inconsistent users; empty if everything matches.
+    """
+    counts: Dict[UserKey, Dict[str, int]] = _load_all_flower_counts(c)
+    c.execute('SELECT chat_id, season, user_id, flower_count, bouquet FROM users ORDER BY chat_id, season, user_id')
+    return [
+        (chat_id, season, user_id) for chat_id, season, user_id, flower_count, bouquet in c.fetchall()
+        if flower_count != sum(counts.get((chat_id, season, user_id), {}).values())
+        or bouquet != render_bouquet(counts.get((chat_id, season, user_id), {}))
+    ]
+
+# Текущий сезон каждого сада: читается почти каждым запросом, меняется только при /reset
+_seasons: Dict[int, int] = {}
+
+@with_db_connection
+def _load_season(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int) -> int:
+    c.execute('SELECT season FROM chat_settings WHERE chat_id = ?', (chat_id,))
+    result: Tuple[int] | None = c.fetchone()
+    return result[0] if result else 1
+
+def get_season(chat_id: int) -> int:
+    """Returns the number of a chat's current season; every garden starts in season 1.
+
+    Args:
+        chat_id (int): The ID of the chat.
+
+    Returns:
+        int: The current season.
+    """
+    season: int | None = _seasons.get(chat_id)
+    if season is None or SHARED:
+        # Сезон мог сменить другой процесс: тогда и лидерборд чата устарел
+        loaded: int = _load_season(chat_id)
+        if season is not None and loaded != season:
+            LEADERBOARDS.invalidate(chat_id)
+        season = _seasons[chat_id] = loaded
+    return season
+
 @with_db_connection
-def init_db(c: sqlite3.Cursor, conn: sqlite3.Connection) -> None:
-    """Initializes the database by creating the users and user_flowers tables.
-    Adds an index to the users table.
+def start_new_season(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int,
+                     message: Tuple[int, int] | None = None) -> int | None:
+    """Archives a chat's current season and switches the garden to a new, empty one.
+
+    Runs in constant time: the old season's rows stay where they are and remain
+    available to get_top_users and get_all_time_top; only the chat's season number changes.
+    With `message` the /reset message is marked as processed in the same transaction, so a
+    redelivered /reset starts only one season, as apply_stitch_delta does for /add.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        message (Tuple[int, int] | None): The (chat_id, message_id) of the /reset message, which may
+            come from another chat than the garden, to record as processed.
+
+    Returns:
+        int | None: The number of the new season, or None if the message had already been processed.
     """
-    # Создаем или изменяем таблицу users
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        name TEXT,
-        stitches INTEGER DEFAULT 0,
-        caterpillars INTEGER DEFAULT 0
-    )''')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_stitches ON users (stitches DESC)')
+    _begin_immediate(c, conn)
+    if message is not None and not mark_message_processed(*message):
+        return None
+    c.execute('''INSERT INTO chat_settings (chat_id, season) VALUES (?, 2)
+                 ON CONFLICT (chat_id) DO UPDATE SET season = season + 1
+                 RETURNING season''', (chat_id,))
+    season: int = c.fetchone()[0]
+    c.execute('INSERT INTO seasons (chat_id, season, ended_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+              (chat_id, season - 1))
+
+    def switch() -> None:
+        _seasons[chat_id] = season
+        LEADERBOARDS.clear(chat_id)
+
+    _after_commit(switch)
+    return season
+
+@with_db_connection
+def get_seasons(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int) -> List[Tuple[int, str]]:
+    """Lists a chat's archived seasons.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
 
-    # Создаем таблицу user_flowers
-    c.execute('''CREATE TABLE IF NOT EXISTS user_flowers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        flower_name TEXT NOT NULL,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-    )''')
+    Returns:
+        List[Tuple[int, str]]: (season, ended_at) for each finished season, oldest first.
+    """
+    c.execute('SELECT season, ended_at FROM seasons WHERE chat_id = ? ORDER BY season', (chat_id,))
+    return c.fetchall()
 
 @with_db_connection
-def add_user(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int, name: str) -> None:
-    """Adds a new user to the database if they don't already exist.
+def add_user(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int, name: str) -> None:
+    """Adds a new user to the current season of a chat's garden if they don't already exist.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
         name (str): The name of the user.
     """
-    c.execute('INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)', (user_id, name))
+    season: int = get_season(chat_id)
+    c.execute('''INSERT INTO users (chat_id, season, user_id, name, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                 ON CONFLICT (chat_id, season, user_id) DO NOTHING
+                 RETURNING name, stitches, bouquet''', (chat_id, season, user_id, name))
+    _refresh_leaderboard(chat_id, season, user_id, c.fetchone())
 
 @with_db_connection
-def update_stitches(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int, amount: int) -> None:
+def update_stitches(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int, amount: int) -> None:
     """Updates the number of stitches for a user.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
         amount (int): The amount of stitches to add.
     """
-    c.execute('UPDATE users SET stitches = stitches + ? WHERE user_id = ?', (amount, user_id))
+    season: int = get_season(chat_id)
+    c.execute('''UPDATE users SET stitches = stitches + ?, updated_at = CURRENT_TIMESTAMP
+                 WHERE chat_id = ? AND season = ? AND user_id = ?
+                 RETURNING name, stitches, bouquet''', (amount, chat_id, season, user_id))
+    _refresh_leaderboard(chat_id, season, user_id, c.fetchone())
 
 @with_db_connection
-def subtract_stitches(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int, amount: int) -> None:
+def subtract_stitches(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int, amount: int) -> None:
     """Subtracts stitches from a user, ensuring the total doesn't go below zero.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
         amount (int): The amount of stitches to subtract.
     """
-    c.execute('UPDATE users SET stitches = MAX(stitches - ?, 0) WHERE user_id = ?', (amount, user_id))
+    season: int = get_season(chat_id)
+    c.execute('''UPDATE users SET stitches = MAX(stitches - ?, 0), updated_at = CURRENT_TIMESTAMP
+                 WHERE chat_id = ? AND season = ? AND user_id = ?
+                 RETURNING name, stitches, bouquet''', (amount, chat_id, season, user_id))
+    _refresh_leaderboard(chat_id, season, user_id, c.fetchone())
 
 @with_db_connection
-def get_user(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int) -> Tuple[str, int, int] | None:
-    """Retrieves user data by user ID.
+def get_user(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int) -> Tuple[str, int, int] | None:
+    """Retrieves user data for the current season by user ID.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
 
     Returns:
         Tuple[str, int, int] | None: A tuple containing (name, stitches, caterpillars) or None if user not found.
     """
-    c.execute('SELECT name, stitches, caterpillars FROM users WHERE user_id = ?', (user_id,))
+    c.execute('SELECT name, stitches, caterpillars FROM users WHERE chat_id = ? AND season = ? AND user_id = ?',
+              (chat_id, get_season(chat_id), user_id))
     result: Tuple[str, int, int] | None = c.fetchone()
     return result
 
+def _award_flowers(c: sqlite3.Cursor, chat_id: int, season: int, user_id: int,
+                   awarded: Dict[str, int]) -> Tuple[str, int, str] | None:
+    """Adds flowers to a user's counters, award log and denormalized bouquet.
+
+    Costs one statement per flower type, however many flowers are awarded.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        chat_id (int): The ID of the chat.
+        season (int): The season the flowers are awarded in.
+        user_id (int): The ID of the user.
+        awarded (Dict[str, int]): How many of each flower to add.
+
+    Returns:
+        Tuple[str, int, str] | None: The user's new (name, stitches, bouquet), or None if there is no such user.
+    """
+    rows: List[Tuple[int, int, int, str, int]] = [
+        (chat_id, season, user_id, flower, count) for flower, count in awarded.items()
+    ]
+    c.executemany('''INSERT INTO user_flower_counts (chat_id, season, user_id, flower_name, count) VALUES (?, ?, ?, ?, ?)
+                     ON CONFLICT (chat_id, season, user_id, flower_name) DO UPDATE SET count = count + excluded.count''',
+                  rows)
+    if FLOWER_AWARD_LOG:
+        c.executemany('''INSERT INTO user_flowers (chat_id, season, user_id, flower_name, quantity)
+                         VALUES (?, ?, ?, ?, ?)''', rows)
+    counts: Dict[str, int] = _load_flower_counts(c, chat_id, season, user_id)
+    # flower_count берётся из счётчиков, а не прибавляется: так он верен и у ещё не пересчитанных участников
+    c.execute('''UPDATE users SET flower_count = ?, bouquet = ?, updated_at = CURRENT_TIMESTAMP
+                 WHERE chat_id = ? AND season = ? AND user_id = ?
+                 RETURNING name, stitches, bouquet''',
+              (sum(counts.values()), render_bouquet(counts), chat_id, season, user_id))
+    return c.fetchone()
+
 @with_db_connection
-def add_flower_to_user(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int, flower_name: str) -> None:
-    """Adds a new flower to a user's collection.
+def add_flower_to_user(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int,
+                       flower_name: str) -> None:
+    """Adds a new flower to a user's collection and to their denormalized bouquet.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
         flower_name (str): The name of the flower to add.
     """
-    c.execute('INSERT INTO user_flowers (user_id, flower_name) VALUES (?, ?)', (user_id, flower_name))
+    season: int = get_season(chat_id)
+    _refresh_leaderboard(chat_id, season, user_id, _award_flowers(c, chat_id, season, user_id, {flower_name: 1}))
 
 @with_db_connection
-def get_user_flowers_list(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int) -> List[str]:
-    """Retrieves all flower names for a specific user.
+def get_flower_counts(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int) -> Dict[str, int]:
+    """Retrieves how many of each flower a user has in the current season.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
 
     Returns:
-        List[str]: A list of flower names.
+        Dict[str, int]: The number of each flower; flowers the user does not have are absent.
     """
-    c.execute('SELECT flower_name FROM user_flowers WHERE user_id = ?', (user_id,))
-    results: List[Tuple[str]] = c.fetchall()
-    return [row[0] for row in results]
+    return _load_flower_counts(c, chat_id, get_season(chat_id), user_id)
 
-@with_db_connection
-def reset_all(c: sqlite3.Cursor, conn: sqlite3.Connection) -> None:
-    """Deletes all user data and flower data from the database.
+def get_user_flowers_list(chat_id: int, user_id: int) -> List[str]:
+    """Retrieves all flower names for a specific user, grouped in ALL_FLOWERS order.
 
     Args:
-        c (sqlite3.Cursor): The database cursor.
-        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        user_id (int): The ID of the user.
+
+    Returns:
+        List[str]: A list of flower names.
     """
-    c.execute('DELETE FROM users')
-    c.execute('DELETE FROM user_flowers')
+    counts: Dict[str, int] = get_flower_counts(chat_id, user_id)
+    return [flower for flower in ALL_FLOWERS for _ in range(counts.get(flower, 0))]
 
 @with_db_connection
-def get_all_users(c: sqlite3.Cursor, conn: sqlite3.Connection) -> List[Tuple[Any, ...]]:
-    """Retrieves all users from the database.
+def get_all_users(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int) -> List[Tuple[Any, ...]]:
+    """Retrieves all users of the current season of a chat's garden.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
 
     Returns:
         List[Tuple[Any, ...]]: A list of tuples, each representing a user.
     """
     # Эта функция теперь возвращает данные без цветов, так как цветы в отдельной таблице
-    c.execute('SELECT user_id, name, stitches, caterpillars FROM users ORDER BY rowid ASC')
+    c.execute('''SELECT user_id, name, stitches, caterpillars FROM users WHERE chat_id = ? AND season = ?
+                 ORDER BY rowid ASC''', (chat_id, get_season(chat_id)))
     result: List[Tuple[Any, ...]] = c.fetchall()
     return result
 
 @with_db_connection
-def get_top_users(c: sqlite3.Cursor, conn: sqlite3.Connection, limit: int = 10) -> List[Tuple[str, int, str]]:
-    """Retrieves the top users based on stitches, including their concatenated flowers.
+def get_top_users(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int,
+                  limit: int = 10, season: int | None = None) -> List[Tuple[str, int, str]]:
+    """Retrieves the top users of a chat's season based on stitches, including their bouquets.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         limit (int): The maximum number of top users to retrieve.
+        season (int | None): The season, or None for the current one.
 
     Returns:
         List[Tuple[str, int, str]]: A list of tuples, each containing (name, stitches, flowers_string).
     """
-    # Запрос для получения топа пользователей и их цветов
-    c.execute('''SELECT u.name, u.stitches, GROUP_CONCAT(uf.flower_name, ' ') AS flowers_string
-                  FROM users u
-                  LEFT JOIN user_flowers uf ON u.user_id = uf.user_id
-                  GROUP BY u.user_id
-                  ORDER BY u.stitches DESC LIMIT ?''', (limit,))
+    # Букет хранится прямо в users, поэтому хватает прохода по idx_users_season_stitches
+    c.execute('''SELECT name, stitches, bouquet FROM users WHERE chat_id = ? AND season = ?
+                 ORDER BY stitches DESC LIMIT ?''', (chat_id, season or get_season(chat_id), limit))
     result: List[Tuple[str, int, str]] = c.fetchall()
     return result
 
 @with_db_connection
-def get_caterpillars(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int) -> int:
-    """Retrieves the number of caterpillars for a specific user.
+def get_all_time_top(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int,
+                     limit: int = 10) -> List[Tuple[str, int, str]]:
+    """Retrieves the top users of a chat over all seasons, with their bouquets summed across seasons.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        limit (int): The maximum number of top users to retrieve.
+
+    Returns:
+        List[Tuple[str, int, str]]: (name, total stitches, bouquet) tuples, best first.
+    """
+    # С единственным MAX() SQLite берёт name из строки последнего сезона участника
+    c.execute('''SELECT user_id, name, MAX(season), SUM(stitches) AS total FROM users WHERE chat_id = ?
+                 GROUP BY user_id ORDER BY total DESC LIMIT ?''', (chat_id, limit))
+    top: List[Tuple[int, str, int, int]] = c.fetchall()
+    counts: Dict[int, Dict[str, int]] = {}
+    c.execute(f'''SELECT user_id, flower_name, SUM(count) FROM user_flower_counts
+                  WHERE chat_id = ? AND user_id IN ({', '.join('?' * len(top))})
+                  GROUP BY user_id, flower_name''', (chat_id, *(row[0] for row in top)))
+    for user_id, flower_name, count in c:
+        counts.setdefault(user_id, {})[flower_name] = count
+    return [(name, total, render_bouquet(counts.get(user_id, {}))) for user_id, name, _, total in top]
+
+@with_db_connection
+def get_leaderboard_rows(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int) -> List[LeaderboardRow]:
+    """Retrieves every user of a chat's current season in the shape the in-memory leaderboard is warmed from.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+
+    Returns:
+        List[LeaderboardRow]: A list of (user_id, name, stitches, bouquet) tuples.
+    """
+    c.execute('SELECT user_id, name, stitches, bouquet FROM users WHERE chat_id = ? AND season = ?',
+              (chat_id, get_season(chat_id)))
+    result: List[LeaderboardRow] = c.fetchall()
+    return result
+
+# Запас при выборке изменений: updated_at с точностью до секунды, а транзакция другого процесса
+# может закоммитить строку чуть позже, чем был взят её updated_at
+LEADERBOARD_SYNC_OVERLAP: str = '-2 seconds'
+
+@with_db_connection
+def get_leaderboard_changes(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int,
+                            since: str | None) -> Tuple[str, List[LeaderboardRow]]:
+    """Retrieves the users of a chat's current season changed since a watermark, e.g. by other processes.
+
+    Rows changed shortly before `since` are returned again; applying them twice is harmless.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        since (str | None): The watermark returned by the previous call, or None to get only a watermark.
+
+    Returns:
+        Tuple[str, List[LeaderboardRow]]: The new watermark and the changed (user_id, name, stitches, bouquet) rows.
+    """
+    c.execute('SELECT CURRENT_TIMESTAMP')
+    watermark: str = c.fetchone()[0]
+    if since is None:
+        return watermark, []
+    c.execute('''SELECT user_id, name, stitches, bouquet FROM users
+                 WHERE chat_id = ? AND season = ? AND updated_at >= datetime(?, ?)''',
+              (chat_id, get_season(chat_id), since, LEADERBOARD_SYNC_OVERLAP))
+    return watermark, c.fetchall()
+
+# Лидерборды садов; в памяти держатся только недавно запрошенные
+LEADERBOARD_CACHE_SIZE: int = 64
+LEADERBOARDS: LeaderboardCache = LeaderboardCache(loader=get_leaderboard_rows, capacity=LEADERBOARD_CACHE_SIZE)
+
+def enable_shared_mode(sync_interval: float) -> None:
+    """Prepares the process for a database that other processes write to as well.
+
+    Write transactions start with BEGIN IMMEDIATE, the season and flower threshold are
+    read from the database on every use, and leaderboards catch up with other processes'
+    writes at most once per `sync_interval` seconds.
+
+    Args:
+        sync_interval (float): The staleness allowed for leaderboards, in seconds.
+    """
+    global SHARED
+    SHARED = True
+    LEADERBOARDS.follow(get_leaderboard_changes, sync_interval)
+
+def _refresh_leaderboard(chat_id: int, season: int, user_id: int, row: Tuple[str, int, str] | None) -> None:
+    """Pushes a user's (name, stitches, bouquet) to the chat's leaderboard once the transaction commits.
+
+    Args:
+        chat_id (int): The ID of the chat.
+        season (int): The season the row belongs to; rows of an archived season are not pushed.
+        user_id (int): The ID of the user.
+        row (Tuple[str, int, str] | None): The user's new state, or None if nothing changed.
+    """
+    if row is not None:
+        name, stitches, bouquet = row
+
+        def update() -> None:
+            if _seasons.get(chat_id) == season:
+                LEADERBOARDS.update(chat_id, user_id, name, stitches, bouquet)
+
+        _after_commit(update)
+
+@with_db_connection
+def get_caterpillars(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int) -> int:
+    """Retrieves the number of caterpillars for a specific user in the current season.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
 
     Returns:
         int: The number of caterpillars for the user, or 0 if not found.
     """
-    c.execute('SELECT caterpillars FROM users WHERE user_id = ?', (user_id,))
+    c.execute('SELECT caterpillars FROM users WHERE chat_id = ? AND season = ? AND user_id = ?',
+              (chat_id, get_season(chat_id), user_id))
     result: Tuple[int] | None = c.fetchone()
     return result[0] if result else 0
 
 @with_db_connection
-def increment_caterpillars(c: sqlite3.Cursor, conn: sqlite3.Connection, user_id: int) -> None:
+def increment_caterpillars(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int) -> None:
     """Increments the caterpillar count for a specific user.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
         user_id (int): The ID of the user.
     """
-    c.execute('UPDATE users SET caterpillars = caterpillars + 1 WHERE user_id = ?', (user_id,))
+    c.execute('''UPDATE users SET caterpillars = caterpillars + 1, updated_at = CURRENT_TIMESTAMP
+                 WHERE chat_id = ? AND season = ? AND user_id = ?''', (chat_id, get_season(chat_id), user_id))
 
 @with_db_connection
-def get_all_users_with_headers(c: sqlite3.Cursor, conn: sqlite3.Connection) -> Tuple[List[str], List[Tuple[Any, ...]]]:
-    """Retrieves all user data along with column headers.
+def get_all_users_with_headers(c: sqlite3.Cursor, conn: sqlite3.Connection,
+                               chat_id: int) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+    """Retrieves all user data of the current season of a chat's garden along with column headers.
 
     Args:
         c (sqlite3.Cursor): The database cursor.
         conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
 
     Returns:
         Tuple[List[str], List[Tuple[Any, ...]]]: A tuple containing a list of headers and a list of user data tuples.
     """
     # Для экспорта, объединяем данные пользователей и их цветы
-    c.execute('''SELECT u.user_id, u.name, u.stitches, u.caterpillars, GROUP_CONCAT(uf.flower_name, ' ') AS flowers_string
-                  FROM users u
-                  LEFT JOIN user_flowers uf ON u.user_id = uf.user_id
-                  GROUP BY u.user_id
-                  ORDER BY u.user_id ASC''')
+    c.execute('''SELECT user_id, name, stitches, caterpillars, bouquet AS flowers_string
+                  FROM users
+                  WHERE chat_id = ? AND season = ?
+                  ORDER BY user_id ASC''', (chat_id, get_season(chat_id)))
     rows: List[Tuple[Any, ...]] = c.fetchall()
     headers: List[str] = [description[0] for description in c.description]
-    return headers, rows
\ No newline at end of file
+    return headers, rows
+
+def _iter_query(query: str, params: Tuple[Any, ...], chunk_size: int) -> Tuple[List[str], Iterator[Tuple[Any, ...]]]:
+    """Runs a query on the current thread's connection and streams its rows.
+
+    Rows are fetched `chunk_size` at a time while the returned iterator is consumed,
+    so it should be consumed on this thread.
+
+    Args:
+        query (str): The SELECT statement.
+        params (Tuple[Any, ...]): The query parameters.
+        chunk_size (int): How many rows to fetch from SQLite at a time.
+
+    Returns:
+        Tuple[List[str], Iterator[Tuple[Any, ...]]]: The column headers and an iterator over the rows.
+    """
+    cursor: sqlite3.Cursor = get_connection().cursor()
+    cursor.execute(query, params)
+    headers: List[str] = [description[0] for description in cursor.description]
+
+    def rows() -> Iterator[Tuple[Any, ...]]:
+        try:
+            while chunk := cursor.fetchmany(chunk_size):
+                yield from chunk
+        finally:
+            cursor.close()
+
+    return headers, rows()
+
+def _scoped_where(chat_id: int | None, season: int | None, since: str | None,
+                  timestamp_column: str) -> Tuple[str, Tuple[Any, ...]]:
+    """Builds the WHERE clause of the export queries, with only the conditions that apply.
+
+    Args:
+        chat_id (int | None): The chat to restrict to, or None for every chat.
+        season (int | None): The season to restrict to, or None for every season.
+        since (str | None): The lower bound for `timestamp_column`, or None.
+        timestamp_column (str): The column compared with `since`.
+
+    Returns:
+        Tuple[str, Tuple[Any, ...]]: The clause (empty if there are no conditions) and its parameters.
+    """
+    conditions: List[str] = []
+    params: List[Any] = []
+    if chat_id is not None:
+        conditions.append('chat_id = ?')
+        params.append(chat_id)
+    if season is not None:
+        conditions.append('season = ?')
+        params.append(season)
+    if since is not None:
+        conditions.append(f'{timestamp_column} >= ?')
+        params.append(since)
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), tuple(params)
+
+def iter_all_users_with_headers(chat_id: int | None = None, since: str | None = None,
+                                chunk_size: int = 1000, season: int | None = None) -> Tuple[List[str], Iterator[Tuple[Any, ...]]]:
+    """Streams user data with their bouquets, without loading it all at once.
+
+    Args:
+        chat_id (int | None): The chat whose garden to stream, or None for every chat.
+        since (str | None): If given, only users with updated_at >= since (a CURRENT_TIMESTAMP string).
+        chunk_size (int): How many rows to fetch from SQLite at a time.
+        season (int | None): The season to stream, or None for every season.
+
+    Returns:
+        Tuple[List[str], Iterator[Tuple[Any, ...]]]: The column headers and an iterator over the rows.
+    """
+    columns: str = 'chat_id, season, user_id, name, stitches, caterpillars, bouquet AS flowers_string, updated_at'
+    where, params = _scoped_where(chat_id, season, since, 'updated_at')
+    return _iter_query(f'SELECT {columns} FROM users{where} ORDER BY chat_id, season, user_id', params, chunk_size)
+
+def iter_flowers_with_headers(chat_id: int | None = None, since: str | None = None,
+                              chunk_size: int = 1000) -> Tuple[List[str], Iterator[Tuple[Any, ...]]]:
+    """Streams the flower award log (user_flowers: one row per flower type per award), without loading it all at once.
+
+    Args:
+        chat_id (int | None): The chat whose flowers to stream, or None for every chat.
+        since (str | None): If given, only flowers with created_at >= since (a CURRENT_TIMESTAMP string).
+        chunk_size (int): How many rows to fetch from SQLite at a time.
+
+    Returns:
+        Tuple[List[str], Iterator[Tuple[Any, ...]]]: The column headers and an iterator over the rows.
+    """
+    where, params = _scoped_where(chat_id, None, since, 'created_at')
+    return _iter_query(f'''SELECT id, chat_id, season, user_id, flower_name, quantity, created_at
+                           FROM user_flowers{where} ORDER BY id''', params, chunk_size)
+
+@with_db_connection
+def get_db_timestamp(c: sqlite3.Cursor, conn: sqlite3.Connection) -> str:
+    """Returns SQLite's CURRENT_TIMESTAMP, in the same format as updated_at and created_at.
+
+    The time is read under the database write lock (BEGIN IMMEDIATE), so it also marks a
+    barrier between writes: every transaction that stamped a row earlier has committed and
+    is visible to reads started afterwards, and every later one stamps its rows with this
+    time or a later one.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+
+    Returns:
+        str: The current UTC time as 'YYYY-MM-DD HH:MM:SS'.
+    """
+    if not conn.in_transaction:
+        c.execute('BEGIN IMMEDIATE')
+    c.execute('SELECT CURRENT_TIMESTAMP')
+    return c.fetchone()[0]
+
+@with_db_connection
+def get_export_watermark(c: sqlite3.Cursor, conn: sqlite3.Connection, name: str) -> str | None:
+    """Retrieves the watermark of a named incremental export.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        name (str): The export name.
+
+    Returns:
+        str | None: The watermark, or None if the export has never run.
+    """
+    c.execute('SELECT watermark FROM export_state WHERE name = ?', (name,))
+    result: Tuple[str] | None = c.fetchone()
+    return result[0] if result else None
+
+@with_db_connection
+def set_export_watermark(c: sqlite3.Cursor, conn: sqlite3.Connection, name: str, watermark: str) -> None:
+    """Stores the watermark of a named incremental export.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        name (str): The export name.
+        watermark (str): The new watermark.
+    """
+    c.execute('''INSERT INTO export_state (name, watermark) VALUES (?, ?)
+                 ON CONFLICT (name) DO UPDATE SET watermark = excluded.watermark''', (name, watermark))
+
+@with_db_connection
+def get_update_offset(c: sqlite3.Cursor, conn: sqlite3.Connection, bot_id: int) -> int | None:
+    """Retrieves the last update_id up to which every update has been processed.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        bot_id (int): The ID of the bot (the numeric part of its token).
+
+    Returns:
+        int | None: The update_id, or None if the bot has never stored one.
+    """
+    c.execute('SELECT update_id FROM update_offsets WHERE bot_id = ?', (bot_id,))
+    result: Tuple[int] | None = c.fetchone()
+    return result[0] if result else None
+
+@with_db_connection
+def set_update_offset(c: sqlite3.Cursor, conn: sqlite3.Connection, bot_id: int, update_id: int) -> None:
+    """Stores the last update_id up to which every update has been processed; never moves it back.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        bot_id (int): The ID of the bot (the numeric part of its token).
+        update_id (int): The new offset.
+    """
+    c.execute('''INSERT INTO update_offsets (bot_id, update_id, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                 ON CONFLICT (bot_id) DO UPDATE SET update_id = MAX(update_id, excluded.update_id),
+                                                    updated_at = excluded.updated_at''', (bot_id, update_id))
+
+# Кэш порогов цветочков по чатам: читается на каждом /add, меняется редко
+_flower_thresholds: dict[int, int | None] = {}
+
+@with_db_connection
+def _load_flower_threshold(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int) -> int | None:
+    c.execute('SELECT flower_threshold FROM chat_settings WHERE chat_id = ?', (chat_id,))
+    result: Tuple[int | None] | None = c.fetchone()
+    return result[0] if result else None
+
+def get_flower_threshold(chat_id: int, default: int) -> int:
+    """Returns the number of stitches per flower in a chat's garden.
+
+    A stored value below 1, which set_flower_threshold refuses but an older version or a
+    manual edit may have left, is ignored like a missing one.
+
+    Args:
+        chat_id (int): The ID of the chat.
+        default (int): The value used when the chat has no valid setting of its own.
+
+    Returns:
+        int: The chat's flower threshold, at least 1 if `default` is.
+    """
+    if chat_id not in _flower_thresholds or SHARED:
+        _flower_thresholds[chat_id] = _load_flower_threshold(chat_id)
+    threshold: int | None = _flower_thresholds.get(chat_id)
+    if threshold is not None and threshold < 1:
+        logger.bind(event="bad_threshold").warning("Порог цветочков {threshold} в чате {chat_id} меньше 1, берём {default}.",
+                                                   threshold=threshold, chat_id=chat_id, default=default)
+        return default
+    return default if threshold is None else threshold
+
+@with_db_connection
+def set_flower_threshold(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, threshold: int | None) -> None:
+    """Stores a chat's number of stitches per flower.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        threshold (int | None): The new threshold, or None to fall back to the configured default.
+
+    Raises:
+        ValueError: If `threshold` is less than 1.
+    """
+    if threshold is not None and threshold < 1:
+        raise ValueError(f"Порог цветочков должен быть не меньше 1, получено {threshold}.")
+    c.execute('''INSERT INTO chat_settings (chat_id, flower_threshold) VALUES (?, ?)
+                 ON CONFLICT (chat_id) DO UPDATE SET flower_threshold = excluded.flower_threshold''',
+              (chat_id, threshold))
+    _after_commit(lambda: _flower_thresholds.pop(chat_id, None))
+
+def _activity_day() -> datetime.date:
+    """Returns the current day of the stitch rollups, in STATS_UTC_OFFSET."""
+    return (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=STATS_UTC_OFFSET)).date()
+
+def _update_streak(c: sqlite3.Cursor, chat_id: int, user_id: int, day: datetime.date) -> None:
+    """Extends the streak of consecutive active days of a member (user_id 0: the whole garden) to `day`."""
+    # В SET все выражения видят старую строку, поэтому новая длина серии повторяется в longest
+    c.execute('''INSERT INTO stitch_streaks (chat_id, user_id, last_day, current, longest) VALUES (?, ?, ?, 1, 1)
+                 ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                     current = CASE WHEN last_day = excluded.last_day THEN current
+                                    WHEN last_day = ? THEN current + 1 ELSE 1 END,
+                     longest = MAX(longest, CASE WHEN last_day = excluded.last_day THEN current
+                                                 WHEN last_day = ? THEN current + 1 ELSE 1 END),
+                     last_day = excluded.last_day''',
+              (chat_id, user_id, day.isoformat(), *[(day - datetime.timedelta(days=1)).isoformat()] * 2))
+
+def _record_stitch_event(c: sqlite3.Cursor, chat_id: int, season: int, user_id: int, amount: int,
+                         penalty: int) -> None:
+    """Appends an /add to stitch_events and folds it into the daily and weekly rollups.
+
+    Every statement is an UPSERT of one row by its primary key, so the cost does not grow
+    with the history; streaks are only touched by a member's first /add of the day.
+    """
+    day: datetime.date = _activity_day()
+    week: str = (day - datetime.timedelta(days=day.weekday())).isoformat()
+    caterpillars: int = 1 if penalty else 0
+    c.execute('INSERT INTO stitch_events (chat_id, season, user_id, amount, penalty) VALUES (?, ?, ?, ?, ?)',
+              (chat_id, season, user_id, amount, penalty))
+    c.execute('''INSERT INTO stitch_daily_members (chat_id, day, user_id, stitches, adds) VALUES (?, ?, ?, ?, 1)
+                 ON CONFLICT (chat_id, day, user_id) DO UPDATE SET stitches = stitches + excluded.stitches,
+                                                                   adds = adds + 1
+                 RETURNING adds''', (chat_id, day.isoformat(), user_id, amount))
+    first_today: bool = c.fetchone()[0] == 1
+    c.execute('''INSERT INTO stitch_daily (chat_id, day, stitches, adds, members, caterpillars) VALUES (?, ?, ?, 1, 1, ?)
+                 ON CONFLICT (chat_id, day) DO UPDATE SET stitches = stitches + excluded.stitches, adds = adds + 1,
+                                                          members = members + ?,
+                                                          caterpillars = caterpillars + excluded.caterpillars
+                 RETURNING stitches, adds''', (chat_id, day.isoformat(), amount, caterpillars, int(first_today)))
+    day_stitches, day_adds = c.fetchone()
+    c.execute('''INSERT INTO stitch_weekly (chat_id, week, stitches, adds, caterpillars) VALUES (?, ?, ?, 1, ?)
+                 ON CONFLICT (chat_id, week) DO UPDATE SET stitches = stitches + excluded.stitches, adds = adds + 1,
+                                                           caterpillars = caterpillars + excluded.caterpillars
+                 RETURNING stitches''', (chat_id, week, amount, caterpillars))
+    week_stitches: int = c.fetchone()[0]
+    c.execute('''INSERT INTO stitch_records (chat_id, best_day, best_day_stitches, best_week, best_week_stitches)
+                 VALUES (?, ?, ?, ?, ?)
+                 ON CONFLICT (chat_id) DO UPDATE SET
+                     best_day = iif(excluded.best_day_stitches > best_day_stitches, excluded.best_day, best_day),
+                     best_day_stitches = MAX(best_day_stitches, excluded.best_day_stitches),
+                     best_week = iif(excluded.best_week_stitches > best_week_stitches, excluded.best_week, best_week),
+                     best_week_stitches = MAX(best_week_stitches, excluded.best_week_stitches)
+                 WHERE excluded.best_day_stitches > best_day_stitches
+                    OR excluded.best_week_stitches > best_week_stitches''',
+              (chat_id, day.isoformat(), day_stitches, week, week_stitches))
+    if first_today:
+        _update_streak(c, chat_id, user_id, day)
+    if day_adds == 1:
+        _update_streak(c, chat_id, 0, day)
+
+class StitchDeltaResult(NamedTuple):
+    """Outcome of a single /add, as returned by apply_stitch_delta."""
+    stitches: int
+    new_flowers: Dict[str, int]
+    bouquet: str
+
+@with_db_connection
+def apply_stitch_delta(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, user_id: int, name: str,
+                       amount: int, penalty: int, flower_threshold: int,
+                       message_id: int | None = None) -> StitchDeltaResult | None:
+    """Applies one /add in a single transaction: creates the user if needed, subtracts the
+    caterpillar penalty, adds the stitches and awards the flowers that became due.
+
+    The UPSERT takes the write lock first, so concurrent calls for the same user are
+    serialized and cannot award the same flowers twice. With `message_id` the message is
+    marked as processed in the same transaction, so a redelivered update, even one handled
+    by another process, is applied exactly once.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat whose garden is updated.
+        user_id (int): The ID of the user.
+        name (str): The name of the user, used only when the user is created.
+        amount (int): The amount of stitches to add.
+        penalty (int): Stitches to subtract before adding (0 if no caterpillar), never going below zero.
+        flower_threshold (int): Number of stitches per flower.
+        message_id (int | None): The ID of the /add message within the chat, to record as processed.
+
+    Returns:
+        StitchDeltaResult | None: The new stitch total, the number of each flower awarded now and the
+            whole bouquet, or None if the message had already been processed.
+    """
+    _begin_immediate(c, conn)
+    if message_id is not None and not mark_message_processed(chat_id, message_id):
+        return None
+    season: int = get_season(chat_id)
+    c.execute('''INSERT INTO users (chat_id, season, user_id, name, stitches, updated_at)
+                 VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                 ON CONFLICT (chat_id, season, user_id) DO UPDATE SET stitches = MAX(stitches - ?, 0) + ?,
+                                                                      updated_at = CURRENT_TIMESTAMP
+                 RETURNING name, stitches, flower_count, bouquet''',
+              (chat_id, season, user_id, name, amount, penalty, amount))
+    stitches: int
+    flower_count: int
+    bouquet: str
+    name, stitches, flower_count, bouquet = c.fetchone()
+    if STITCH_EVENT_LOG:
+        _record_stitch_event(c, chat_id, season, user_id, amount, penalty)
+
+    # Все причитающиеся цветочки разыгрываются одним мультиномиальным броском
+    new_flowers: Dict[str, int] = sample_flowers(flower_count, max(0, stitches // flower_threshold - flower_count))
+    if new_flowers:
+        name, stitches, bouquet = _award_flowers(c, chat_id, season, user_id, new_flowers)
+
+    _refresh_leaderboard(chat_id, season, user_id, (name, stitches, bouquet))
+    return StitchDeltaResult(stitches, new_flowers, bouquet)
+
+@with_db_connection
+def apply_stitch_deltas(c: sqlite3.Cursor, conn: sqlite3.Connection,
+                        deltas: List[Tuple[int, int, str, int, int, int, int | None]]) -> List[StitchDeltaResult | None]:
+    """Applies several /add operations in one transaction, in order.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        deltas (List[Tuple[int, int, str, int, int, int, int | None]]): The apply_stitch_delta arguments
+            (chat_id, user_id, name, amount, penalty, flower_threshold, message_id) of each operation.
+
+    Returns:
+        List[StitchDeltaResult | None]: The result of each operation, in the same order.
+    """
+    # Вложенные вызовы присоединяются к этой транзакции, поэтому коммит (и fsync) один на всю пачку
+    return [apply_stitch_delta(*delta) for delta in deltas]
+
+@with_db_connection
+def mark_message_processed(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, message_id: int) -> bool:
+    """Records a message as processed.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        message_id (int): The ID of the message within the chat.
+
+    Returns:
+        bool: True if the message was recorded now, False if it had already been processed.
+    """
+    c.execute('INSERT OR IGNORE INTO processed_messages (chat_id, message_id, seen_at) VALUES (?, ?, ?)',
+              (chat_id, message_id, time.time()))
+    return c.rowcount == 1
+
+@with_db_connection
+def prune_processed_messages(c: sqlite3.Cursor, conn: sqlite3.Connection, ttl: float) -> int:
+    """Deletes processed-message records older than `ttl` seconds.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        ttl (float): The maximum age of a record, in seconds.
+
+    Returns:
+        int: The number of deleted records.
+    """
+    c.execute('DELETE FROM processed_messages WHERE seen_at < ?', (time.time() - ttl,))
+    return c.rowcount
+
+class GardenStats(NamedTuple):
+    """A garden's activity as read from the stitch rollups by get_garden_stats."""
+    today: str
+    daily: List[Tuple[str, int, int, int]]  # (день, крестики, добавления, участники) за последние дни, по порядку
+    weekly: List[Tuple[str, int, int]]  # (понедельник недели, крестики, добавления) за последние недели, по порядку
+    streak: Tuple[str, int, int] | None  # (последний активный день, текущая серия, рекорд) сада
+    records: Tuple[str, int, str, int] | None  # (лучший день, его крестики, лучшая неделя, её крестики)
+    members: List[Tuple[str, int, int, int, int, int]]  # (имя, крестики, добавления, активных дней, серия, рекорд)
+
+@with_db_connection
+def get_garden_stats(c: sqlite3.Cursor, conn: sqlite3.Connection, chat_id: int, days: int = 7, weeks: int = 8,
+                     members: int = 10) -> GardenStats:
+    """Reads a garden's trends, streaks and most active members from the rollups.
+
+    Every query reads a fixed window of rollup rows by primary key, so the cost depends on
+    `days`, `weeks` and the number of members active in the last `days` days, but not on
+    how long the garden has existed.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        chat_id (int): The ID of the chat.
+        days (int): How many days, including today, the daily trend and member activity cover.
+        weeks (int): How many weeks, including the current one, the weekly trend covers.
+        members (int): How many of the most active members to return.
+
+    Returns:
+        GardenStats: The rollups; streaks are returned as stored, so one whose last day is
+            before yesterday has already ended.
+    """
+    today: datetime.date = _activity_day()
+    since: str = (today - datetime.timedelta(days=days - 1)).isoformat()
+    monday: datetime.date = today - datetime.timedelta(days=today.weekday())
+    c.execute('SELECT day, stitches, adds, members FROM stitch_daily WHERE chat_id = ? AND day >= ? ORDER BY day',
+              (chat_id, since))
+    daily: List[Tuple[str, int, int, int]] = c.fetchall()
+    c.execute('SELECT week, stitches, adds FROM stitch_weekly WHERE chat_id = ? AND week >= ? ORDER BY week',
+              (chat_id, (monday - datetime.timedelta(weeks=weeks - 1)).isoformat()))
+    weekly: List[Tuple[str, int, int]] = c.fetchall()
+    c.execute('SELECT last_day, current, longest FROM stitch_streaks WHERE chat_id = ? AND user_id = 0', (chat_id,))
+    streak: Tuple[str, int, int] | None = c.fetchone()
+    c.execute('''SELECT best_day, best_day_stitches, best_week, best_week_stitches
+                 FROM stitch_records WHERE chat_id = ?''', (chat_id,))
+    records: Tuple[str, int, str, int] | None = c.fetchone()
+    c.execute('''SELECT m.user_id, SUM(m.stitches) AS total, SUM(m.adds), COUNT(*),
+                        iif(s.last_day >= ?, s.current, 0), s.longest
+                 FROM stitch_daily_members m
+                 JOIN stitch_streaks s ON s.chat_id = m.chat_id AND s.user_id = m.user_id
+                 WHERE m.chat_id = ? AND m.day >= ?
+                 GROUP BY m.user_id ORDER BY total DESC LIMIT ?''',
+              ((today - datetime.timedelta(days=1)).isoformat(), chat_id, since, members))
+    active: List[Tuple[int, int, int, int, int, int]] = c.fetchall()
+    # Имена берутся из текущего сезона; участник, не писавший в нём, остаётся без имени
+    names: Dict[int, str] = {}
+    if active:
+        c.execute(f'''SELECT user_id, name FROM users WHERE chat_id = ? AND season = ?
+                      AND user_id IN ({", ".join("?" * len(active))})''',
+                  (chat_id, get_season(chat_id), *[row[0] for row in active]))
+        names = dict(c.fetchall())
+    return GardenStats(
+        today.isoformat(), daily, weekly, streak, records,
+        [(names.get(user_id, ""), *row) for user_id, *row in active],
+    )
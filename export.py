@@ -1,25 +1,298 @@
+import argparse
 import csv
-from typing import List, Tuple, Any
-from db import get_all_users
+import gzip
+import io
+import json
+import os
+import struct
+import tempfile
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple, Any
+from db import (
+    iter_all_users_with_headers, iter_flowers_with_headers,
+    get_db_timestamp, get_export_watermark, set_export_watermark, get_season
+)
+from migrations import init_db
 
-def export_users_to_csv(filename: str = 'export.csv') -> str:
-    """Exports all user data from the database to a CSV file.
+# Лимит Telegram на документ, отправляемый ботом, — 50 МБ; оставляем запас
+BACKUP_PART_SIZE: int = 45 * 1024 * 1024
+# До этого размера части держатся в памяти, дальше сбрасываются во временный файл
+SPOOL_MAX_SIZE: int = 1024 * 1024
+
+# Формат -> расширение файла
+FORMATS: Dict[str, str] = {"csv": ".csv", "jsonl": ".jsonl", "wgb": ".wgb"}
+
+# Набор данных -> функция (chat_id, since) -> (headers, rows); chat_id=None — все сады
+DATASETS: Dict[str, Callable[[int | None, str | None], Tuple[List[str], Iterator[Tuple[Any, ...]]]]] = {
+    "users": iter_all_users_with_headers,
+    "flowers": iter_flowers_with_headers,
+}
+
+# Компактный бинарный формат .wgb: сигнатура, число колонок и их имена, затем строки;
+# каждое значение — байт типа и данные (целые — zigzag varint, строки — varint длины и UTF-8).
+WGB_MAGIC: bytes = b"WGB1"
+_WGB_NULL, _WGB_INT, _WGB_STR, _WGB_FLOAT = 0, 1, 2, 3
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(stream: BinaryIO) -> int:
+    result: int = 0
+    shift: int = 0
+    while True:
+        byte: bytes = stream.read(1)
+        if not byte:
+            raise EOFError("Неожиданный конец файла .wgb")
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+def _write_wgb_str(out: bytearray, value: str) -> None:
+    data: bytes = value.encode('utf-8')
+    _write_varint(out, len(data))
+    out += data
+
+def _read_wgb_str(stream: BinaryIO) -> str:
+    return stream.read(_read_varint(stream)).decode('utf-8')
+
+def read_wgb(stream: BinaryIO) -> Tuple[List[str], Iterator[Tuple[Any, ...]]]:
+    """Reads a file written in the .wgb format.
+
+    Args:
+        stream (BinaryIO): The (decompressed) file object.
+
+    Returns:
+        Tuple[List[str], Iterator[Tuple[Any, ...]]]: The column headers and an iterator over the rows.
+    """
+    if stream.read(len(WGB_MAGIC)) != WGB_MAGIC:
+        raise ValueError("Это не файл .wgb")
+    headers: List[str] = [_read_wgb_str(stream) for _ in range(_read_varint(stream))]
+
+    def rows() -> Iterator[Tuple[Any, ...]]:
+        while True:
+            values: List[Any] = []
+            for column in range(len(headers)):
+                tag: bytes = stream.read(1)
+                if not tag:
+                    if column == 0:
+                        return
+                    raise EOFError("Неожиданный конец файла .wgb")
+                if tag[0] == _WGB_NULL:
+                    values.append(None)
+                elif tag[0] == _WGB_INT:
+                    encoded: int = _read_varint(stream)
+                    values.append((encoded >> 1) ^ -(encoded & 1))
+                elif tag[0] == _WGB_STR:
+                    values.append(_read_wgb_str(stream))
+                elif tag[0] == _WGB_FLOAT:
+                    values.append(struct.unpack('<d', stream.read(8))[0])
+                else:
+                    raise ValueError(f"Неизвестный тип значения в .wgb: {tag[0]}")
+            yield tuple(values)
+
+    return headers, rows()
+
+class _CsvRowWriter:
+    def __init__(self, stream: BinaryIO, headers: List[str]) -> None:
+        self._text: io.TextIOWrapper = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(headers)
+
+    def writerow(self, row: Tuple[Any, ...]) -> None:
+        self._writer.writerow(row)
+
+    def finish(self) -> None:
+        self._text.flush()
+        self._text.detach()  # Не закрываем поток вместе с обёрткой
+
+class _JsonLinesRowWriter:
+    def __init__(self, stream: BinaryIO, headers: List[str]) -> None:
+        self._text: io.TextIOWrapper = io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+        self._headers: List[str] = headers
+
+    def writerow(self, row: Tuple[Any, ...]) -> None:
+        self._text.write(json.dumps(dict(zip(self._headers, row)), ensure_ascii=False))
+        self._text.write('\n')
+
+    def finish(self) -> None:
+        self._text.flush()
+        self._text.detach()
+
+class _WgbRowWriter:
+    def __init__(self, stream: BinaryIO, headers: List[str]) -> None:
+        self._stream: BinaryIO = stream
+        header: bytearray = bytearray(WGB_MAGIC)
+        _write_varint(header, len(headers))
+        for name in headers:
+            _write_wgb_str(header, name)
+        stream.write(header)
+
+    def writerow(self, row: Tuple[Any, ...]) -> None:
+        out: bytearray = bytearray()
+        for value in row:
+            if value is None:
+                out.append(_WGB_NULL)
+            elif isinstance(value, int):
+                out.append(_WGB_INT)
+                _write_varint(out, (value << 1) ^ (value >> 63))
+            elif isinstance(value, float):
+                out.append(_WGB_FLOAT)
+                out += struct.pack('<d', value)
+            else:
+                out.append(_WGB_STR)
+                _write_wgb_str(out, str(value))
+        self._stream.write(out)
+
+    def finish(self) -> None:
+        pass
+
+_ROW_WRITERS: Dict[str, type] = {"csv": _CsvRowWriter, "jsonl": _JsonLinesRowWriter, "wgb": _WgbRowWriter}
+
+class _ExportPart:
+    """One export file being written into a spooled temporary file, optionally gzip-compressed."""
+
+    def __init__(self, fmt: str, headers: List[str], compress: bool) -> None:
+        self.raw: BinaryIO = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+b')
+        self._stream: BinaryIO = gzip.GzipFile(fileobj=self.raw, mode='wb') if compress else self.raw
+        self.writer = _ROW_WRITERS[fmt](self._stream, headers)
+        self.rows: int = 0
+
+    def size(self) -> int:
+        """Returns the number of bytes already flushed to the file (a slight underestimate)."""
+        return self.raw.tell()
+
+    def finish(self) -> BinaryIO:
+        """Flushes the part and returns its file, rewound to the start."""
+        self.writer.finish()
+        if self._stream is not self.raw:
+            self._stream.close()  # GzipFile дописывает трейлер, но чужой fileobj не закрывает
+        self.raw.seek(0)
+        return self.raw
+
+def write_parts(fmt: str, headers: List[str], rows: Iterable[Tuple[Any, ...]], basename: str,
+                compress: bool = False, part_size: int = BACKUP_PART_SIZE) -> List[Tuple[str, BinaryIO]]:
+    """Streams rows into one or more files of the given format, each no larger than `part_size`.
+
+    Rows are written as they are read, so memory use does not depend on the number of rows.
+    Every part is a complete file (with its own header row for CSV).
+
+    Args:
+        fmt (str): One of FORMATS.
+        headers (List[str]): The column names.
+        rows (Iterable[Tuple[Any, ...]]): The data rows, e.g. a streaming cursor.
+        basename (str): The file name without extension.
+        compress (bool): Whether to gzip each part.
+        part_size (int): The approximate maximum size of a part in bytes.
+
+    Returns:
+        List[Tuple[str, BinaryIO]]: (file name, file object) for each part; the caller closes the files.
+    """
+    parts: List[BinaryIO] = []
+    part: _ExportPart = _ExportPart(fmt, headers, compress)
+    for row in rows:
+        if part.rows and part.size() >= part_size:
+            parts.append(part.finish())
+            part = _ExportPart(fmt, headers, compress)
+        part.writer.writerow(row)
+        part.rows += 1
+    parts.append(part.finish())
+
+    extension: str = FORMATS[fmt] + ('.gz' if compress else '')
+    if len(parts) == 1:
+        return [(basename + extension, parts[0])]
+    return [(f"{basename}.part{i}{extension}", file) for i, file in enumerate(parts, start=1)]
+
+def export_to_file(fmt: str, headers: List[str], rows: Iterable[Tuple[Any, ...]], path: str,
+                   compress: bool = False) -> int:
+    """Streams rows into a single file on disk.
 
     Args:
+        fmt (str): One of FORMATS.
+        headers (List[str]): The column names.
+        rows (Iterable[Tuple[Any, ...]]): The data rows.
+        path (str): The file to create.
+        compress (bool): Whether to gzip the file.
+
+    Returns:
+        int: The number of rows written.
+    """
+    count: int = 0
+    with open(path, 'wb') as raw:
+        stream: BinaryIO = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+        writer = _ROW_WRITERS[fmt](stream, headers)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        writer.finish()
+        if stream is not raw:
+            stream.close()
+    return count
+
+def export_datasets(out_dir: str, fmt: str = "csv", compress: bool = False,
+                    incremental: str | None = None) -> List[Tuple[str, int]]:
+    """Exports every dataset in DATASETS, for all gardens, into `out_dir`.
+
+    With `incremental`, only users and flowers changed since that export's last watermark
+    are written, and the watermark is advanced once all files are written. The watermark is
+    taken at a write barrier (see get_db_timestamp) before the rows are read, so a row is
+    only missed if the clock of the database host goes backwards; rows changed in the same
+    second as the watermark, or while the export runs, may be exported twice.
+
+    Args:
+        out_dir (str): The directory for the files.
+        fmt (str): One of FORMATS.
+        compress (bool): Whether to gzip the files.
+        incremental (str | None): The name of the incremental export, or None for a full export.
+
+    Returns:
+        List[Tuple[str, int]]: (path, row count) for each written file.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    since: str | None = get_export_watermark(incremental) if incremental else None
+    # Берём до чтения: всё, что записано раньше, уже закоммичено и попадёт в выгрузку, остальное — в следующую
+    watermark: str = get_db_timestamp()
+    stamp: str = watermark.replace('-', '').replace(':', '').replace(' ', 'T')
+    kind: str = f"{incremental}-{stamp}" if incremental else f"full-{stamp}"
+
+    written: List[Tuple[str, int]] = []
+    for dataset, iter_rows in DATASETS.items():
+        headers, rows = iter_rows(None, since)
+        path: str = os.path.join(out_dir, f"{dataset}-{kind}{FORMATS[fmt]}" + ('.gz' if compress else ''))
+        written.append((path, export_to_file(fmt, headers, rows, path, compress)))
+    if incremental:
+        set_export_watermark(incremental, watermark)
+    return written
+
+def export_users_to_csv(chat_id: int, filename: str = 'export.csv') -> str:
+    """Exports the current season of a chat's garden to a human-readable CSV file.
+
+    Args:
+        chat_id (int): The ID of the chat.
         filename (str): The name of the CSV file to create.
 
     Returns:
         str: The name of the created CSV file.
     """
-    users: List[Tuple[Any, ...]] = get_all_users()
+    _, users = iter_all_users_with_headers(chat_id, season=get_season(chat_id))
     with open(filename, mode='w', encoding='utf-8', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['№', 'Имя', 'Крестики', 'Цветочки'])
-        for index, user in enumerate(users, start=1):
-            user_id: Any
-            name: str
-            stitches: int
-            flowers: str
-            user_id, name, stitches, flowers = user  # Type hints for unpacking
+        for index, (_, _, user_id, name, stitches, caterpillars, flowers, updated_at) in enumerate(users, start=1):
             writer.writerow([index, name, stitches, flowers])
-    return filename
\ No newline at end of file
+    return filename
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт данных Зимнего сада.")
+    parser.add_argument("--out", default="exports", help="каталог для файлов (по умолчанию exports)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv", help="формат файлов")
+    parser.add_argument("--gzip", action="store_true", help="сжать файлы gzip")
+    parser.add_argument("--incremental", metavar="NAME",
+                        help="выгрузить только изменения с прошлого запуска экспорта NAME")
+    args = parser.parse_args()
+
+    init_db()
+    for path, count in export_datasets(args.out, args.format, args.gzip, args.incremental):
+        print(f"{path}: {count} строк")
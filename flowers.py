@@ -1,11 +1,23 @@
+import math
 import random
-from typing import List
+from typing import Dict, List
 
 # Цветы
 BASE_FLOWERS: List[str] = ['🌷', '🌹', '🌸', '🌺', '🌼']
 ADVANCED_FLOWERS: List[str] = ['🪻', '🪷', '🌻']
 ALL_FLOWERS: List[str] = BASE_FLOWERS + ADVANCED_FLOWERS
 
+# Сколько первых цветочков выбирается только из BASE_FLOWERS
+BASE_FLOWERS_LIMIT: int = 10
+
+_RNG: random.Random = random.Random()
+
+# Знак между цветком и их числом в компактном букете
+BOUQUET_COUNT_SIGN: str = "×"
+
+# Сколько крестиков съедает гусеница
+CATERPILLAR_PENALTY: int = 100
+
 def get_random_flower(flower_count: int) -> str:
     """Returns a random flower based on the current flower count.
 
@@ -15,11 +27,113 @@ def get_random_flower(flower_count: int) -> str:
     Returns:
         str: An emoji string representing a random flower.
     """
-    if flower_count < 10:
+    if flower_count < BASE_FLOWERS_LIMIT:
         return random.choice(BASE_FLOWERS)
     else:
         return random.choice(ALL_FLOWERS)
 
+def _binomial(n: int, p: float, rng: random.Random) -> int:
+    """Draws from Binomial(n, p) in time that does not grow with n.
+
+    Uses the geometric method for small n * p and Hörmann's BTRS transformed rejection
+    otherwise (the algorithm behind random.binomialvariate in Python 3.12).
+
+    Args:
+        n (int): The number of trials.
+        p (float): The success probability.
+        rng (random.Random): The random number generator.
+
+    Returns:
+        int: The number of successes.
+    """
+    if n <= 0 or p <= 0.0:
+        return 0
+    if p >= 1.0:
+        return n
+    if p > 0.5:
+        return n - _binomial(n, 1.0 - p, rng)
+    if n * p < 10.0:
+        successes: int = 0
+        trial: int = 0
+        log_q: float = math.log(1.0 - p)
+        while True:
+            trial += math.floor(math.log(1.0 - rng.random()) / log_q) + 1
+            if trial > n:
+                return successes
+            successes += 1
+
+    spq: float = math.sqrt(n * p * (1.0 - p))
+    b: float = 1.15 + 2.53 * spq
+    a: float = -0.0873 + 0.0248 * b + 0.01 * p
+    c: float = n * p + 0.5
+    vr: float = 0.92 - 4.2 / b
+    alpha: float = (2.83 + 5.1 / b) * spq
+    lpq: float = math.log(p / (1.0 - p))
+    m: int = math.floor((n + 1) * p)
+    h: float = math.lgamma(m + 1) + math.lgamma(n - m + 1)
+    while True:
+        u: float = rng.random() - 0.5
+        us: float = 0.5 - abs(u)
+        k: int = math.floor((2.0 * a / us + b) * u + c)
+        if k < 0 or k > n:
+            continue
+        v: float = rng.random()
+        if us >= 0.07 and v <= vr:
+            return k
+        v *= alpha / (a / (us * us) + b)
+        if math.log(v) <= h - math.lgamma(k + 1) - math.lgamma(n - k + 1) + (k - m) * lpq:
+            return k
+
+def _multinomial(n: int, flowers: List[str], counts: Dict[str, int], rng: random.Random) -> None:
+    """Adds n draws, uniform over `flowers`, to `counts` with one binomial draw per flower."""
+    for index, flower in enumerate(flowers):
+        remaining_types: int = len(flowers) - index
+        drawn: int = n if remaining_types == 1 else _binomial(n, 1.0 / remaining_types, rng)
+        if drawn:
+            counts[flower] = counts.get(flower, 0) + drawn
+        n -= drawn
+        if n == 0:
+            return
+
+def sample_flowers(flower_count: int, amount: int, rng: random.Random | None = None) -> Dict[str, int]:
+    """Draws `amount` new flowers at once, with the same distribution as calling
+    get_random_flower for each of them in turn.
+
+    The flowers that bring the user up to BASE_FLOWERS_LIMIT come from BASE_FLOWERS,
+    the rest from ALL_FLOWERS. The cost depends on the number of flower types only.
+
+    Args:
+        flower_count (int): How many flowers the user already has.
+        amount (int): How many flowers to draw.
+        rng (random.Random | None): The generator to use; the module's by default.
+
+    Returns:
+        Dict[str, int]: The number of each flower drawn; flowers not drawn are absent.
+    """
+    rng = rng or _RNG
+    counts: Dict[str, int] = {}
+    base: int = max(0, min(amount, BASE_FLOWERS_LIMIT - flower_count))
+    _multinomial(base, BASE_FLOWERS, counts, rng)
+    _multinomial(amount - base, ALL_FLOWERS, counts, rng)
+    return counts
+
+def render_bouquet(counts: Dict[str, int]) -> str:
+    """Renders a compact bouquet from per-flower counts, e.g. "🌷×42 🌹×17 🌼", in ALL_FLOWERS order.
+
+    The result has at most one entry per flower kind, so its length does not grow with the
+    number of flowers.
+
+    Args:
+        counts (Dict[str, int]): The number of each flower the user has.
+
+    Returns:
+        str: The space-separated entries; empty if there are no flowers.
+    """
+    return ' '.join(
+        flower if counts[flower] == 1 else f"{flower}{BOUQUET_COUNT_SIGN}{counts[flower]}"
+        for flower in ALL_FLOWERS if counts.get(flower)
+    )
+
 def should_give_flower(total_stitches: int, prev_stitches: int) -> bool:
     """Determines if a new flower should be given based on stitch count.
 
@@ -1,45 +1,98 @@
 from messages import M
 from loguru import logger
 import telebot
-import io
-import csv
-from typing import List, Tuple, Any
-from config import ALLOWED_CHAT_ID
-from db import get_all_users_with_headers
-from .utils import _MESSAGES_LOG, clean_message_log
+from telebot.async_telebot import AsyncTeleBot
+from typing import BinaryIO, List, Tuple, Any
+from config import ALLOWED_CHAT_IDS, BACKUP_FORMAT, BACKUP_GZIP
+from db import iter_all_users_with_headers, run_db
+from logsink import log_context
+from metrics import timed
+from export import write_parts
+from outbox import OUTBOX
+from .utils import is_duplicate, send_reply, send_reply_async
+
+def build_backup(chat_id: int) -> List[Tuple[str, BinaryIO]]:
+    """Streams a chat's garden into BACKUP_FORMAT files that fit Telegram's document size limit.
+
+    Args:
+        chat_id (int): The ID of the chat.
+
+    Returns:
+        List[Tuple[str, BinaryIO]]: (file name, file object) for each part; the caller closes the files.
+    """
+    headers: List[str]
+    headers, rows = iter_all_users_with_headers(chat_id)
+    return write_parts(BACKUP_FORMAT, headers, rows, basename='backup', compress=BACKUP_GZIP)
 
 def register_backup_handler(bot: telebot.TeleBot) -> None:
     @bot.message_handler(commands=['backup'])
+    @timed("handler_seconds", "backup")
+    @log_context("backup")
     def send_backup(message: telebot.types.Message) -> None:
-        """Sends a CSV backup of user data to the allowed chat.
+        """Sends a backup of user data to the allowed chat.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        chat_id: int = message.chat.id
+        if chat_id not in ALLOWED_CHAT_IDS:
+            logger.warning("Пользователь {user_id} попытался запросить бэкап в неразрешенном чате {chat_id}.",
+                           user_id=message.from_user.id, chat_id=chat_id)
+            send_reply(bot, message, M["backup_denied"])
+            return
+
+        if is_duplicate(message):
+            return
+
+        parts: List[Tuple[str, BinaryIO]] = []
+        try:
+            parts = build_backup(chat_id)
+            if OUTBOX.running:
+                # Файлы закроет очередь отправки, когда они уйдут
+                for part in parts:
+                    OUTBOX.send_document(chat_id, part)
+                parts = []
+            for part in parts:
+                bot.send_document(chat_id, part)
+            logger.info("Резервная копия отправлена в чат {chat_id}.", chat_id=chat_id)
+        except Exception as e:
+            logger.error("Ошибка при /backup в чате {chat_id}: {error}", chat_id=chat_id, error=e, exc_info=True)
+            send_reply(bot, message, M["backup_error"].format(error=e))
+        finally:
+            for _, file in parts:
+                file.close()
+
+def register_backup_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['backup'])
+    @timed("handler_seconds", "backup")
+    @log_context("backup")
+    async def send_backup(message: telebot.types.Message) -> None:
+        """Sends a backup of user data to the allowed chat.
         Args:
             message (telebot.types.Message): The message object.
         """
         chat_id: int = message.chat.id
-        if chat_id != ALLOWED_CHAT_ID:
-            logger.warning(f"Пользователь {message.from_user.id} попытался запросить бэкап в неразрешенном чате {chat_id}.")
-            bot.send_message(chat_id, M["backup_denied"])
+        if chat_id not in ALLOWED_CHAT_IDS:
+            logger.warning("Пользователь {user_id} попытался запросить бэкап в неразрешенном чате {chat_id}.",
+                           user_id=message.from_user.id, chat_id=chat_id)
+            await send_reply_async(bot, message, M["backup_denied"])
             return
 
-        if message.message_id in _MESSAGES_LOG:
-            logger.debug(f"Сообщение {message.message_id} уже обработано, пропуск.")
+        if await run_db(is_duplicate, message):
             return
-        _MESSAGES_LOG.add(message.message_id)
-        clean_message_log()
 
+        parts: List[Tuple[str, BinaryIO]] = []
         try:
-            headers: List[str]
-            rows: List[Tuple[Any, ...]]
-            headers, rows = get_all_users_with_headers()
-
-            output: io.StringIO = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(headers)
-            writer.writerows(rows)
-            output.seek(0)
-
-            bot.send_document(chat_id, ('backup.csv', output.getvalue()))
-            logger.info(f"Резервная копия отправлена в чат {chat_id}.")
+            parts = await run_db(build_backup, chat_id)
+            if OUTBOX.running:
+                for part in parts:
+                    OUTBOX.send_document(chat_id, part)
+                parts = []
+            for part in parts:
+                await bot.send_document(chat_id, part)
+            logger.info("Резервная копия отправлена в чат {chat_id}.", chat_id=chat_id)
         except Exception as e:
-            logger.error(f"Ошибка при /backup в чате {chat_id}: {e}", exc_info=True)
-            bot.send_message(chat_id, M["backup_error"].format(error=e))
+            logger.error("Ошибка при /backup в чате {chat_id}: {error}", chat_id=chat_id, error=e, exc_info=True)
+            await send_reply_async(bot, message, M["backup_error"].format(error=e))
+        finally:
+            for _, file in parts:
+                file.close()
@@ -0,0 +1,75 @@
+from messages import M
+from loguru import logger
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+from db import LEADERBOARDS, run_db
+from leaderboard import RankEntry
+from logsink import log_context
+from metrics import timed
+from .utils import is_duplicate, send_reply, send_reply_async
+
+def render_me(entry: RankEntry) -> str:
+    """Builds the /me message text.
+
+    Args:
+        entry (RankEntry): The user's place in the garden.
+
+    Returns:
+        str: The message text.
+    """
+    text: str = M["me_rank"].format(
+        name=entry.name, rank=entry.rank, total=entry.total, stitches=entry.stitches,
+        bouquet=entry.bouquet or M["empty_bouquet"]
+    )
+    if entry.next_name is None:
+        return text + M["me_leader"]
+    return text + M["me_next"].format(next_name=entry.next_name, gap=entry.next_stitches - entry.stitches + 1)
+
+def process_me(message: telebot.types.Message) -> str | None:
+    """Builds the /me reply: the user's place, stitches, gap to the next place and bouquet.
+
+    Args:
+        message (telebot.types.Message): The message object.
+
+    Returns:
+        str | None: The reply text, or None if the message is a duplicate and needs no reply.
+    """
+    chat_id: int = message.chat.id
+    user_id: int = message.from_user.id
+    if is_duplicate(message):
+        return None
+
+    try:
+        # Место ищется двоичным поиском в упорядоченном индексе лидерборда чата, без запроса к базе
+        entry: RankEntry | None = LEADERBOARDS.get(chat_id).rank(user_id)
+        return render_me(entry) if entry is not None else M["me_missing"]
+    except Exception as e:
+        logger.error("Ошибка в /me для пользователя {user_id} в чате {chat_id}: {error}", user_id=user_id,
+                     chat_id=chat_id, error=e, exc_info=True)
+        return "Ошибка при поиске твоего места."
+
+def register_me_handler(bot: telebot.TeleBot) -> None:
+    @bot.message_handler(commands=['me'])
+    @timed("handler_seconds", "me")
+    @log_context("me")
+    def show_me(message: telebot.types.Message) -> None:
+        """Shows the user's place in the garden.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = process_me(message)
+        if reply is not None:
+            send_reply(bot, message, reply, quote=True)
+
+def register_me_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['me'])
+    @timed("handler_seconds", "me")
+    @log_context("me")
+    async def show_me(message: telebot.types.Message) -> None:
+        """Shows the user's place in the garden.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = await run_db(process_me, message)
+        if reply is not None:
+            await send_reply_async(bot, message, reply, quote=True)
@@ -1,36 +1,78 @@
 from messages import M
 from loguru import logger
 import telebot
-from typing import Any
-from config import ADMIN_ID
-from db import reset_all
-from .utils import _MESSAGES_LOG, clean_message_log
+from telebot.async_telebot import AsyncTeleBot
+from typing import Any, List
+from config import ADMIN_ID, ALLOWED_CHAT_IDS
+from db import start_new_season, run_db
+from logsink import log_context
+from metrics import timed
+from .utils import is_duplicate, send_reply, send_reply_async
+
+def process_reset(message: telebot.types.Message) -> str | None:
+    """Starts a new season in a garden, archiving the current one. Only allowed for the ADMIN_ID.
+
+    `/reset` applies to the garden of the chat it is sent in, `/reset <chat_id>` to the given
+    garden (e.g. from a private chat with the bot); other chats are refused.
+
+    Args:
+        message (telebot.types.Message): The message object.
+
+    Returns:
+        str | None: The reply text, or None if the message is a duplicate and needs no reply.
+    """
+    user_id: int = message.from_user.id
+
+    if is_duplicate(message, claim_in_transaction=True):
+        return None
+
+    if user_id != ADMIN_ID:
+        logger.warning("Пользователь {user_id} попытался выполнить /reset без прав администратора.", user_id=user_id)
+        return M["reset_denied"]
+
+    arguments: List[str] = (message.text or "").split()[1:]
+    chat_id: int = message.chat.id
+    if arguments and arguments[0].lstrip("-").isdigit():
+        chat_id = int(arguments[0])
+    if chat_id not in ALLOWED_CHAT_IDS:
+        logger.warning("Администратор {user_id} попытался выполнить /reset для чата {chat_id}, который не входит в сады.",
+                       user_id=user_id, chat_id=chat_id)
+        return M["reset_unknown_chat"].format(chat_id=chat_id)
+
+    try:
+        # Отметка об обработке пишется в транзакции смены сезона: повтор после сбоя не начнёт второй сезон
+        season: int | None = start_new_season(chat_id, (message.chat.id, message.message_id))
+        if season is None:
+            return None
+        logger.info("Администратор {user_id} начал сезон {season} в саду чата {chat_id}.", user_id=user_id,
+                    season=season, chat_id=chat_id)
+        return M["reset_done"].format(season=season)
+    except Exception as e:
+        logger.error("Ошибка при /reset для администратора {user_id}: {error}", user_id=user_id, error=e, exc_info=True)
+        return M["reset_error"].format(error=e)
 
 def register_reset_handler(bot: telebot.TeleBot) -> None:
     @bot.message_handler(commands=['reset'])
+    @timed("handler_seconds", "reset")
+    @log_context("reset")
     def reset_command(message: telebot.types.Message) -> None:
-        """Resets all user progress. Only callable by the ADMIN_ID.
+        """Starts a new season in a garden. Only callable by the ADMIN_ID.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = process_reset(message)
+        if reply is not None:
+            send_reply(bot, message, reply)
+
+def register_reset_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['reset'])
+    @timed("handler_seconds", "reset")
+    @log_context("reset")
+    async def reset_command(message: telebot.types.Message) -> None:
+        """Starts a new season in a garden. Only callable by the ADMIN_ID.
         Args:
             message (telebot.types.Message): The message object.
         """
-        chat_id: int = message.chat.id
-        user_id: int = message.from_user.id
-
-        if message.message_id in _MESSAGES_LOG:
-            logger.debug(f"Сообщение {message.message_id} уже обработано, пропуск.")
-            return
-        _MESSAGES_LOG.add(message.message_id)
-        clean_message_log()
-
-        if user_id != ADMIN_ID:
-            logger.warning(f"Пользователь {user_id} попытался выполнить /reset без прав администратора.")
-            bot.send_message(chat_id, M["reset_denied"])
-            return
-
-        try:
-            reset_all()
-            bot.send_message(chat_id, M["reset_done"])
-            logger.info(f"Все данные пользователей были сброшены администратором {user_id}.")
-        except Exception as e:
-            logger.error(f"Ошибка при /reset для администратора {user_id}: {e}", exc_info=True)
-            bot.send_message(chat_id, M["reset_error"].format(error=e))
+        reply: str | None = await run_db(process_reset, message)
+        if reply is not None:
+            await send_reply_async(bot, message, reply)
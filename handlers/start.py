@@ -1,20 +1,36 @@
 from messages import M
-from loguru import logger
 import telebot
-from .utils import _MESSAGES_LOG, clean_message_log
+from telebot.async_telebot import AsyncTeleBot
+from db import run_db
+from logsink import log_context
+from metrics import timed
+from .utils import is_duplicate, send_reply, send_reply_async
 
 def register_start_handler(bot: telebot.TeleBot) -> None:
     @bot.message_handler(commands=['start'])
+    @timed("handler_seconds", "start")
+    @log_context("start")
     def start_message(message: telebot.types.Message) -> None:
         """Sends a welcome message to the user.
         Args:
             message (telebot.types.Message): The message object.
         """
-        if message.message_id in _MESSAGES_LOG:
-            logger.debug(f"Сообщение {message.message_id} уже обработано, пропуск.")
+        if is_duplicate(message):
             return
-        _MESSAGES_LOG.add(message.message_id)
-        clean_message_log()
 
-        bot.reply_to(message, M["start"])
-        logger.info(f"Отправлено сообщение о старте пользователю {message.from_user.id}")
+        send_reply(bot, message, M["start"], quote=True)
+
+def register_start_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['start'])
+    @timed("handler_seconds", "start")
+    @log_context("start")
+    async def start_message(message: telebot.types.Message) -> None:
+        """Sends a welcome message to the user.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        # Дедупликация может обращаться к базе, поэтому тоже уходит в DB-пул
+        if await run_db(is_duplicate, message):
+            return
+
+        await send_reply_async(bot, message, M["start"], quote=True)
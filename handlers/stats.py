@@ -0,0 +1,132 @@
+from messages import M
+import datetime
+from loguru import logger
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+from typing import Dict, List, Tuple
+from config import ADMIN_ID, ALLOWED_CHAT_IDS
+from db import run_db, get_garden_stats, GardenStats
+from logsink import log_context
+from metrics import render_report
+from .utils import is_duplicate, send_reply, send_reply_async
+
+# Столбики для трендов, от самого низкого к самому высокому
+BARS: str = "▁▂▃▄▅▆▇█"
+STATS_DAYS: int = 7
+STATS_WEEKS: int = 8
+
+def _bar(value: int, peak: int) -> str:
+    return BARS[(len(BARS) - 1) * value // peak] if peak > 0 else BARS[0]
+
+def _short_date(day: str) -> str:
+    return datetime.date.fromisoformat(day).strftime("%d.%m")
+
+def render_garden_stats(stats: GardenStats, days: int = STATS_DAYS, weeks: int = STATS_WEEKS) -> str:
+    """Builds the /stats garden message: daily and weekly trends, streaks, records and the most active members.
+
+    Args:
+        stats (GardenStats): The rollups read by get_garden_stats with the same `days` and `weeks`.
+        days (int): The number of days in the daily trend.
+        weeks (int): The number of weeks in the weekly trend.
+
+    Returns:
+        str: The message text.
+    """
+    if stats.records is None:
+        return M["stats_garden_empty"]
+    today: datetime.date = datetime.date.fromisoformat(stats.today)
+    # Дни и недели без добавлений в сводках отсутствуют, в отчёте они нулевые
+    by_day: Dict[str, Tuple[str, int, int, int]] = {row[0]: row for row in stats.daily}
+    day_rows: List[Tuple[str, int, int, int]] = []
+    for offset in range(days - 1, -1, -1):
+        day: str = (today - datetime.timedelta(days=offset)).isoformat()
+        day_rows.append(by_day.get(day, (day, 0, 0, 0)))
+    monday: datetime.date = today - datetime.timedelta(days=today.weekday())
+    by_week: Dict[str, Tuple[str, int, int]] = {row[0]: row for row in stats.weekly}
+    week_rows: List[Tuple[str, int, int]] = []
+    for offset in range(weeks - 1, -1, -1):
+        week: str = (monday - datetime.timedelta(weeks=offset)).isoformat()
+        week_rows.append(by_week.get(week, (week, 0, 0)))
+
+    parts: List[str] = [M["stats_garden_days"].format(days=days)]
+    peak: int = max(row[1] for row in day_rows)
+    for day, stitches, _, members in day_rows:
+        parts.append(M["stats_garden_day"].format(day=_short_date(day), bar=_bar(stitches, peak), stitches=stitches,
+                                                  members=members))
+    parts.append(M["stats_garden_weeks"])
+    peak = max(row[1] for row in week_rows)
+    previous: int = 0
+    for week, stitches, _ in week_rows:
+        change: str = M["stats_garden_change"].format(change=round(100 * (stitches / previous - 1))) if previous else ""
+        parts.append(M["stats_garden_week"].format(week=_short_date(week), bar=_bar(stitches, peak), stitches=stitches,
+                                                   change=change))
+        previous = stitches
+
+    last_day, current, longest = stats.streak
+    # Серия продолжается, пока сад вышивал сегодня или вчера
+    alive: bool = last_day >= (today - datetime.timedelta(days=1)).isoformat()
+    parts.append(M["stats_garden_streak"].format(current=current if alive else 0, longest=longest))
+    best_day, best_day_stitches, best_week, best_week_stitches = stats.records
+    parts.append(M["stats_garden_records"].format(day=_short_date(best_day), day_stitches=best_day_stitches,
+                                                  week=_short_date(best_week), week_stitches=best_week_stitches))
+    if stats.members:
+        parts.append(M["stats_garden_members"].format(days=days))
+        for index, (name, stitches, _, active, streak, longest) in enumerate(stats.members, start=1):
+            parts.append(M["stats_garden_member"].format(index=index, name=name or "Игрок", stitches=stitches,
+                                                         active=active, streak=streak, longest=longest))
+    return "".join(parts)
+
+def process_stats(message: telebot.types.Message) -> str | None:
+    """Builds the /stats reply with the collected timings, or with `/stats garden [chat_id]` the
+    activity report of a garden (by default the chat it is sent in). Only allowed for the ADMIN_ID.
+
+    Args:
+        message (telebot.types.Message): The message object.
+
+    Returns:
+        str | None: The reply text, or None if the message is a duplicate and needs no reply.
+    """
+    user_id: int = message.from_user.id
+
+    if is_duplicate(message):
+        return None
+
+    if user_id != ADMIN_ID:
+        logger.warning("Пользователь {user_id} попытался выполнить /stats без прав администратора.", user_id=user_id)
+        return M["stats_denied"]
+
+    arguments: List[str] = (message.text or "").split()[1:]
+    if arguments and arguments[0].lower() == "garden":
+        chat_id: int = message.chat.id
+        if len(arguments) > 1 and arguments[1].lstrip("-").isdigit():
+            chat_id = int(arguments[1])
+        if chat_id not in ALLOWED_CHAT_IDS:
+            return M["stats_garden_unknown"].format(chat_id=chat_id)
+        return render_garden_stats(get_garden_stats(chat_id, STATS_DAYS, STATS_WEEKS))
+
+    report: str = render_report()
+    return M["stats_title"] + report if report else M["stats_empty"]
+
+def register_stats_handler(bot: telebot.TeleBot) -> None:
+    @bot.message_handler(commands=['stats'])
+    @log_context("stats")
+    def stats_command(message: telebot.types.Message) -> None:
+        """Sends the timing report or, with `/stats garden`, a garden's activity. Only callable by the ADMIN_ID.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = process_stats(message)
+        if reply is not None:
+            send_reply(bot, message, reply)
+
+def register_stats_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['stats'])
+    @log_context("stats")
+    async def stats_command(message: telebot.types.Message) -> None:
+        """Sends the timing report or, with `/stats garden`, a garden's activity. Only callable by the ADMIN_ID.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = await run_db(process_stats, message)
+        if reply is not None:
+            await send_reply_async(bot, message, reply)
@@ -1,39 +1,89 @@
 from messages import M
 from loguru import logger
 import telebot
+from telebot.async_telebot import AsyncTeleBot
 from typing import List, Tuple, Any
-from db import get_top_users
-from .utils import _MESSAGES_LOG, clean_message_log
+from db import LEADERBOARDS, get_all_time_top, get_season, get_top_users, run_db
+from logsink import log_context
+from metrics import timed
+from .utils import is_duplicate, send_reply, send_reply_async
+
+def render_top(top_users: List[Tuple[str, int, str]], title: str = M["top_title"]) -> str:
+    """Builds the /top message text.
+
+    Args:
+        top_users (List[Tuple[str, int, str]]): The top users as (name, stitches, bouquet), best first.
+        title (str): The first line of the message.
+
+    Returns:
+        str: The message text.
+    """
+    if not top_users:
+        return M["top_empty"]
+    lines: List[str] = [title]
+    for i, (name, stitches, flowers) in enumerate(top_users, start=1):
+        lines.append(M["top_item"].format(
+            index=i, name=name, stitches=stitches, flowers=flowers or "без цветов"
+        ) + "\n")
+    return "".join(lines)
+
+def process_top(message: telebot.types.Message) -> str | None:
+    """Builds the /top reply: the current season, `/top all` for all seasons or `/top N` for season N.
+
+    Args:
+        message (telebot.types.Message): The message object.
+
+    Returns:
+        str | None: The reply text, or None if the message is a duplicate and needs no reply.
+    """
+    chat_id: int = message.chat.id
+    if is_duplicate(message):
+        return None
+
+    try:
+        # /top all — за все сезоны, /top N — архивный сезон N
+        argument: str = (message.text or "").partition(" ")[2].strip().lower()
+        if argument == "all":
+            return render_top(get_all_time_top(chat_id), M["top_title_all"])
+        if argument.isdigit() and int(argument) != get_season(chat_id):
+            season: int = int(argument)
+            top_users: List[Tuple[str, int, str]] = get_top_users(chat_id, season=season)
+            if not top_users:
+                return M["top_season_empty"].format(season=season)
+            return render_top(top_users, M["top_title_season"].format(season=season))
+        # Текст топа текущего сезона кэшируется в лидерборде чата и пересобирается, только когда меняется топ-10
+        reply: str = LEADERBOARDS.get(chat_id).render(render_top)
+        if reply == M["top_empty"]:
+            logger.info("Запрошен топ чата {chat_id}, но список пуст.", chat_id=chat_id)
+        return reply
+    except Exception as e:
+        logger.error("Ошибка в /top для чата {chat_id}: {error}", chat_id=chat_id, error=e, exc_info=True)
+        return "Ошибка при показе топа."
 
 def register_top_handler(bot: telebot.TeleBot) -> None:
     @bot.message_handler(commands=['top'])
+    @timed("handler_seconds", "top")
+    @log_context("top")
     def show_top(message: telebot.types.Message) -> None:
         """Shows the top users by stitches.
         Args:
             message (telebot.types.Message): The message object.
         """
-        chat_id: int = message.chat.id
-        if message.message_id in _MESSAGES_LOG:
-            logger.debug(f"Сообщение {message.message_id} уже обработано, пропуск.")
+        reply: str | None = process_top(message)
+        if reply is None:
             return
-        _MESSAGES_LOG.add(message.message_id)
-        clean_message_log()
+        send_reply(bot, message, reply)
 
-        try:
-            top_users: List[Tuple[str, int, str]] = get_top_users()
-            if not top_users:
-                bot.send_message(chat_id, M["top_empty"])
-                logger.info(f"Запрошен топ, но список пуст.")
-                return
-
-            reply: str = M["top_title"]
-            for i, (name, stitches, flowers) in enumerate(top_users, start=1):
-                reply += M["top_item"].format(
-                    index=i, name=name, stitches=stitches, flowers=flowers or "без цветов"
-                ) + "\n"
-
-            bot.send_message(chat_id, reply)
-            logger.info(f"Топ пользователей отправлен в чат {chat_id}.")
-        except Exception as e:
-            logger.error(f"Ошибка в /top для чата {chat_id}: {e}", exc_info=True)
-            bot.send_message(chat_id, "Ошибка при показе топа.")
+def register_top_handler_async(bot: AsyncTeleBot) -> None:
+    @bot.message_handler(commands=['top'])
+    @timed("handler_seconds", "top")
+    @log_context("top")
+    async def show_top(message: telebot.types.Message) -> None:
+        """Shows the top users by stitches.
+        Args:
+            message (telebot.types.Message): The message object.
+        """
+        reply: str | None = await run_db(process_top, message)
+        if reply is None:
+            return
+        await send_reply_async(bot, message, reply)
@@ -1,10 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
 from loguru import logger
-from typing import Set
-
-_MESSAGES_LOG: Set[int] = set()
-def clean_message_log() -> None:
-    """Cleans the message log if it exceeds a certain size."""
-    global _MESSAGES_LOG
-    if len(_MESSAGES_LOG) > 1000:
-        logger.info("Очистка журнала сообщений.")
-        _MESSAGES_LOG = set()
+import telebot
+from telebot.async_telebot import AsyncTeleBot
+from typing import Tuple
+from config import DEDUP_BACKEND, DEDUP_CAPACITY, DEDUP_TTL
+from db import mark_message_processed, prune_processed_messages
+from outbox import OUTBOX
+from rendering import split_message
+
+MessageKey = Tuple[int, int]  # (chat_id, message_id): message_id уникален только внутри чата
+
+class MessageDeduplicator:
+    """Bounded in-memory record of processed messages.
+
+    Keys live in an insertion-ordered dict used as a FIFO ring: at most `capacity`
+    entries are kept and entries older than `ttl` seconds are evicted, both in O(1)
+    per insert. Safe to call from telebot's worker threads.
+
+    Callers that record a message in processed_messages themselves (see
+    db.apply_stitch_delta) pass in_database=False; such records are pruned after `ttl`
+    here as well, so the table stays bounded whichever backend is configured.
+    """
+
+    _PRUNE_EVERY: int = 1000
+
+    def __init__(self, capacity: int = DEDUP_CAPACITY, ttl: float = DEDUP_TTL) -> None:
+        self._capacity: int = capacity
+        self._ttl: float = ttl
+        self._seen: OrderedDict[MessageKey, float] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._inserts: int = 0
+
+    def check_and_add(self, key: MessageKey, in_database: bool = True) -> bool:
+        """Records the key and reports whether it had already been seen.
+
+        Args:
+            key (MessageKey): The (chat_id, message_id) pair.
+            in_database (bool): Whether the database record, if any, is made here; False when the
+                caller records the key within the transaction that applies the message.
+
+        Returns:
+            bool: True if the key was seen before (a duplicate), False otherwise.
+        """
+        if self._check_and_add_in_memory(key):
+            return True
+        if not in_database:
+            self._count_insert()
+        return False
+
+    def _check_and_add_in_memory(self, key: MessageKey) -> bool:
+        now: float = time.monotonic()
+        with self._lock:
+            # Самые старые записи стоят в начале, поэтому вытеснение по TTL останавливается на первой свежей
+            while self._seen:
+                oldest_key, seen_at = next(iter(self._seen.items()))
+                if now - seen_at < self._ttl:
+                    break
+                del self._seen[oldest_key]
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self._capacity:
+                self._seen.popitem(last=False)
+            return False
+
+    def _count_insert(self) -> None:
+        """Counts a record added to processed_messages and prunes the old ones every _PRUNE_EVERY records."""
+        with self._lock:
+            self._inserts += 1
+            prune: bool = self._inserts % self._PRUNE_EVERY == 0
+        if prune:
+            prune_processed_messages(self._ttl)
+
+class SQLiteMessageDeduplicator(MessageDeduplicator):
+    """Deduplicator that also records processed messages in the database,
+    so duplicates are recognised across restarts.
+    """
+
+    def check_and_add(self, key: MessageKey, in_database: bool = True) -> bool:
+        """Records the key in memory and in the database and reports whether it had already been seen.
+
+        Args:
+            key (MessageKey): The (chat_id, message_id) pair.
+            in_database (bool): Whether to record the key in the database here; False when the caller
+                records it within the transaction that applies the message (see db.apply_stitch_delta).
+
+        Returns:
+            bool: True if the key was seen before (a duplicate), False otherwise.
+        """
+        if self._check_and_add_in_memory(key):
+            return True
+        if in_database and not mark_message_processed(*key):
+            return True
+        self._count_insert()
+        return False
+
+_DEDUPLICATOR: MessageDeduplicator = (
+    SQLiteMessageDeduplicator() if DEDUP_BACKEND == "sqlite" else MessageDeduplicator()
+)
+
+def is_duplicate(message: telebot.types.Message, claim_in_transaction: bool = False) -> bool:
+    """Checks whether the message has already been handled and marks it as handled.
+
+    Args:
+        message (telebot.types.Message): The incoming message.
+        claim_in_transaction (bool): Whether the caller records the message as processed in the
+            database itself, in the transaction that applies it; only the in-memory record is
+            checked here then.
+
+    Returns:
+        bool: True if the message is a duplicate and should be skipped.
+    """
+    if _DEDUPLICATOR.check_and_add((message.chat.id, message.message_id), in_database=not claim_in_transaction):
+        # Повторы приходят пачками после перезапуска или повтора webhook, поэтому запись ограничена по частоте
+        logger.bind(event="duplicate").debug("Сообщение {message_id} в чате {chat_id} уже обработано, пропуск.",
+                                             message_id=message.message_id, chat_id=message.chat.id)
+        return True
+    return False
+
+def send_reply(bot: telebot.TeleBot, message: telebot.types.Message, text: str,
+               coalesce: bool = False, quote: bool = False) -> None:
+    """Sends a reply into the message's chat through OUTBOX, or directly when the outbox is not running.
+
+    Text longer than Telegram allows is split into several messages on line breaks;
+    only the first one quotes `message`.
+
+    Args:
+        bot (telebot.TeleBot): The bot, used when the outbox is off.
+        message (telebot.types.Message): The message being answered.
+        text (str): The reply text.
+        coalesce (bool): Whether the outbox may merge it with other pending replies in the chat.
+        quote (bool): Whether to send it as a reply to `message`.
+    """
+    for part in split_message(text):
+        if OUTBOX.running:
+            if quote:
+                OUTBOX.reply_to(message, part)
+            else:
+                OUTBOX.send_message(message.chat.id, part, coalesce=coalesce)
+        elif quote:
+            bot.reply_to(message, part)
+        else:
+            bot.send_message(message.chat.id, part)
+        quote = False
+
+async def send_reply_async(bot: AsyncTeleBot, message: telebot.types.Message, text: str,
+                           coalesce: bool = False, quote: bool = False) -> None:
+    """Async variant of send_reply; queueing on OUTBOX never blocks the event loop."""
+    if OUTBOX.running:
+        send_reply(bot, message, text, coalesce, quote)
+        return
+    for part in split_message(text):
+        if quote:
+            await bot.reply_to(message, part)
+        else:
+            await bot.send_message(message.chat.id, part)
+        quote = False
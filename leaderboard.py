@@ -0,0 +1,405 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+LeaderboardRow = Tuple[int, str, int, str]  # (user_id, name, stitches, bouquet)
+TopEntry = Tuple[str, int, str]  # (name, stitches, bouquet)
+# (since) -> (watermark, rows changed at or after since); since=None — только текущий watermark
+ChangesLoader = Callable[[str | None], Tuple[str, Iterable[LeaderboardRow]]]
+OrderKey = Tuple[int, int]  # (-stitches, user_id)
+
+class RankEntry(NamedTuple):
+    """A user's place in a leaderboard, as returned by Leaderboard.rank()."""
+    rank: int  # участники с одинаковым числом крестиков делят место
+    total: int
+    name: str
+    stitches: int
+    bouquet: str
+    next_name: str | None  # ближайший участник с большим числом крестиков
+    next_stitches: int | None
+
+class RankIndex:
+    """Sorted multiset of order keys kept as a list of short sorted lists.
+
+    A plain sorted list moves every key after the insertion point on each update, O(n).
+    Here the keys are split into sublists of at most 2 * `load` keys with the largest key
+    of each kept in `_maxes`, so an insert or removal bisects `_maxes` and shifts only one
+    sublist, O(log n + load). Positions come from a Fenwick tree over the sublist lengths
+    in O(log n); it is rebuilt in O(n / load) only when a sublist is split or removed.
+    """
+
+    def __init__(self, load: int = 500) -> None:
+        """Args:
+            load (int): The target sublist length; a sublist is split in two once it exceeds twice that.
+        """
+        self._load: int = load
+        self._lists: List[List[OrderKey]] = []
+        self._maxes: List[OrderKey] = []
+        self._tree: List[int] | None = None  # Дерево Фенвика по длинам подсписков, None — перестроить
+        self._len: int = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def build(self, keys: Iterable[OrderKey]) -> None:
+        """Replaces the contents with `keys`, in any order."""
+        ordered: List[OrderKey] = sorted(keys)
+        self._lists = [ordered[start:start + self._load] for start in range(0, len(ordered), self._load)]
+        self._maxes = [part[-1] for part in self._lists]
+        self._tree = None
+        self._len = len(ordered)
+
+    def clear(self) -> None:
+        self.build(())
+
+    def add(self, key: OrderKey) -> None:
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            self._len = 1
+            return
+        index: int = bisect.bisect_left(self._maxes, key)
+        if index == len(self._lists):
+            # Ключ больше всех: дописываем в конец последнего списка
+            index -= 1
+            self._lists[index].append(key)
+            self._maxes[index] = key
+        else:
+            bisect.insort(self._lists[index], key)
+        self._len += 1
+        keys: List[OrderKey] = self._lists[index]
+        if len(keys) > 2 * self._load:
+            self._lists[index:index + 1] = [keys[:self._load], keys[self._load:]]
+            self._maxes[index:index + 1] = [keys[self._load - 1], keys[-1]]
+            self._tree = None
+        else:
+            self._tree_add(index, 1)
+
+    def remove(self, key: OrderKey) -> None:
+        """Removes a key that is present."""
+        index: int = bisect.bisect_left(self._maxes, key)
+        keys: List[OrderKey] = self._lists[index]
+        del keys[bisect.bisect_left(keys, key)]
+        self._len -= 1
+        if keys:
+            self._maxes[index] = keys[-1]
+            self._tree_add(index, -1)
+        else:
+            del self._lists[index]
+            del self._maxes[index]
+            self._tree = None
+
+    def bisect_left(self, key: OrderKey | Tuple[int]) -> int:
+        """Returns the number of keys less than `key`."""
+        index: int = bisect.bisect_left(self._maxes, key)
+        if index == len(self._lists):
+            return self._len
+        return self._prefix(index) + bisect.bisect_left(self._lists[index], key)
+
+    def __getitem__(self, position: int) -> OrderKey:
+        if not 0 <= position < self._len:
+            raise IndexError(position)
+        # Спуск по дереву Фенвика: последний подсписок, перед которым не больше `position` ключей
+        tree: List[int] = self._fenwick()
+        index: int = 0
+        step: int = 1 << (len(self._lists).bit_length() - 1)
+        while step:
+            if index + step <= len(self._lists) and tree[index + step] <= position:
+                index += step
+                position -= tree[index]
+            step >>= 1
+        return self._lists[index][position]
+
+    def head(self, count: int) -> List[OrderKey]:
+        """Returns the `count` smallest keys, smallest first."""
+        result: List[OrderKey] = []
+        for keys in self._lists:
+            if len(result) >= count:
+                break
+            result.extend(keys[:count - len(result)])
+        return result
+
+    def _fenwick(self) -> List[int]:
+        if self._tree is None:
+            tree: List[int] = [0] + [len(keys) for keys in self._lists]
+            for node in range(1, len(tree)):
+                parent: int = node + (node & -node)
+                if parent < len(tree):
+                    tree[parent] += tree[node]
+            self._tree = tree
+        return self._tree
+
+    def _tree_add(self, index: int, delta: int) -> None:
+        if self._tree is None:
+            return  # Перестроится при следующем запросе позиции
+        node: int = index + 1
+        while node < len(self._tree):
+            self._tree[node] += delta
+            node += node & -node
+
+    def _prefix(self, index: int) -> int:
+        """Returns the number of keys in the sublists before `index`."""
+        tree: List[int] = self._fenwick()
+        total: int = 0
+        while index:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+class Leaderboard:
+    """In-process index of users ordered by stitches, with a memoized /top text.
+
+    The index is filled from the database by `loader` on first use (or explicitly via
+    warm()) and afterwards kept up to date by the db layer after each commit, so reading
+    the top does not touch SQLite.
+
+    When other processes write to the same database, `changes` lets the index follow them:
+    at most once per `sync_interval` seconds a read first applies the users they changed.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[LeaderboardRow]], size: int = 10,
+                 changes: ChangesLoader | None = None, sync_interval: float = 1.0) -> None:
+        """Args:
+            loader (Callable[[], Iterable[LeaderboardRow]]): Returns all users as (user_id, name, stitches, bouquet).
+            size (int): How many users the memoized top contains.
+            changes (ChangesLoader | None): Returns the users changed since a watermark, or None
+                if this process is the only writer.
+            sync_interval (float): The minimum time between two catch-ups with `changes`, in seconds.
+        """
+        self._loader: Callable[[], Iterable[LeaderboardRow]] = loader
+        self._size: int = size
+        self._changes: ChangesLoader | None = changes
+        self._sync_interval: float = sync_interval
+        self._watermark: str | None = None
+        self._synced: float = 0.0
+        self._lock: threading.RLock = threading.RLock()
+        self._users: Dict[int, Tuple[str, int, str]] = {}
+        self._order: RankIndex = RankIndex()  # (-stitches, user_id), по возрастанию
+        self._warm: bool = False
+        self._top: Tuple[TopEntry, ...] = ()
+        self._rendered: str | None = None
+
+    def warm(self) -> None:
+        """(Re)loads the whole index from the database."""
+        with self._lock:
+            self._users.clear()
+            if self._changes is not None:
+                # Отметку берём до чтения, чтобы изменения во время загрузки попали в следующую синхронизацию
+                self._watermark, _ = self._changes(None)
+                self._synced = time.monotonic()
+            for user_id, name, stitches, bouquet in self._loader():
+                self._users[user_id] = (name, stitches, bouquet)
+            self._order.build((-stitches, user_id) for user_id, (_, stitches, _) in self._users.items())
+            self._warm = True
+            self._refresh_top()
+
+    def clear(self) -> None:
+        """Empties the index, e.g. after all user data has been deleted."""
+        with self._lock:
+            self._users.clear()
+            self._order.clear()
+            self._warm = True
+            self._refresh_top()
+
+    def invalidate(self) -> None:
+        """Drops the index so that the next read reloads it from the database."""
+        with self._lock:
+            self._warm = False
+            self._rendered = None
+
+    def update(self, user_id: int, name: str, stitches: int, bouquet: str) -> None:
+        """Records the committed state of one user.
+
+        Args:
+            user_id (int): The ID of the user.
+            name (str): The name of the user.
+            stitches (int): The user's stitch total.
+            bouquet (str): The user's rendered bouquet.
+        """
+        with self._lock:
+            if not self._warm:
+                return  # Индекс всё равно будет загружен из базы целиком
+            self._put(user_id, name, stitches, bouquet)
+            self._refresh_top()
+
+    def sync(self) -> None:
+        """Applies the users changed by other processes, if `changes` is set and the last
+        catch-up is older than `sync_interval`. Called by every read."""
+        with self._lock:
+            if self._changes is None or not self._warm or time.monotonic() - self._synced < self._sync_interval:
+                return
+            self._synced = time.monotonic()
+            watermark, rows = self._changes(self._watermark)
+            if not self._warm:
+                return  # Пока читали изменения, сменился сезон и индекс сброшен
+            self._watermark = watermark
+            for user_id, name, stitches, bouquet in rows:
+                self._put(user_id, name, stitches, bouquet)
+            self._refresh_top()
+
+    def top(self) -> List[TopEntry]:
+        """Returns the top users as (name, stitches, bouquet), best first.
+
+        Returns:
+            List[TopEntry]: At most `size` entries.
+        """
+        with self._lock:
+            self.sync()
+            if not self._warm:
+                self.warm()
+            return list(self._top)
+
+    def rank(self, user_id: int) -> RankEntry | None:
+        """Finds a user's place by binary search in the RankIndex, without sorting or SQL.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            RankEntry | None: The user's place, or None if the user is not in the garden.
+        """
+        with self._lock:
+            self.sync()
+            if not self._warm:
+                self.warm()
+            user: Tuple[str, int, str] | None = self._users.get(user_id)
+            if user is None:
+                return None
+            name, stitches, bouquet = user
+            # Число участников строго впереди: ключи (-stitches,) меньше любых (-stitches, user_id)
+            ahead: int = self._order.bisect_left((-stitches,))
+            next_name: str | None = None
+            next_stitches: int | None = None
+            if ahead:
+                next_name, next_stitches, _ = self._users[self._order[ahead - 1][1]]
+            return RankEntry(ahead + 1, len(self._order), name, stitches, bouquet, next_name, next_stitches)
+
+    def render(self, renderer: Callable[[List[TopEntry]], str]) -> str:
+        """Returns the /top text, calling `renderer` only when the top has changed.
+
+        Args:
+            renderer (Callable[[List[TopEntry]], str]): Builds the message text from the top entries.
+
+        Returns:
+            str: The rendered text.
+        """
+        with self._lock:
+            self.sync()
+            if not self._warm:
+                self.warm()
+            if self._rendered is None:
+                self._rendered = renderer(list(self._top))
+            return self._rendered
+
+    def _put(self, user_id: int, name: str, stitches: int, bouquet: str) -> None:
+        """Moves a user to their new place in the ordered index; the caller holds the lock."""
+        previous: Tuple[str, int, str] | None = self._users.get(user_id)
+        if previous is not None:
+            self._order.remove((-previous[1], user_id))
+        self._users[user_id] = (name, stitches, bouquet)
+        self._order.add((-stitches, user_id))
+
+    def _refresh_top(self) -> None:
+        """Recomputes the top slice and drops the memoized text if it changed."""
+        top: Tuple[TopEntry, ...] = tuple(
+            self._users[user_id] for _, user_id in self._order.head(self._size)
+        )
+        if top != self._top:
+            self._top = top
+            self._rendered = None
+
+class LeaderboardCache:
+    """Per-chat leaderboards, of which at most `capacity` are kept in memory.
+
+    Leaderboards are created and warmed lazily on the first read for a chat; the least
+    recently read one is dropped when the cache is full. Updates for a chat that is not
+    cached are ignored, since its leaderboard will be loaded from the database anyway.
+    """
+
+    def __init__(self, loader: Callable[[int], Iterable[LeaderboardRow]], capacity: int = 64, size: int = 10) -> None:
+        """Args:
+            loader (Callable[[int], Iterable[LeaderboardRow]]): Returns all users of a chat as (user_id, name, stitches, bouquet).
+            capacity (int): How many chats' leaderboards to keep.
+            size (int): How many users each memoized top contains.
+        """
+        self._loader: Callable[[int], Iterable[LeaderboardRow]] = loader
+        self._capacity: int = capacity
+        self._size: int = size
+        self._changes: Callable[[int, str | None], Tuple[str, Iterable[LeaderboardRow]]] | None = None
+        self._sync_interval: float = 1.0
+        self._boards: OrderedDict[int, Leaderboard] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Leaderboard:
+        """Returns the leaderboard of a chat, creating it if needed.
+
+        Args:
+            chat_id (int): The ID of the chat.
+
+        Returns:
+            Leaderboard: The chat's leaderboard; it warms itself on first read.
+        """
+        with self._lock:
+            board: Leaderboard | None = self._boards.get(chat_id)
+            if board is None:
+                board = Leaderboard(
+                    loader=lambda: self._loader(chat_id), size=self._size,
+                    changes=(lambda since: self._changes(chat_id, since)) if self._changes is not None else None,
+                    sync_interval=self._sync_interval,
+                )
+                self._boards[chat_id] = board
+                if len(self._boards) > self._capacity:
+                    self._boards.popitem(last=False)
+            else:
+                self._boards.move_to_end(chat_id)
+            return board
+
+    def follow(self, changes: Callable[[int, str | None], Tuple[str, Iterable[LeaderboardRow]]],
+               sync_interval: float) -> None:
+        """Makes the leaderboards catch up with writes of other processes; see Leaderboard.
+
+        Args:
+            changes (Callable[[int, str | None], Tuple[str, Iterable[LeaderboardRow]]]): Returns
+                the users of a chat changed since a watermark, together with the new watermark.
+            sync_interval (float): The minimum time between two catch-ups of one chat, in seconds.
+        """
+        with self._lock:
+            self._changes = changes
+            self._sync_interval = sync_interval
+            boards: List[Leaderboard] = list(self._boards.values())
+            self._boards.clear()
+        for board in boards:
+            board.invalidate()
+
+    def update(self, chat_id: int, user_id: int, name: str, stitches: int, bouquet: str) -> None:
+        """Records the committed state of one user, if the chat's leaderboard is cached."""
+        with self._lock:
+            board: Leaderboard | None = self._boards.get(chat_id)
+        if board is not None:
+            board.update(user_id, name, stitches, bouquet)
+
+    def clear(self, chat_id: int) -> None:
+        """Empties a chat's leaderboard, e.g. after its garden has been reset."""
+        with self._lock:
+            board: Leaderboard | None = self._boards.get(chat_id)
+        if board is not None:
+            board.clear()
+
+    def invalidate(self, chat_id: int | None = None) -> None:
+        """Drops one chat's leaderboard, or all of them, so they are reloaded from the database.
+
+        Args:
+            chat_id (int | None): The chat, or None for every chat.
+        """
+        with self._lock:
+            if chat_id is None:
+                boards: List[Leaderboard] = list(self._boards.values())
+                self._boards.clear()
+            else:
+                board: Leaderboard | None = self._boards.pop(chat_id, None)
+                boards = [board] if board is not None else []
+        for board in boards:
+            board.invalidate()
@@ -0,0 +1,214 @@
+import asyncio
+import datetime
+import functools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from loguru import logger
+from typing import Any, Callable, Dict, TextIO, Tuple
+from metrics import METRICS
+
+# Поля записи loguru, которые не копируются в JSON как пользовательские
+_RESERVED_EXTRA: Tuple[str, ...] = ("exc_info",)
+
+# (время, уровень, номер уровня, сообщение, модуль, функция, строка, поля, трассировка)
+_QueuedRecord = Tuple[datetime.datetime, str, int, str, str, str, int, Dict[str, Any], str | None]
+
+class EventRateLimiter:
+    """Lets through at most `rate` records per second for each event name and counts the rest.
+
+    Records opt in by binding an `event` field, e.g. logger.bind(event="duplicate").debug(...).
+    """
+
+    def __init__(self, rate: int) -> None:
+        self._rate: int = rate
+        self._windows: Dict[str, Tuple[int, int]] = {}  # событие -> (секунда, записей в ней)
+        self._lock: threading.Lock = threading.Lock()
+
+    def allow(self, event: str) -> bool:
+        second: int = int(time.monotonic())
+        with self._lock:
+            window_second, count = self._windows.get(event, (second, 0))
+            if window_second != second:
+                count = 0
+            self._windows[event] = (second, count + 1)
+            return count < self._rate
+
+class QueueSink:
+    """loguru sink that hands records to a background thread, which writes them as JSON lines.
+
+    The calling thread only copies the record into a bounded queue. When the queue is full the
+    record is dropped and counted in METRICS as log_dropped; the writer reports the number of
+    dropped records in the log itself once it catches up. The file is rotated by size.
+    """
+
+    def __init__(self, path: str, rotation_bytes: int, queue_size: int, console_level: int,
+                 rate_limiter: EventRateLimiter) -> None:
+        """Args:
+            path (str): The JSON log file.
+            rotation_bytes (int): The size at which the file is renamed and a new one started.
+            queue_size (int): How many records may wait for the writer.
+            console_level (int): The minimum level number also printed to stderr as text.
+            rate_limiter (EventRateLimiter): Limits records that carry an `event` field.
+        """
+        self._path: str = path
+        self._rotation_bytes: int = rotation_bytes
+        self._console_level: int = console_level
+        self._rate_limiter: EventRateLimiter = rate_limiter
+        self._queue: queue.Queue[_QueuedRecord | None] = queue.Queue(maxsize=queue_size)
+        self._dropped: int = 0
+        self._dropped_lock: threading.Lock = threading.Lock()
+        self._reported: int = 0
+        self._file: TextIO | None = None
+        self._thread: threading.Thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def __call__(self, message: Any) -> None:
+        record: Dict[str, Any] = message.record
+        extra: Dict[str, Any] = record["extra"]
+        event: str | None = extra.get("event")
+        if event is not None and not self._rate_limiter.allow(event):
+            METRICS.increment("log_suppressed", event)
+            return
+        exception: str | None = None
+        if record["exception"] is not None:
+            exception = "".join(traceback.format_exception(*record["exception"]))
+        elif extra.get("exc_info") and sys.exc_info()[0] is not None:
+            # Вызовы logger.error(..., exc_info=True) выполняются внутри except: трассировку берём отсюда
+            exception = traceback.format_exc()
+        try:
+            self._queue.put_nowait((
+                record["time"], record["level"].name, record["level"].no, record["message"],
+                record["name"], record["function"], record["line"], dict(extra), exception,
+            ))
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+            METRICS.increment("log_dropped", record["level"].name)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Writes out the queued records and stops the writer thread."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            self._file = open(self._path, "a", encoding="utf-8")
+        return self._file
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        stamp: str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        root, extension = os.path.splitext(self._path)
+        os.replace(self._path, f"{root}.{stamp}{extension}")
+
+    def _write(self, item: _QueuedRecord) -> None:
+        moment, level, level_no, text, module, function, line, extra, exception = item
+        document: Dict[str, Any] = {
+            "time": moment.isoformat(timespec="milliseconds"), "level": level, "message": text,
+            "module": module, "function": function, "line": line,
+        }
+        document.update((key, value) for key, value in extra.items() if key not in _RESERVED_EXTRA)
+        if exception is not None:
+            document["exception"] = exception
+        file: TextIO = self._open()
+        file.write(json.dumps(document, ensure_ascii=False, default=str) + "\n")
+        if level_no >= self._console_level:
+            sys.stderr.write(f"{moment:%Y-%m-%d %H:%M:%S.%f} | {level:<8} | {module}:{function}:{line} - {text}\n")
+            if exception is not None:
+                sys.stderr.write(exception)
+        if file.tell() >= self._rotation_bytes:
+            self._rotate()
+
+    def _run(self) -> None:
+        while True:
+            item: _QueuedRecord | None = self._queue.get()
+            try:
+                # Пишем всё, что накопилось, и сбрасываем буфер файла, только когда очередь опустела
+                while item is not None:
+                    self._write(item)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self._flush()
+            except Exception as e:
+                sys.stderr.write(f"Ошибка записи журнала: {e}\n")
+            if item is None:
+                return
+
+    def _flush(self) -> None:
+        """Reports newly dropped records and flushes the file; called whenever the queue runs empty."""
+        dropped: int = self._dropped
+        if dropped != self._reported:
+            now: datetime.datetime = datetime.datetime.now().astimezone()
+            self._write((now, "WARNING", 30, f"Очередь журнала переполнялась, потеряно записей: {dropped - self._reported}",
+                         __name__, "_flush", 0, {"dropped_total": dropped}, None))
+            self._reported = dropped
+        if self._file is not None:
+            self._file.flush()
+        sys.stderr.flush()
+
+def setup_logging(path: str, level: str, console_level: str, rotation_mb: int, queue_size: int,
+                  event_rate: int) -> QueueSink:
+    """Replaces loguru's default synchronous stderr handler with a QueueSink.
+
+    Args:
+        path (str): The JSON log file.
+        level (str): The minimum level that is logged at all.
+        console_level (str): The minimum level also printed to stderr.
+        rotation_mb (int): The file size, in MB, at which the log is rotated.
+        queue_size (int): How many records may wait for the writer before new ones are dropped.
+        event_rate (int): Records per second let through for each `event`-tagged kind of record.
+
+    Returns:
+        QueueSink: The sink; close() it on shutdown to write out the queue.
+    """
+    logger.remove()
+    sink: QueueSink = QueueSink(path, rotation_mb * 1024 * 1024, queue_size, logger.level(console_level).no,
+                                EventRateLimiter(event_rate))
+    logger.add(sink, level=level, format="{message}", catch=True)
+    return sink
+
+def log_context(handler: str) -> Callable[[Callable], Callable]:
+    """Decorator for command callbacks: tags every record logged inside with the handler name,
+    chat_id and user_id, and logs one record with the command's duration when it finishes.
+
+    Args:
+        handler (str): The handler name, e.g. "add".
+
+    Returns:
+        Callable[[Callable], Callable]: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(message: Any, *args: Any, **kwargs: Any) -> Any:
+                with logger.contextualize(handler=handler, chat_id=message.chat.id, user_id=message.from_user.id):
+                    started: float = time.perf_counter()
+                    try:
+                        return await func(message, *args, **kwargs)
+                    finally:
+                        logger.info("Команда {handler} обработана за {duration_ms:.2f} мс", handler=handler,
+                                    duration_ms=1000 * (time.perf_counter() - started))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(message: Any, *args: Any, **kwargs: Any) -> Any:
+            with logger.contextualize(handler=handler, chat_id=message.chat.id, user_id=message.from_user.id):
+                started: float = time.perf_counter()
+                try:
+                    return func(message, *args, **kwargs)
+                finally:
+                    logger.info("Команда {handler} обработана за {duration_ms:.2f} мс", handler=handler,
+                                duration_ms=1000 * (time.perf_counter() - started))
+        return wrapper
+    return decorator
@@ -1,15 +1,28 @@
 from messages import M
+import asyncio
+import atexit
 import sqlite3
 import csv
 import io
+import multiprocessing
 import os
 import telebot
+import telebot.asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
 from loguru import logger
 from typing import Any, Set, Tuple, List
-from config import TOKEN, ALLOWED_CHAT_ID, ADMIN_ID, FLOWER_THRESHOLD
+from config import (
+    TOKEN, ALLOWED_CHAT_ID, ALLOWED_CHAT_IDS, ADMIN_ID, FLOWER_THRESHOLD, FLOWER_AWARD_LOG, BOT_MODE, UPDATE_MODE,
+    STITCH_EVENT_LOG, STATS_UTC_OFFSET,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, TELEGRAM_API_URL,
+    SNAPSHOT_DIR, SNAPSHOT_INTERVAL, SNAPSHOT_KEEP, SNAPSHOT_GZIP, METRICS_ENABLED, METRICS_PORT,
+    OUTBOX_ENABLED, BACKFILL_BATCH_SIZE, BACKFILL_PAUSE_MS,
+    LOG_FILE, LOG_LEVEL, LOG_CONSOLE_LEVEL, LOG_ROTATION_MB, LOG_QUEUE_SIZE, LOG_EVENT_RATE,
+    WORKERS, SHARED_DB, LEADERBOARD_SYNC_MS, POLL_BATCH_SIZE, POLL_TIMEOUT, POLL_WORKERS
+)
 from db import (
-    init_db, add_user, update_stitches, get_user,
-    reset_all, get_top_users, subtract_stitches,
+    close_connections, add_user, update_stitches, get_user,
+    get_top_users, subtract_stitches,
     get_all_users_with_headers
 )
 from export import export_users_to_csv
@@ -18,16 +31,51 @@ from flowers import (
     BASE_FLOWERS, ADVANCED_FLOWERS, ALL_FLOWERS
 )
 
-from handlers.start import register_start_handler
-from handlers.add import register_add_handler
-from handlers.top import register_top_handler
-from handlers.backup import register_backup_handler
-from handlers.reset import register_reset_handler
+import db
+import metrics
+from logsink import setup_logging
+from metrics import instrument_bot, start_prometheus_server
+from migrations import init_db, start_backfills
+from outbox import OUTBOX
+from poller import UpdatePoller
+from snapshot import start_snapshot_scheduler
+from webhook import run_webhook
+from workers import WorkerPool, RoutedUpdate, decode_update
+from writebehind import STITCH_WRITER
+
+from handlers.start import register_start_handler, register_start_handler_async
+from handlers.add import register_add_handler, register_add_handler_async
+from handlers.top import register_top_handler, register_top_handler_async
+from handlers.me import register_me_handler, register_me_handler_async
+from handlers.backup import register_backup_handler, register_backup_handler_async
+from handlers.reset import register_reset_handler, register_reset_handler_async
+from handlers.stats import register_stats_handler, register_stats_handler_async
 
 # ---------------- ИНИЦИАЛИЗАЦИЯ ----------------
-bot: telebot.TeleBot = telebot.TeleBot(TOKEN)
-init_db()
-logger.add("bot.log", format="{time} {level} {message}", level="INFO", rotation="5 MB")
+# Журнал пишет фоновый поток, обработчики только ставят записи в очередь. Воркеры пула
+# пишут каждый в свой файл: ротацию одного файла несколько процессов не поделят
+WORKER_NAME: str = multiprocessing.current_process().name
+if WORKER_NAME != "MainProcess":
+    LOG_FILE = "{0}.{2}{1}".format(*os.path.splitext(LOG_FILE), WORKER_NAME)
+LOG_SINK = setup_logging(LOG_FILE, LOG_LEVEL, LOG_CONSOLE_LEVEL, LOG_ROTATION_MB, LOG_QUEUE_SIZE, LOG_EVENT_RATE)
+atexit.register(LOG_SINK.close)  # atexit идёт в обратном порядке: журнал закрывается последним
+metrics.ENABLED = METRICS_ENABLED
+db.FLOWER_AWARD_LOG = FLOWER_AWARD_LOG
+db.STITCH_EVENT_LOG = STITCH_EVENT_LOG
+db.STATS_UTC_OFFSET = STATS_UTC_OFFSET
+if SHARED_DB:
+    db.enable_shared_mode(LEADERBOARD_SYNC_MS / 1000)
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = telebot.asyncio_helper.API_URL = TELEGRAM_API_URL
+# Обновления обрабатывают потоки UpdatePoller или webhook-сервера, собственный пул telebot не нужен:
+# смещение можно сдвигать, только когда обработчики действительно закончили
+bot: telebot.TeleBot = telebot.TeleBot(TOKEN, threaded=False)
+# Заполнения данных после миграций идут в фоне, пока бот уже отвечает
+init_db(legacy_chat_id=ALLOWED_CHAT_ID or None, backfill=False)
+atexit.register(close_connections)
+atexit.register(STITCH_WRITER.close)  # выполняется раньше close_connections
+atexit.register(OUTBOX.close)  # дослать ответы, ожидающие в очереди
+instrument_bot(bot)
 
 def handle_error(update: telebot.types.Update, error: Exception) -> None:
     """Global error handler for the bot. Sends error details to the admin.
@@ -36,38 +84,118 @@ def handle_error(update: telebot.types.Update, error: Exception) -> None:
         update (telebot.types.Update): The update object that caused the error.
         error (Exception): The exception that was raised.
     """
-    logger.error(f"Произошла необработанная ошибка: {error}", exc_info=True)
+    logger.error("Произошла необработанная ошибка: {error}", error=error, exc_info=True)
     error_message = f"Произошла ошибка: {error}"
 
     if ADMIN_ID:
         try:
             bot.send_message(ADMIN_ID, f"Критическая ошибка бота: {error_message}\nОбновление: {update}")
-            logger.info(f"Сообщение об ошибке отправлено администратору {ADMIN_ID}.")
+            logger.info("Сообщение об ошибке отправлено администратору {admin_id}.", admin_id=ADMIN_ID)
         except Exception as e:
-            logger.error(f"Не удалось отправить сообщение об ошибке администратору {ADMIN_ID}: {e}", exc_info=True)
+            logger.error("Не удалось отправить сообщение об ошибке администратору {admin_id}: {error}",
+                         admin_id=ADMIN_ID, error=e, exc_info=True)
 
 # Зарегистрировать обработчики команд
 register_start_handler(bot)
 register_add_handler(bot)
 register_top_handler(bot)
+register_me_handler(bot)
 register_backup_handler(bot)
 register_reset_handler(bot)
+register_stats_handler(bot)
 
 # Зарегистрировать глобальный обработчик ошибок
 bot.callback_query_handler(func=lambda call: True)(handle_error) # Это для перехвата ошибок из колбэков, но не из сообщений
 
-# ---------------- ЗАПУСК ----------------
-if __name__ == "__main__":
-    print("Бот запущен 🌿")
-    logger.info("Бот запущен")
+def create_async_bot() -> AsyncTeleBot:
+    """Creates the asyncio bot with the async variants of all command handlers.
+
+    Returns:
+        AsyncTeleBot: The configured bot.
+    """
+    async_bot: AsyncTeleBot = AsyncTeleBot(TOKEN)
+    instrument_bot(async_bot)
+    register_start_handler_async(async_bot)
+    register_add_handler_async(async_bot)
+    register_top_handler_async(async_bot)
+    register_me_handler_async(async_bot)
+    register_backup_handler_async(async_bot)
+    register_reset_handler_async(async_bot)
+    register_stats_handler_async(async_bot)
+    return async_bot
+
+def run_worker(updates: multiprocessing.Queue) -> None:
+    """Main function of a WorkerPool process: handles the updates routed to it one at a time until it gets None.
 
+    Args:
+        updates (multiprocessing.Queue): The worker's queue of RoutedUpdate items.
+    """
+    if OUTBOX_ENABLED:
+        OUTBOX.start(bot)
+    logger.info("Воркер {worker} готов к обработке обновлений.", worker=WORKER_NAME)
     while True:
+        routed: RoutedUpdate | None = updates.get()
+        if routed is None:
+            break
         try:
-            logger.info("Начинаем опрос Telegram API...")
-            bot.polling(non_stop=True, interval=3, timeout=60)
+            bot.process_new_updates([decode_update(routed)])
         except Exception as e:
-            logger.error(M["polling_error"].format(error=e), exc_info=True)
-            bot.stop_polling()
-            import time
-            time.sleep(5)
-            logger.info("Перезапуск опроса через 5 секунд.")
+            logger.error("Ошибка при обработке обновления {update_id}: {error}", update_id=routed[0], error=e,
+                         exc_info=True)
+
+def run_polling() -> None:
+    """Runs the synchronous bot; polling resumes from the update offset stored in the database."""
+    UpdatePoller(bot, POLL_BATCH_SIZE, POLL_TIMEOUT, POLL_WORKERS).run()
+
+async def run_async_polling(async_bot: AsyncTeleBot) -> None:
+    """Runs the asyncio bot: every update is handled in its own task, and all
+    requests share the aiohttp session managed by telebot.asyncio_helper.
+
+    Args:
+        async_bot (AsyncTeleBot): The bot to run.
+    """
+    try:
+        logger.info("Начинаем асинхронный опрос Telegram API...")
+        await async_bot.infinity_polling(timeout=60)
+    finally:
+        await async_bot.close_session()
+
+# ---------------- ЗАПУСК ----------------
+if __name__ == "__main__":
+    print("Бот запущен 🌿")
+    logger.info("Бот запущен, режим: {mode}, садов: {gardens}", mode=BOT_MODE, gardens=len(ALLOWED_CHAT_IDS))
+
+    if METRICS_ENABLED and METRICS_PORT:
+        start_prometheus_server(METRICS_PORT)
+        logger.info("Метрики Prometheus доступны на http://127.0.0.1:{port}/metrics", port=METRICS_PORT)
+
+    if OUTBOX_ENABLED:
+        # Очередь отправляет через синхронный бот и в режиме BOT_MODE=async
+        OUTBOX.start(bot)
+
+    start_backfills(BACKFILL_BATCH_SIZE, BACKFILL_PAUSE_MS / 1000)
+
+    if SNAPSHOT_INTERVAL > 0:
+        start_snapshot_scheduler(SNAPSHOT_DIR, SNAPSHOT_INTERVAL, SNAPSHOT_KEEP, SNAPSHOT_GZIP)
+
+    if WORKERS > 1 and UPDATE_MODE != "webhook":
+        raise ValueError("WORKERS > 1 поддерживается только с UPDATE_MODE=webhook.")
+    if UPDATE_MODE == "webhook":
+        if BOT_MODE == "async":
+            raise ValueError("Режим webhook поддерживается только с BOT_MODE=sync.")
+        if not WEBHOOK_URL:
+            raise ValueError("Для режима webhook нужно задать WEBHOOK_URL.")
+        if WORKERS > 1:
+            # Этот процесс только принимает обновления; один поток раздачи сохраняет их порядок
+            pool: WorkerPool = WorkerPool(run_worker, WORKERS, WEBHOOK_QUEUE_SIZE)
+            pool.start()
+            atexit.register(pool.close)
+            run_webhook(bot, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                        WEBHOOK_QUEUE_SIZE, 1, dispatch=pool.dispatch)
+        else:
+            run_webhook(bot, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                        WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS)
+    elif BOT_MODE == "async":
+        asyncio.run(run_async_polling(create_async_bot()))
+    else:
+        run_polling()
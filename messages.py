@@ -20,6 +20,15 @@ M = {
     "top_empty": "Пока никто не добавлял крестики.",
     "top_title": "🏆 Топ 10 участников:\n",
     "top_item": "{index}. {name}: {stitches} крестиков, {flowers}",
+    "top_title_all": "🏆 Топ 10 за все сезоны:\n",
+    "top_title_season": "🏆 Топ 10 сезона {season}:\n",
+    "top_season_empty": "В сезоне {season} никто не добавлял крестики.",
+
+    # Место участника
+    "me_missing": "Тебя пока нет в саду этого сезона. Начни с /add <число> 🌱",
+    "me_rank": "{name}, ты на {rank} месте из {total}: {stitches} крестиков.\nТвой сад: {bouquet}",
+    "me_next": "\nЧтобы обогнать {next_name}, нужно ещё {gap} крестиков.",
+    "me_leader": "\nТы лидируешь! 🏆",
 
     # Бэкап
     "backup_denied": "Эта команда работает только в основном чате 🛡️",
@@ -27,8 +36,25 @@ M = {
 
     # Reset
     "reset_denied": "Эта команда доступна только администратору 🛡️",
-    "reset_done": "Прогресс всех участников сброшен 🌱",
+    "reset_done": "Начался сезон {season} 🌱 Прошлые сезоны сохранены: /top all",
     "reset_error": "Ошибка при сбросе данных: {error}",
+    "reset_unknown_chat": "Чат {chat_id} не входит в сады бота. Укажи сад: /reset <chat_id>",
+
+    # Статистика
+    "stats_denied": "Эта команда доступна только администратору 🛡️",
+    "stats_empty": "Статистика пока не собрана.",
+    "stats_title": "⏱ Время обработки:\n",
+    "stats_garden_unknown": "Чат {chat_id} не входит в сады бота.",
+    "stats_garden_empty": "В этом саду ещё не добавляли крестики с тех пор, как ведётся статистика.",
+    "stats_garden_days": "📊 Крестики за {days} дн.:\n",
+    "stats_garden_day": "{day} {bar} {stitches} (участников: {members})\n",
+    "stats_garden_weeks": "\n📅 По неделям:\n",
+    "stats_garden_week": "с {week} {bar} {stitches}{change}\n",
+    "stats_garden_change": " ({change:+d}% к прошлой)",
+    "stats_garden_streak": "\n🔥 Сад вышивает {current} дн. подряд, рекорд — {longest} дн.\n",
+    "stats_garden_records": "🏆 Лучший день: {day} — {day_stitches}, лучшая неделя: с {week} — {week_stitches}\n",
+    "stats_garden_members": "\n👥 Самые активные за {days} дн.:\n",
+    "stats_garden_member": "{index}. {name}: {stitches} за {active} дн., серия {streak} (рекорд {longest})\n",
 
     # Ошибки
     "polling_error": "Ошибка polling: {error}",
@@ -0,0 +1,223 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+# Границы корзин гистограмм в секундах: от 0.1 мс до 30 с
+BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+ENABLED: bool = True
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is O(log buckets) under a short lock."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index: int = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation inside the bucket that contains it."""
+        with self._lock:
+            counts: List[int] = list(self.counts)
+            total: int = self.count
+            maximum: float = self.max
+        if not total:
+            return 0.0
+        rank: float = q * total
+        seen: int = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower: float = BUCKETS[index - 1] if index > 0 else 0.0
+                upper: float = BUCKETS[index] if index < len(BUCKETS) else maximum
+                return min(maximum, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+        return maximum
+
+class MetricsRegistry:
+    """In-memory histograms and counters, keyed by metric family and a single label value."""
+
+    def __init__(self) -> None:
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str], int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, family: str, label: str, value: float) -> None:
+        """Records a duration in seconds."""
+        histogram: Histogram | None = self.histograms.get((family, label))
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault((family, label), Histogram())
+        histogram.observe(value)
+
+    def increment(self, family: str, label: str, amount: int = 1) -> None:
+        """Increments a counter."""
+        with self._lock:
+            self.counters[(family, label)] = self.counters.get((family, label), 0) + amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+METRICS: MetricsRegistry = MetricsRegistry()
+
+# Имя семейства -> имя метки в Prometheus
+LABELS: Dict[str, str] = {
+    "db_call_seconds": "function",
+    "db_lock_wait_seconds": "function",
+    "db_queries": "function",
+    "handler_seconds": "handler",
+    "log_dropped": "level",
+    "log_suppressed": "event",
+    "outbox_coalesced": "method",
+    "outbox_retries": "reason",
+    "telegram_request_seconds": "method",
+    "updates_polled": "mode",
+}
+
+def timed(family: str, label: str) -> Callable[[Callable], Callable]:
+    """Decorator that records the duration of every call, for plain and async functions.
+
+    Args:
+        family (str): The metric family, e.g. "handler_seconds".
+        label (str): The label value, e.g. the handler name.
+
+    Returns:
+        Callable[[Callable], Callable]: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not ENABLED:
+                    return await func(*args, **kwargs)
+                started: float = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    METRICS.observe(family, label, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not ENABLED:
+                return func(*args, **kwargs)
+            started: float = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                METRICS.observe(family, label, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def instrument_bot(bot: Any) -> None:
+    """Wraps the bot's sending methods so the time spent in Telegram API calls is recorded.
+
+    Works for both telebot.TeleBot and AsyncTeleBot.
+
+    Args:
+        bot (Any): The bot instance.
+    """
+    for method in ("send_message", "reply_to", "send_document"):
+        setattr(bot, method, timed("telegram_request_seconds", method)(getattr(bot, method)))
+
+def render_report() -> str:
+    """Renders all metrics as a short plain-text report for /stats.
+
+    Returns:
+        str: The report.
+    """
+    lines: List[str] = []
+    for (family, label), histogram in sorted(METRICS.histograms.items()):
+        if not histogram.count:
+            continue
+        lines.append(
+            f"{family}[{label}]: n={histogram.count} "
+            f"avg={1000 * histogram.sum / histogram.count:.2f} "
+            f"p50={1000 * histogram.quantile(0.5):.2f} p95={1000 * histogram.quantile(0.95):.2f} "
+            f"p99={1000 * histogram.quantile(0.99):.2f} max={1000 * histogram.max:.2f} мс"
+        )
+    for (family, label), value in sorted(METRICS.counters.items()):
+        lines.append(f"{family}[{label}]: {value}")
+    return "\n".join(lines)
+
+def render_prometheus() -> str:
+    """Renders all metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines: List[str] = []
+    families: Dict[str, List[Tuple[str, Histogram]]] = {}
+    for (family, label), histogram in sorted(METRICS.histograms.items()):
+        families.setdefault(family, []).append((label, histogram))
+    for family, histograms in families.items():
+        name: str = f"garden_{family}"
+        label_name: str = LABELS.get(family, "name")
+        lines.append(f"# TYPE {name} histogram")
+        for label, histogram in histograms:
+            cumulative: int = 0
+            for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label_name}="{label}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{{label_name}="{label}"}} {histogram.count}')
+    counter_families: Dict[str, List[Tuple[str, int]]] = {}
+    for (family, label), value in sorted(METRICS.counters.items()):
+        counter_families.setdefault(family, []).append((label, value))
+    for family, values in counter_families.items():
+        name = f"garden_{family}_total"
+        label_name = LABELS.get(family, "name")
+        lines.append(f"# TYPE {name} counter")
+        for label, value in values:
+            lines.append(f'{name}{{{label_name}="{label}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def start_prometheus_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves render_prometheus() at /metrics from a daemon thread.
+
+    Args:
+        port (int): The port to listen on.
+        host (str): The address to listen on; localhost by default.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body: bytes = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), RequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,547 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from loguru import logger
+from typing import Callable, Dict, List, Tuple
+from db import (
+    BACKFILL_BATCH_SIZE, with_db_connection, backfill_bouquets, backfill_bouquets_batch,
+    check_bouquet_consistency, set_flower_threshold
+)
+from flowers import BOUQUET_COUNT_SIGN
+
+# Схема таблиц на момент миграций 1 и 2; менять их нельзя, новая схема задаётся новой миграцией.
+# Сады разных чатов живут в одних таблицах и различаются по chat_id
+_USERS_COLUMNS: str = '''(
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    name TEXT,
+    stitches INTEGER DEFAULT 0,
+    caterpillars INTEGER DEFAULT 0,
+    flower_count INTEGER NOT NULL DEFAULT 0,
+    bouquet TEXT NOT NULL DEFAULT '',
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, user_id)
+)'''
+_USER_FLOWERS_COLUMNS: str = '''(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    flower_name TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY (chat_id, user_id) REFERENCES users (chat_id, user_id) ON DELETE CASCADE
+)'''
+# Сколько цветочков каждого вида у участника: не больше len(ALL_FLOWERS) строк на человека
+_USER_FLOWER_COUNTS_COLUMNS: str = '''(
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    flower_name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id, flower_name),
+    FOREIGN KEY (chat_id, user_id) REFERENCES users (chat_id, user_id) ON DELETE CASCADE
+) WITHOUT ROWID'''
+
+# С миграции 7 строки участника принадлежат сезону; прошлые сезоны остаются в тех же таблицах
+_SEASON_USERS_COLUMNS: str = '''(
+    chat_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    name TEXT,
+    stitches INTEGER DEFAULT 0,
+    caterpillars INTEGER DEFAULT 0,
+    flower_count INTEGER NOT NULL DEFAULT 0,
+    bouquet TEXT NOT NULL DEFAULT '',
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, season, user_id)
+)'''
+_SEASON_USER_FLOWERS_COLUMNS: str = '''(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    flower_name TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY (chat_id, season, user_id) REFERENCES users (chat_id, season, user_id) ON DELETE CASCADE
+)'''
+_SEASON_USER_FLOWER_COUNTS_COLUMNS: str = '''(
+    chat_id INTEGER NOT NULL,
+    season INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    flower_name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, season, user_id, flower_name),
+    FOREIGN KEY (chat_id, season, user_id) REFERENCES users (chat_id, season, user_id) ON DELETE CASCADE
+) WITHOUT ROWID'''
+
+def _split_legacy_garden(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    """Rebuilds single-garden users and user_flowers tables with a chat_id column.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        legacy_chat_id (int | None): The chat the existing data belongs to.
+    """
+    c.execute('SELECT EXISTS (SELECT 1 FROM users)')
+    if c.fetchone()[0] and legacy_chat_id is None:
+        raise ValueError("В базе есть данные одного сада: укажите чат, которому они принадлежат.")
+    c.execute('ALTER TABLE user_flowers RENAME TO user_flowers_legacy')
+    c.execute('ALTER TABLE users RENAME TO users_legacy')
+    c.execute(f'CREATE TABLE users {_USERS_COLUMNS}')
+    c.execute(f'CREATE TABLE user_flowers {_USER_FLOWERS_COLUMNS}')
+    c.execute('''INSERT INTO users (chat_id, user_id, name, stitches, caterpillars, flower_count, bouquet, updated_at)
+                 SELECT ?, user_id, name, stitches, caterpillars, flower_count, bouquet, updated_at
+                 FROM users_legacy''', (legacy_chat_id,))
+    c.execute('''INSERT INTO user_flowers (id, chat_id, user_id, flower_name, created_at)
+                 SELECT id, ?, user_id, flower_name, created_at FROM user_flowers_legacy''', (legacy_chat_id,))
+    c.execute('DROP TABLE user_flowers_legacy')
+    c.execute('DROP TABLE users_legacy')
+
+@dataclass(frozen=True)
+class Migration:
+    """One schema step; `upgrade` runs in a single transaction together with the user_version bump."""
+    version: int
+    description: str
+    upgrade: Callable[[sqlite3.Cursor, int | None], None]  # (курсор, чат базы с одним садом)
+
+# Пакетные заполнения данных: имя -> функция одной пачки (позиция -> (новая позиция или None, обновлено строк))
+BACKFILLS: Dict[str, Callable[[Tuple[int, ...] | None, int], Tuple[Tuple[int, ...] | None, int]]] = {
+    "bouquets": backfill_bouquets_batch,
+}
+
+def _queue_backfill(c: sqlite3.Cursor, name: str) -> None:
+    """Schedules a batched backfill, restarting it from the beginning if it is already queued.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        name (str): A key of BACKFILLS.
+    """
+    c.execute('''INSERT INTO schema_backfills (name, position) VALUES (?, NULL)
+                 ON CONFLICT (name) DO UPDATE SET position = NULL''', (name,))
+
+def _create_gardens(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_backfills (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        position TEXT
+    )''')
+    c.execute(f'CREATE TABLE IF NOT EXISTS users {_USERS_COLUMNS}')
+
+    # Старые базы: добавляем денормализованный букет, он будет заполнен в фоне
+    columns: List[str] = [row[1] for row in c.execute('PRAGMA table_info(users)').fetchall()]
+    if 'flower_count' not in columns:
+        c.execute('ALTER TABLE users ADD COLUMN flower_count INTEGER NOT NULL DEFAULT 0')
+        c.execute("ALTER TABLE users ADD COLUMN bouquet TEXT NOT NULL DEFAULT ''")
+        _queue_backfill(c, "bouquets")
+    # ALTER TABLE не допускает DEFAULT CURRENT_TIMESTAMP, поэтому заполняем отдельно
+    if 'updated_at' not in columns:
+        c.execute('ALTER TABLE users ADD COLUMN updated_at TEXT')
+        c.execute('UPDATE users SET updated_at = CURRENT_TIMESTAMP')
+
+    c.execute(f'CREATE TABLE IF NOT EXISTS user_flowers {_USER_FLOWERS_COLUMNS}')
+
+    # Базы с одним садом: первичный ключ не меняется через ALTER, поэтому пересобираем обе таблицы
+    if 'chat_id' not in columns:
+        _split_legacy_garden(c, legacy_chat_id)
+
+    # Журнал выдачи хранит по строке на вид цветка в каждой выдаче, а не на каждый цветок
+    if 'quantity' not in [row[1] for row in c.execute('PRAGMA table_info(user_flowers)').fetchall()]:
+        c.execute('ALTER TABLE user_flowers ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1')
+
+def _create_flower_counts(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    c.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_flower_counts')")
+    if c.fetchone()[0]:
+        return
+    c.execute(f'CREATE TABLE user_flower_counts {_USER_FLOWER_COUNTS_COLUMNS}')
+    # Счётчики появились позже журнала: сворачиваем журнал в них здесь же, ведь награды сразу пишут в счётчики
+    c.execute('''INSERT INTO user_flower_counts (chat_id, user_id, flower_name, count)
+                 SELECT chat_id, user_id, flower_name, SUM(quantity) FROM user_flowers
+                 GROUP BY chat_id, user_id, flower_name''')
+    if c.rowcount:
+        _queue_backfill(c, "bouquets")
+
+def _create_settings(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Настройки садов; отсутствующие значения берутся из конфигурации
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_settings (
+        chat_id INTEGER PRIMARY KEY,
+        flower_threshold INTEGER
+    )''')
+    # Водяные знаки инкрементального экспорта
+    c.execute('''CREATE TABLE IF NOT EXISTS export_state (
+        name TEXT PRIMARY KEY,
+        watermark TEXT NOT NULL
+    )''')
+    # Обработанные сообщения, для дедупликации между перезапусками
+    c.execute('''CREATE TABLE IF NOT EXISTS processed_messages (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        seen_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_processed_messages_seen ON processed_messages (seen_at)')
+
+def _index_users(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    c.execute('DROP INDEX IF EXISTS idx_stitches')
+    # /top одного чата — проход по диапазону этого индекса
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_chat_stitches ON users (chat_id, stitches DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_updated ON users (updated_at)')
+
+def _index_user_flowers(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user_flowers_user ON user_flowers (chat_id, user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user_flowers_created ON user_flowers (created_at)')
+
+def _compact_bouquets(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Букеты, сохранённые до компактного вида, перечисляли каждый цветок: их выдаёт повторяющийся цветок без счётчика
+    c.execute('''SELECT EXISTS (SELECT 1 FROM user_flower_counts JOIN users USING (chat_id, user_id)
+                 WHERE count > 1 AND instr(bouquet, ?) = 0)''', (BOUQUET_COUNT_SIGN,))
+    if c.fetchone()[0]:
+        _queue_backfill(c, "bouquets")
+
+def _add_seasons(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Текущий сезон сада хранится в chat_settings, законченные сезоны — в seasons
+    c.execute('ALTER TABLE chat_settings ADD COLUMN season INTEGER NOT NULL DEFAULT 1')
+    c.execute('''CREATE TABLE seasons (
+        chat_id INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        ended_at TEXT NOT NULL,
+        PRIMARY KEY (chat_id, season)
+    ) WITHOUT ROWID''')
+    # Сезон входит в первичный ключ, поэтому все три таблицы пересобираются; данные уходят в сезон 1
+    for table in ('user_flowers', 'user_flower_counts', 'users'):
+        c.execute(f'ALTER TABLE {table} RENAME TO {table}_unseasoned')
+    c.execute(f'CREATE TABLE users {_SEASON_USERS_COLUMNS}')
+    c.execute(f'CREATE TABLE user_flowers {_SEASON_USER_FLOWERS_COLUMNS}')
+    c.execute(f'CREATE TABLE user_flower_counts {_SEASON_USER_FLOWER_COUNTS_COLUMNS}')
+    c.execute('''INSERT INTO users (chat_id, season, user_id, name, stitches, caterpillars, flower_count, bouquet, updated_at)
+                 SELECT chat_id, 1, user_id, name, stitches, caterpillars, flower_count, bouquet, updated_at
+                 FROM users_unseasoned''')
+    c.execute('''INSERT INTO user_flowers (id, chat_id, season, user_id, flower_name, created_at, quantity)
+                 SELECT id, chat_id, 1, user_id, flower_name, created_at, quantity FROM user_flowers_unseasoned''')
+    c.execute('''INSERT INTO user_flower_counts (chat_id, season, user_id, flower_name, count)
+                 SELECT chat_id, 1, user_id, flower_name, count FROM user_flower_counts_unseasoned''')
+    for table in ('user_flowers', 'user_flower_counts', 'users'):
+        c.execute(f'DROP TABLE {table}_unseasoned')
+    # Индексы старых таблиц удалились вместе с ними
+    c.execute('CREATE INDEX idx_users_season_stitches ON users (chat_id, season, stitches DESC)')
+    c.execute('CREATE INDEX idx_users_updated ON users (updated_at)')
+    c.execute('CREATE INDEX idx_user_flowers_user ON user_flowers (chat_id, season, user_id)')
+    c.execute('CREATE INDEX idx_user_flowers_created ON user_flowers (created_at)')
+    # Позиции незаконченных заполнений записаны в старых ключах (chat_id, user_id)
+    c.execute('UPDATE schema_backfills SET position = NULL')
+
+def _index_users_season_updated(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Лидерборды воркеров подтягивают изменения других процессов по (chat_id, season, updated_at)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_season_updated ON users (chat_id, season, updated_at)')
+
+def _create_update_offsets(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Последнее обновление Telegram, до которого включительно всё обработано; по боту, если база общая
+    c.execute('''CREATE TABLE IF NOT EXISTS update_offsets (
+        bot_id INTEGER PRIMARY KEY,
+        update_id INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    )''')
+
+def _create_stitch_rollups(c: sqlite3.Cursor, legacy_chat_id: int | None) -> None:
+    # Журнал добавлений крестиков только дописывается; отчёты читают сводки ниже, а не его
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_events (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        season INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        penalty INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Сводки обновляются вместе с каждым событием; day и week — даты (ISO) по STATS_UTC_OFFSET, week — понедельник
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_daily (
+        chat_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        stitches INTEGER NOT NULL DEFAULT 0,
+        adds INTEGER NOT NULL DEFAULT 0,
+        members INTEGER NOT NULL DEFAULT 0,
+        caterpillars INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_daily_members (
+        chat_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        stitches INTEGER NOT NULL DEFAULT 0,
+        adds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day, user_id)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_weekly (
+        chat_id INTEGER NOT NULL,
+        week TEXT NOT NULL,
+        stitches INTEGER NOT NULL DEFAULT 0,
+        adds INTEGER NOT NULL DEFAULT 0,
+        caterpillars INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, week)
+    ) WITHOUT ROWID''')
+    # Серии дней подряд с добавлениями: по участнику, user_id 0 — весь сад
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_streaks (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        last_day TEXT NOT NULL,
+        current INTEGER NOT NULL,
+        longest INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stitch_records (
+        chat_id INTEGER PRIMARY KEY,
+        best_day TEXT NOT NULL,
+        best_day_stitches INTEGER NOT NULL,
+        best_week TEXT NOT NULL,
+        best_week_stitches INTEGER NOT NULL
+    )''')
+
+# Шаги по порядку; базы, созданные до появления миграций, проходят их все, поэтому каждый шаг
+# должен быть применим и к уже частично обновлённой схеме. Новые шаги только дописываются в конец.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "таблицы users и user_flowers, разделение базы с одним садом по чатам", _create_gardens),
+    Migration(2, "счётчики цветочков user_flower_counts", _create_flower_counts),
+    Migration(3, "таблицы chat_settings, export_state и processed_messages", _create_settings),
+    Migration(4, "индексы users по (chat_id, stitches) и updated_at", _index_users),
+    Migration(5, "индексы user_flowers по участнику и created_at", _index_user_flowers),
+    Migration(6, "компактные букеты", _compact_bouquets),
+    Migration(7, "сезоны: столбец season в users, user_flowers и user_flower_counts", _add_seasons),
+    Migration(8, "индекс users по (chat_id, season, updated_at)", _index_users_season_updated),
+    Migration(9, "таблица update_offsets", _create_update_offsets),
+    Migration(10, "журнал stitch_events и сводки по дням и неделям", _create_stitch_rollups),
+]
+SCHEMA_VERSION: int = MIGRATIONS[-1].version
+
+class _DryRun(Exception):
+    """Raised to roll back a dry run once every step has succeeded."""
+
+@with_db_connection
+def get_schema_version(c: sqlite3.Cursor, conn: sqlite3.Connection) -> int:
+    """Reads the schema version stored in PRAGMA user_version.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+
+    Returns:
+        int: The version of the last applied migration; 0 for a new or pre-migration database.
+    """
+    c.execute('PRAGMA user_version')
+    return c.fetchone()[0]
+
+@with_db_connection
+def _apply(c: sqlite3.Cursor, conn: sqlite3.Connection, migrations: List[Migration],
+           legacy_chat_id: int | None, dry_run: bool) -> None:
+    """Applies migrations in one transaction; a dry run rolls it back at the end.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        migrations (List[Migration]): The steps to apply, in order.
+        legacy_chat_id (int | None): The chat that owned a single-garden database.
+        dry_run (bool): Whether to roll everything back instead of committing.
+    """
+    # DDL в sqlite3 не открывает транзакцию сам, поэтому открываем её явно
+    c.execute('BEGIN IMMEDIATE')
+    # Другой процесс (соседний воркер или контейнер) мог применить шаг, пока мы ждали блокировку
+    c.execute('PRAGMA user_version')
+    applied: int = c.fetchone()[0]
+    for migration in migrations:
+        if migration.version <= applied:
+            continue
+        migration.upgrade(c, legacy_chat_id)
+        c.execute(f'PRAGMA user_version = {migration.version:d}')
+    if dry_run:
+        raise _DryRun()
+
+def migrate(legacy_chat_id: int | None = None, dry_run: bool = False) -> List[Migration]:
+    """Brings the schema up to SCHEMA_VERSION.
+
+    Each migration is committed together with its version, so an interrupted upgrade
+    resumes at the failed step. When the schema is current this is a single PRAGMA read.
+    A dry run applies every pending step in one transaction and rolls it back, which
+    checks that they succeed on this database without changing it.
+
+    Args:
+        legacy_chat_id (int | None): The chat that owned a single-garden database.
+        dry_run (bool): Whether to only try the migrations.
+
+    Returns:
+        List[Migration]: The migrations that were (or, for a dry run, would be) applied.
+    """
+    version: int = get_schema_version()
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Схема базы версии {version} новее кода (версия {SCHEMA_VERSION}).")
+    pending: List[Migration] = [migration for migration in MIGRATIONS if migration.version > version]
+    if not pending:
+        return []
+    if dry_run:
+        try:
+            _apply(pending, legacy_chat_id, True)
+        except _DryRun:
+            pass
+        return pending
+    for migration in pending:
+        started: float = time.perf_counter()
+        _apply([migration], legacy_chat_id, False)
+        logger.info("Миграция {version} ({description}) применена за {duration:.2f} с.", version=migration.version,
+                    description=migration.description, duration=time.perf_counter() - started)
+    return pending
+
+@with_db_connection
+def get_pending_backfills(c: sqlite3.Cursor, conn: sqlite3.Connection) -> List[str]:
+    """Lists the queued backfills in the order they will run.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+
+    Returns:
+        List[str]: The names of the unfinished backfills.
+    """
+    c.execute('SELECT name FROM schema_backfills ORDER BY id')
+    return [row[0] for row in c.fetchall()]
+
+@with_db_connection
+def _load_backfill_position(c: sqlite3.Cursor, conn: sqlite3.Connection, name: str) -> Tuple[int, ...] | None:
+    c.execute('SELECT position FROM schema_backfills WHERE name = ?', (name,))
+    row: Tuple[str | None] | None = c.fetchone()
+    return tuple(json.loads(row[0])) if row and row[0] else None
+
+@with_db_connection
+def _run_backfill_batch(c: sqlite3.Cursor, conn: sqlite3.Connection, name: str,
+                        position: Tuple[int, ...] | None, batch_size: int) -> Tuple[Tuple[int, ...] | None, int]:
+    """Runs one batch of a backfill and records its progress in the same transaction.
+
+    Args:
+        c (sqlite3.Cursor): The database cursor.
+        conn (sqlite3.Connection): The database connection.
+        name (str): The backfill.
+        position (Tuple[int, ...] | None): Where the previous batch stopped.
+        batch_size (int): How many rows to process.
+
+    Returns:
+        Tuple[Tuple[int, ...] | None, int]: The next position (None when finished) and the rows updated.
+    """
+    position, updated = BACKFILLS[name](position, batch_size)
+    if position is None:
+        c.execute('DELETE FROM schema_backfills WHERE name = ?', (name,))
+    else:
+        c.execute('UPDATE schema_backfills SET position = ? WHERE name = ?', (json.dumps(position), name))
+    return position, updated
+
+def run_backfills(batch_size: int, pause: float = 0.0) -> int:
+    """Runs every queued backfill to completion, one committed batch at a time.
+
+    Progress is stored after each batch, so a restart continues where the last run stopped.
+
+    Args:
+        batch_size (int): How many rows each transaction processes.
+        pause (float): Seconds to sleep between batches, leaving the write lock to the bot.
+
+    Returns:
+        int: The number of rows updated.
+    """
+    total: int = 0
+    for name in get_pending_backfills():
+        started: float = time.perf_counter()
+        position: Tuple[int, ...] | None = _load_backfill_position(name)
+        updated: int = 0
+        while True:
+            position, batch_updated = _run_backfill_batch(name, position, batch_size)
+            updated += batch_updated
+            if position is None:
+                break
+            if pause:
+                time.sleep(pause)
+        logger.info("Заполнение {backfill} завершено за {duration:.2f} с, обновлено строк: {updated}", backfill=name,
+                    duration=time.perf_counter() - started, updated=updated)
+        total += updated
+    return total
+
+def start_backfills(batch_size: int, pause: float) -> threading.Thread | None:
+    """Runs the queued backfills on a daemon thread while the bot serves updates.
+
+    Args:
+        batch_size (int): How many rows each transaction processes.
+        pause (float): Seconds to sleep between batches.
+
+    Returns:
+        threading.Thread | None: The started thread, or None if nothing is queued.
+    """
+    if not get_pending_backfills():
+        return None
+
+    def run() -> None:
+        try:
+            run_backfills(batch_size, pause)
+        except Exception as e:
+            logger.error("Фоновое заполнение данных прервано: {error}", error=e, exc_info=True)
+
+    thread: threading.Thread = threading.Thread(target=run, name="backfill", daemon=True)
+    thread.start()
+    return thread
+
+def init_db(legacy_chat_id: int | None = None, backfill: bool = True) -> None:
+    """Migrates the database to the current schema.
+
+    Args:
+        legacy_chat_id (int | None): The chat that owned a single-garden database.
+        backfill (bool): Whether to also run queued backfills now; the bot passes False
+            and runs them in the background with start_backfills.
+    """
+    migrate(legacy_chat_id)
+    if backfill and get_pending_backfills():
+        run_backfills(BACKFILL_BATCH_SIZE)
+
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1."""
+    number: int = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"нужно целое число не меньше 1, получено {value}")
+    return number
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Схема и обслуживание базы Зимнего сада.")
+    parser.add_argument("--legacy-chat", type=int, help="чат, которому принадлежат данные базы с одним садом")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="показать версию схемы и незавершённые заполнения")
+    migrate_parser = commands.add_parser("migrate", help="применить миграции и заполнения")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="проверить миграции и откатить их")
+    commands.add_parser("backfill", help="пересчитать букеты в users")
+    commands.add_parser("check", help="проверить согласованность букетов")
+    threshold_parser = commands.add_parser("set-threshold", help="задать число крестиков на цветочек в саду")
+    threshold_parser.add_argument("chat_id", type=int)
+    threshold_parser.add_argument("threshold", type=_positive_int, nargs="?",
+                                  help="не меньше 1; без значения — вернуть настройку по умолчанию")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        version: int = get_schema_version()
+        print(f"Версия схемы: {version} из {SCHEMA_VERSION}")
+        for migration in MIGRATIONS:
+            if migration.version > version:
+                print(f"  ожидает: {migration.version}. {migration.description}")
+        if version:
+            print(f"Незавершённые заполнения: {', '.join(get_pending_backfills()) or 'нет'}")
+        raise SystemExit(0)
+    if args.command == "migrate" and args.dry_run:
+        planned: List[Migration] = migrate(args.legacy_chat, dry_run=True)
+        for migration in planned:
+            print(f"{migration.version}. {migration.description}")
+        print("Миграции проходят, изменения откачены." if planned else "Схема актуальна.")
+        raise SystemExit(0)
+
+    init_db(args.legacy_chat)
+    if args.command == "migrate":
+        print(f"Версия схемы: {get_schema_version()}")
+    elif args.command == "backfill":
+        print(f"Обновлено пользователей: {backfill_bouquets()}")
+    elif args.command == "set-threshold":
+        set_flower_threshold(args.chat_id, args.threshold)
+        print(f"Порог для чата {args.chat_id}: {'по умолчанию' if args.threshold is None else args.threshold}")
+    else:
+        broken: List[Tuple[int, int, int]] = check_bouquet_consistency()
+        print(f"Несогласованные пользователи (чат, сезон, пользователь): {broken}" if broken else "Букеты согласованы.")
+        raise SystemExit(1 if broken else 0)
@@ -0,0 +1,288 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from loguru import logger
+import requests
+import telebot
+from typing import Any, BinaryIO, Deque, Dict, List, Tuple
+from config import OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GLOBAL_RATE, OUTBOX_COALESCE, WORKERS
+from metrics import METRICS
+from rendering import MAX_MESSAGE_LENGTH, message_length
+
+# Разделитель между объединёнными ответами
+COALESCE_SEPARATOR: str = "\n\n"
+# Сколько раз пытаться отправить сообщение при сетевых ошибках, прежде чем сдаться
+MAX_ATTEMPTS: int = 5
+
+class TokenBucket:
+    """Token bucket: `capacity` sends at once, refilled at `rate` sends per second.
+
+    block() empties the bucket until a given moment, which is how a 429 retry_after is honored.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.blocked_until: float = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Returns how many seconds to wait before a token is available (0 if one is)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0.0
+        self.updated = max(self.updated, until)
+
+    def idle(self, now: float) -> bool:
+        """Reports whether the bucket is full again, i.e. it can be dropped and recreated later."""
+        self._refill(now)
+        return now >= self.blocked_until and self.tokens >= self.capacity
+
+@dataclass
+class _Outgoing:
+    """One queued Bot API call."""
+    chat_id: int
+    method: str  # "send_message" или "send_document"
+    payload: Any  # текст или (имя файла, файл)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    coalesce: bool = False
+    attempts: int = 0
+
+class Outbox:
+    """Outbound send queue that keeps the bot under Telegram's rate limits.
+
+    Handlers enqueue replies and return at once; a background thread sends them through
+    the bot, taking a token from the chat's bucket and from the global bucket for every
+    call. A 429 response blocks the chat for `retry_after` seconds and puts the message
+    back at the head of the chat's queue, so replies are delayed rather than lost.
+    Consecutive coalescible messages queued for the same chat (the /add confirmations)
+    are sent as one combined message while it fits into MAX_MESSAGE_LENGTH.
+
+    Each process has its own outbox and the limits are not coordinated between processes,
+    so when `processes` outboxes send for the same bot token, each one gets that share of
+    the per-chat and global rates. The per-chat burst cannot drop below one message, so a
+    chat may still get up to max(chat_burst, processes) messages back to back.
+    """
+
+    def __init__(self, chat_rate_per_minute: float, chat_burst: int, global_rate_per_second: float,
+                 coalesce: bool, processes: int = 1) -> None:
+        """Args:
+            chat_rate_per_minute (float): Sustained sends per minute to one chat, for the whole bot.
+            chat_burst (int): How many sends to one chat may go out back to back, for the whole bot.
+            global_rate_per_second (float): Sustained sends per second across all chats, for the whole bot.
+            coalesce (bool): Whether coalescible messages may be merged.
+            processes (int): How many processes send through their own outboxes under the same limits.
+        """
+        self._chat_rate: float = chat_rate_per_minute / 60 / processes
+        self._chat_burst: float = max(1.0, chat_burst / processes)
+        global_rate: float = global_rate_per_second / processes
+        self._global: TokenBucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self._coalesce: bool = coalesce
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._pending: OrderedDict[int, Deque[_Outgoing]] = OrderedDict()
+        self._cond: threading.Condition = threading.Condition()
+        self._bot: telebot.TeleBot | None = None
+        self._thread: threading.Thread | None = None
+        self._closing: bool = False
+        self._in_flight: int = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._closing
+
+    def start(self, bot: telebot.TeleBot) -> None:
+        """Starts the sending thread.
+
+        Args:
+            bot (telebot.TeleBot): The synchronous bot used for the Bot API calls.
+        """
+        self._bot = bot
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stops accepting messages and waits up to `timeout` seconds for the queue to drain."""
+        with self._cond:
+            if self._thread is None or self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        left: int = sum(len(items) for items in self._pending.values())
+        if left:
+            logger.warning("Очередь отправки закрыта, не отправлено сообщений: {left}", left=left)
+
+    def pending(self) -> int:
+        """Returns the number of queued and in-flight calls."""
+        with self._cond:
+            return sum(len(items) for items in self._pending.values()) + self._in_flight
+
+    def send_message(self, chat_id: int, text: str, coalesce: bool = False, **kwargs: Any) -> None:
+        """Queues a text message.
+
+        Args:
+            chat_id (int): The target chat.
+            text (str): The message text.
+            coalesce (bool): Whether it may be merged with neighbouring coalescible messages.
+            **kwargs: Extra arguments for TeleBot.send_message; messages with any are never merged.
+        """
+        self._put(_Outgoing(chat_id, "send_message", text, kwargs, coalesce and not kwargs))
+
+    def reply_to(self, message: telebot.types.Message, text: str) -> None:
+        """Queues a reply to `message`."""
+        self.send_message(message.chat.id, text, reply_parameters=telebot.types.ReplyParameters(
+            message.message_id, allow_sending_without_reply=True
+        ))
+
+    def send_document(self, chat_id: int, document: Tuple[str, BinaryIO]) -> None:
+        """Queues a document; the outbox closes the file once it is sent or given up on.
+
+        Args:
+            chat_id (int): The target chat.
+            document (Tuple[str, BinaryIO]): (file name, file object).
+        """
+        self._put(_Outgoing(chat_id, "send_document", document))
+
+    def _put(self, item: _Outgoing) -> None:
+        with self._cond:
+            self._pending.setdefault(item.chat_id, deque()).append(item)
+            self._cond.notify()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket: TokenBucket | None = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _next_batch(self) -> List[_Outgoing] | None:
+        """Waits until some chat may be sent to and takes its next call (or merged messages).
+
+        Returns None once the outbox is closing and the queue is empty. Called under the lock.
+        """
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return None
+                self._cond.wait()
+                continue
+            now: float = time.monotonic()
+            wait: float = float('inf')
+            ready: int | None = None
+            # Чаты обходятся в порядке очереди, чтобы активный чат не вытеснял остальные
+            for chat_id in self._pending:
+                chat_wait: float = max(self._bucket(chat_id).delay(now), self._global.delay(now))
+                if chat_wait <= 0:
+                    ready = chat_id
+                    break
+                wait = min(wait, chat_wait)
+            if ready is None:
+                self._cond.wait(wait)
+                continue
+
+            items: Deque[_Outgoing] = self._pending[ready]
+            batch: List[_Outgoing] = [items.popleft()]
+            if self._coalesce and batch[0].coalesce:
+                length: int = message_length(batch[0].payload)
+                while items and items[0].coalesce and \
+                        length + len(COALESCE_SEPARATOR) + message_length(items[0].payload) <= MAX_MESSAGE_LENGTH:
+                    length += len(COALESCE_SEPARATOR) + message_length(items[0].payload)
+                    batch.append(items.popleft())
+            if items:
+                self._pending.move_to_end(ready)
+            else:
+                del self._pending[ready]
+            self._bucket(ready).consume(now)
+            self._global.consume(now)
+            self._in_flight += len(batch)
+            if len(self._buckets) > 10000:
+                self._prune_buckets(now)
+            return batch
+
+    def _prune_buckets(self, now: float) -> None:
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._pending and bucket.idle(now)]:
+            del self._buckets[chat_id]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                batch: List[_Outgoing] | None = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._send(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+
+    def _send(self, batch: List[_Outgoing]) -> None:
+        head: _Outgoing = batch[0]
+        try:
+            if head.method == "send_document":
+                head.payload[1].seek(0)  # Повторная попытка должна отправить файл с начала
+                self._bot.send_document(head.chat_id, head.payload, **head.kwargs)
+            else:
+                text: str = COALESCE_SEPARATOR.join(item.payload for item in batch)
+                self._bot.send_message(head.chat_id, text, **head.kwargs)
+            if len(batch) > 1:
+                METRICS.increment("outbox_coalesced", "send_message", len(batch) - 1)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 429:
+                logger.error("Telegram отклонил {method} в чат {chat_id}: {error}", method=head.method,
+                             chat_id=head.chat_id, error=e)
+                self._finish(batch)
+                return
+            retry_after: float = float((e.result_json.get("parameters") or {}).get("retry_after", 1))
+            METRICS.increment("outbox_retries", "429")
+            logger.bind(event="outbox_429").warning("429 от Telegram для чата {chat_id}, повтор через {retry_after} с.",
+                                                   chat_id=head.chat_id, retry_after=retry_after)
+            self._requeue(batch, retry_after)
+            return
+        except (requests.exceptions.RequestException, OSError) as e:
+            head.attempts += 1
+            if head.attempts >= MAX_ATTEMPTS:
+                logger.error("Не удалось отправить {method} в чат {chat_id} после {attempts} попыток: {error}",
+                             method=head.method, chat_id=head.chat_id, attempts=head.attempts, error=e)
+                self._finish(batch)
+                return
+            METRICS.increment("outbox_retries", "network")
+            logger.bind(event="outbox_network").warning("Сетевая ошибка при отправке в чат {chat_id}: {error}. Повтор.",
+                                                       chat_id=head.chat_id, error=e)
+            self._requeue(batch, 2 ** head.attempts)
+            return
+        except Exception as e:
+            logger.error("Ошибка при отправке {method} в чат {chat_id}: {error}", method=head.method,
+                         chat_id=head.chat_id, error=e, exc_info=True)
+        self._finish(batch)
+
+    def _requeue(self, batch: List[_Outgoing], delay: float) -> None:
+        """Puts the batch back at the head of its chat's queue and blocks the chat for `delay` seconds."""
+        chat_id: int = batch[0].chat_id
+        with self._cond:
+            self._bucket(chat_id).block(time.monotonic() + delay)
+            items: Deque[_Outgoing] = self._pending.setdefault(chat_id, deque())
+            items.extendleft(reversed(batch))
+            self._cond.notify()
+
+    def _finish(self, batch: List[_Outgoing]) -> None:
+        for item in batch:
+            if item.method == "send_document":
+                item.payload[1].close()
+
+# При WORKERS > 1 отвечают только воркеры, каждый через свою очередь, поэтому лимиты делятся между ними
+OUTBOX: Outbox = Outbox(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GLOBAL_RATE, OUTBOX_COALESCE, WORKERS)
@@ -0,0 +1,102 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from loguru import logger
+import telebot
+from typing import Dict, List
+from db import get_update_offset, set_update_offset
+from metrics import METRICS
+from workers import update_owner
+
+# Лимит Telegram на число обновлений в одном ответе getUpdates
+MAX_BATCH_SIZE: int = 100
+# Пауза перед повтором после ошибки getUpdates, растёт вдвое до RETRY_MAX_DELAY
+RETRY_DELAY: float = 1.0
+RETRY_MAX_DELAY: float = 30.0
+
+class UpdatePoller:
+    """Long-polling loop that stores how far it got and resumes from there after a restart.
+
+    Updates are fetched with getUpdates in batches of up to `batch_size`. A batch is split
+    by sender: each sender's updates are handled in order, and different senders run in
+    parallel on at most `workers` threads. Only when the whole batch has been handled is
+    its last update_id stored in update_offsets and confirmed to Telegram (by asking for
+    the next offset). A crash therefore never skips an update; the updates of an
+    unfinished batch are delivered again. The commands that change data, /add and
+    /reset, record their message in processed_messages in the same transaction as the
+    change, whatever DEDUP_BACKEND is, so a redelivered one is applied once; read-only
+    commands may answer twice.
+
+    Only this loop (UPDATE_MODE=polling, BOT_MODE=sync) keeps that guarantee. The webhook
+    server answers 200 once an update is queued, and with BOT_MODE=async infinity_polling
+    confirms a batch with its next getUpdates without waiting for the handlers, so in
+    those modes updates still queued or in flight at a crash are lost; the per-message
+    records still keep any update that Telegram does deliver again from being applied twice.
+
+    Telegram answers getUpdates at once while updates are pending, so a backlog left by
+    downtime drains in full batches; the long-poll timeout only applies once it is empty.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, batch_size: int, timeout: int, workers: int) -> None:
+        """Args:
+            bot (telebot.TeleBot): The bot whose handlers process the updates; it must be
+                created with threaded=False, so that handling finishes before the offset moves.
+            batch_size (int): The maximum number of updates per getUpdates call (at most 100).
+            timeout (int): The long-poll timeout in seconds.
+            workers (int): How many senders' updates are handled in parallel.
+        """
+        self._bot: telebot.TeleBot = bot
+        self._bot_id: int = int(bot.token.split(":", 1)[0])
+        self._batch_size: int = min(batch_size, MAX_BATCH_SIZE)
+        self._timeout: int = timeout
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="poll")
+        self._stopped: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        """Polls and handles updates until stop() is called."""
+        stored: int | None = get_update_offset(self._bot_id)
+        offset: int | None = stored + 1 if stored is not None else None
+        logger.info("Опрос Telegram API с update_id {offset}.", offset=offset)
+        delay: float = RETRY_DELAY
+        while not self._stopped.is_set():
+            try:
+                updates: List[telebot.types.Update] = self._bot.get_updates(
+                    offset=offset, limit=self._batch_size, timeout=self._timeout,
+                    long_polling_timeout=self._timeout,
+                )
+            except Exception as e:
+                logger.error("Ошибка getUpdates: {error}. Повтор через {delay} с.", error=e, delay=delay)
+                self._stopped.wait(delay)
+                delay = min(2 * delay, RETRY_MAX_DELAY)
+                continue
+            delay = RETRY_DELAY
+            if not updates:
+                continue
+            self._handle(updates)
+            last: int = updates[-1].update_id
+            set_update_offset(self._bot_id, last)
+            offset = last + 1
+            # Полная пачка значит, что в Telegram ждут ещё обновления
+            backlog: bool = len(updates) >= self._batch_size
+            METRICS.increment("updates_polled", "backlog" if backlog else "live", len(updates))
+            if backlog:
+                logger.info("Разбор накопившихся обновлений: обработано до {update_id}.", update_id=last)
+
+    def stop(self) -> None:
+        """Makes run() return after the current batch."""
+        self._stopped.set()
+
+    def _handle(self, updates: List[telebot.types.Update]) -> None:
+        """Handles a batch: each sender's updates in order, different senders in parallel."""
+        by_owner: Dict[int, List[telebot.types.Update]] = {}
+        for update in updates:
+            by_owner.setdefault(update_owner(update), []).append(update)
+        wait([self._executor.submit(self._handle_in_order, owned) for owned in by_owner.values()])
+
+    def _handle_in_order(self, updates: List[telebot.types.Update]) -> None:
+        for update in updates:
+            try:
+                self._bot.process_new_updates([update])
+            except Exception as e:
+                # Ошибка одного обновления не должна задерживать смещение: оно записано в журнал
+                logger.error("Ошибка при обработке обновления {update_id}: {error}", update_id=update.update_id,
+                             error=e, exc_info=True)
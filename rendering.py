@@ -0,0 +1,62 @@
+from typing import List
+
+# Лимит Telegram на длину сообщения; длина считается в единицах UTF-16, и каждый цветочек-эмодзи занимает две
+MAX_MESSAGE_LENGTH: int = 4096
+ELLIPSIS: str = "…"
+
+def message_length(text: str) -> int:
+    """Returns the length of a text the way Telegram counts it, in UTF-16 code units.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The length.
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+def truncate(text: str, limit: int) -> str:
+    """Shortens a text to at most `limit` UTF-16 code units, ending it with an ellipsis if cut.
+
+    Args:
+        text (str): The text.
+        limit (int): The maximum length.
+
+    Returns:
+        str: The text, or its cut-down version.
+    """
+    if message_length(text) <= limit:
+        return text
+    cut: str = text[:max(0, limit - 1)]
+    while cut and message_length(cut) > limit - 1:
+        cut = cut[:-1]
+    return cut + ELLIPSIS
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Splits a text into messages of at most `limit` UTF-16 code units, on line breaks where possible.
+
+    A single line longer than `limit` is truncated rather than broken mid-line.
+
+    Args:
+        text (str): The text.
+        limit (int): The maximum length of one message.
+
+    Returns:
+        List[str]: The messages; one if the text already fits.
+    """
+    if message_length(text) <= limit:
+        return [text]
+    parts: List[str] = []
+    current: List[str] = []
+    length: int = 0
+    for line in text.split('\n'):
+        line = truncate(line, limit)
+        line_length: int = message_length(line)
+        if current and length + 1 + line_length > limit:
+            parts.append('\n'.join(current))
+            current, length = [], 0
+        length += line_length + (1 if current else 0)
+        current.append(line)
+    if current:
+        parts.append('\n'.join(current))
+    return [part for part in parts if part.strip()]
@@ -0,0 +1,235 @@
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from loguru import logger
+from typing import List
+import db
+
+SNAPSHOT_PREFIX: str = "garden-"
+# Сколько страниц копировать за шаг и сколько спать между шагами: между шагами
+# писатели в db.py получают базу, так что копия не останавливает бота
+BACKUP_STEP_PAGES: int = 256
+BACKUP_STEP_SLEEP: float = 0.005
+# Запись в базу из другого соединения перезапускает пошаговое копирование; после стольких
+# перезапусков копируем одним шагом — в режиме WAL это лишь читающая транзакция, писателям она не мешает
+MAX_BACKUP_RESTARTS: int = 5
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _copy_database(source: sqlite3.Connection, target: sqlite3.Connection) -> None:
+    """Copies `source` into `target` page by page, falling back to a single step if busy writers
+    keep restarting the copy.
+
+    Args:
+        source (sqlite3.Connection): The database to copy.
+        target (sqlite3.Connection): The database to overwrite.
+    """
+    restarts: int = 0
+    last_remaining: int | None = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts >= MAX_BACKUP_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    try:
+        source.backup(target, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP, progress=progress)
+    except _TooManyRestarts:
+        source.backup(target)
+
+def _integrity_check(path: str) -> List[str]:
+    """Runs PRAGMA integrity_check on a database file.
+
+    Args:
+        path (str): The database file.
+
+    Returns:
+        List[str]: The problems found; ["ok"] if the file is intact.
+    """
+    conn: sqlite3.Connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute('PRAGMA integrity_check').fetchall()]
+    finally:
+        conn.close()
+
+def list_snapshots(directory: str) -> List[str]:
+    """Lists snapshots in a directory, oldest first.
+
+    Args:
+        directory (str): The snapshot directory.
+
+    Returns:
+        List[str]: The snapshot paths.
+    """
+    if not os.path.isdir(directory):
+        return []
+    names: List[str] = sorted(
+        name for name in os.listdir(directory)
+        if name.startswith(SNAPSHOT_PREFIX) and (name.endswith('.db') or name.endswith('.db.gz'))
+    )
+    return [os.path.join(directory, name) for name in names]
+
+def create_snapshot(directory: str, keep: int = 24, compress: bool = False) -> str:
+    """Copies the live database into a new snapshot without blocking the bot.
+
+    The copy is made with the SQLite online backup API in small steps, switched to a
+    rollback journal so it is a single self-contained file, verified with
+    PRAGMA integrity_check, optionally gzipped, and only then moved into `directory`.
+    Snapshots beyond the newest `keep` are deleted.
+
+    Args:
+        directory (str): The snapshot directory.
+        keep (int): How many snapshots to keep.
+        compress (bool): Whether to gzip the snapshot.
+
+    Returns:
+        str: The path of the new snapshot.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name: str = SNAPSHOT_PREFIX + time.strftime('%Y%m%dT%H%M%S', time.gmtime()) + '.db'
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        source: sqlite3.Connection = sqlite3.connect(db.DB_NAME, timeout=db.DB_TIMEOUT)
+        target: sqlite3.Connection = sqlite3.connect(tmp_path)
+        try:
+            _copy_database(source, target)
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+            source.close()
+
+        problems: List[str] = _integrity_check(tmp_path)
+        if problems != ["ok"]:
+            raise RuntimeError(f"Снимок не прошёл integrity_check: {problems[:5]}")
+
+        if compress:
+            name += '.gz'
+            with open(tmp_path, 'rb') as plain, gzip.open(tmp_path + '.gz', 'wb') as packed:
+                shutil.copyfileobj(plain, packed)
+            os.remove(tmp_path)
+            tmp_path += '.gz'
+        path: str = os.path.join(directory, name)
+        os.replace(tmp_path, path)
+    except BaseException:
+        for leftover in (tmp_path, tmp_path + '.gz'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    for old in list_snapshots(directory)[:-keep] if keep > 0 else []:
+        os.remove(old)
+    return path
+
+def _unpacked(path: str) -> str:
+    """Returns a plain database file for a snapshot, decompressing .gz snapshots into a temp file."""
+    if not path.endswith('.gz'):
+        return path
+    fd, tmp_path = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(fd, 'wb') as plain, gzip.open(path, 'rb') as packed:
+        shutil.copyfileobj(packed, plain)
+    return tmp_path
+
+def verify_snapshot(path: str) -> List[str]:
+    """Runs PRAGMA integrity_check on a snapshot.
+
+    Args:
+        path (str): The snapshot, plain or gzipped.
+
+    Returns:
+        List[str]: The problems found; ["ok"] if the snapshot is intact.
+    """
+    plain: str = _unpacked(path)
+    try:
+        return _integrity_check(plain)
+    finally:
+        if plain != path:
+            os.remove(plain)
+
+def restore_snapshot(path: str) -> None:
+    """Replaces the contents of the live database with a snapshot.
+
+    The snapshot is verified first and copied in with the backup API, so the database
+    file is never left half-written. The bot should be stopped while restoring: a running
+    bot would keep serving its in-memory caches.
+
+    Args:
+        path (str): The snapshot, plain or gzipped.
+    """
+    plain: str = _unpacked(path)
+    try:
+        problems: List[str] = _integrity_check(plain)
+        if problems != ["ok"]:
+            raise RuntimeError(f"Снимок повреждён, восстановление отменено: {problems[:5]}")
+        source: sqlite3.Connection = sqlite3.connect(plain)
+        target: sqlite3.Connection = sqlite3.connect(db.DB_NAME, timeout=db.DB_TIMEOUT)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        if plain != path:
+            os.remove(plain)
+    db.LEADERBOARDS.invalidate()
+
+def start_snapshot_scheduler(directory: str, interval_minutes: int, keep: int, compress: bool) -> threading.Thread:
+    """Starts a daemon thread that takes a snapshot every `interval_minutes`.
+
+    Args:
+        directory (str): The snapshot directory.
+        interval_minutes (int): The pause between snapshots.
+        keep (int): How many snapshots to keep.
+        compress (bool): Whether to gzip the snapshots.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+    def run() -> None:
+        while True:
+            time.sleep(interval_minutes * 60)
+            try:
+                path: str = create_snapshot(directory, keep, compress)
+                logger.info("Снимок базы сохранён: {path}", path=path)
+            except Exception as e:
+                logger.error("Не удалось сделать снимок базы: {error}", error=e, exc_info=True)
+
+    thread: threading.Thread = threading.Thread(target=run, name="snapshot-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Снимки базы Зимнего сада.")
+    parser.add_argument("--dir", default="snapshots", help="каталог снимков (по умолчанию snapshots)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="сделать снимок работающей базы")
+    create.add_argument("--keep", type=int, default=24, help="сколько последних снимков хранить")
+    create.add_argument("--gzip", action="store_true", help="сжать снимок gzip")
+    commands.add_parser("list", help="показать снимки")
+    verify = commands.add_parser("verify", help="проверить снимок (PRAGMA integrity_check)")
+    verify.add_argument("path")
+    restore = commands.add_parser("restore", help="восстановить базу из снимка (бот должен быть остановлен)")
+    restore.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        print(create_snapshot(args.dir, args.keep, args.gzip))
+    elif args.command == "list":
+        for snapshot_path in list_snapshots(args.dir):
+            print(snapshot_path)
+    elif args.command == "verify":
+        result: List[str] = verify_snapshot(args.path)
+        print("\n".join(result))
+        raise SystemExit(0 if result == ["ok"] else 1)
+    else:
+        restore_snapshot(args.path)
+        print(f"База {db.DB_NAME} восстановлена из {args.path}")
@@ -0,0 +1,144 @@
+import hmac
+import json
+import queue
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+import telebot
+from typing import Any, Callable, List
+
+SECRET_HEADER: str = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE: int = 1024 * 1024
+
+class WebhookServer:
+    """Embedded HTTP server that receives Telegram updates pushed to the webhook.
+
+    Each POST is authenticated by the secret token header, parsed and put on a bounded
+    queue; a fixed set of worker threads hands the updates to `dispatch`. When the queue
+    is full the server answers 503, and Telegram retries the delivery later.
+
+    Telegram only delivers webhooks over HTTPS, so the server is expected to sit behind
+    a TLS-terminating reverse proxy that forwards to `host:port`.
+    """
+
+    def __init__(self, dispatch: Callable[[telebot.types.Update], None], host: str, port: int,
+                 path: str, secret: str, queue_size: int, workers: int) -> None:
+        """Args:
+            dispatch (Callable[[telebot.types.Update], None]): Processes a single update.
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+            path (str): The URL path Telegram posts updates to.
+            secret (str): The expected secret token; a random one is generated if empty.
+            queue_size (int): The maximum number of updates waiting for a worker.
+            workers (int): The number of worker threads.
+        """
+        self.dispatch: Callable[[telebot.types.Update], None] = dispatch
+        self.path: str = path
+        self.secret: str = secret or secrets.token_urlsafe(32)
+        self.updates: queue.Queue[telebot.types.Update] = queue.Queue(maxsize=queue_size)
+        self._workers: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"webhook-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._httpd: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self._make_request_handler())
+
+    def serve_forever(self) -> None:
+        """Starts the workers and serves requests until shutdown() is called."""
+        for worker in self._workers:
+            worker.start()
+        logger.info("Webhook-сервер слушает {address} по пути {path}", address=self._httpd.server_address, path=self.path)
+        self._httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        """Stops accepting requests and lets the workers drain the queue."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self.updates.join()
+
+    def _work(self) -> None:
+        """Worker loop: processes queued updates one by one."""
+        while True:
+            update: telebot.types.Update = self.updates.get()
+            try:
+                self.dispatch(update)
+            except Exception as e:
+                logger.error("Ошибка при обработке обновления {update_id}: {error}", update_id=update.update_id, error=e,
+                             exc_info=True)
+            finally:
+                self.updates.task_done()
+
+    def _make_request_handler(self) -> type:
+        """Builds the request handler class bound to this server."""
+        server: WebhookServer = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                if self.path != server.path:
+                    self._respond(404)
+                    return
+                token: str = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    logger.bind(event="webhook_forbidden").warning("Webhook-запрос с неверным секретом от {client}",
+                                                                   client=self.client_address[0])
+                    self._respond(403)
+                    return
+
+                length: int = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    self._respond(400)
+                    return
+                try:
+                    update: telebot.types.Update = telebot.types.Update.de_json(json.loads(self.rfile.read(length)))
+                except ValueError:
+                    self._respond(400)
+                    return
+
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    # Обратное давление: Telegram повторит доставку позже
+                    logger.bind(event="webhook_overflow").warning("Очередь webhook переполнена, обновление {update_id} отклонено.",
+                                                                 update_id=update.update_id)
+                    self._respond(503)
+                    return
+                self._respond(200)
+
+            def _respond(self, status: int) -> None:
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass  # Запросы не пишем в stderr, ошибки логируются выше
+
+        return RequestHandler
+
+def run_webhook(bot: telebot.TeleBot, url: str, host: str, port: int, secret: str,
+                queue_size: int, workers: int,
+                dispatch: Callable[[telebot.types.Update], None] | None = None) -> None:
+    """Registers the webhook with Telegram and serves updates until interrupted.
+
+    Args:
+        bot (telebot.TeleBot): The bot whose handlers process the updates; it should be
+            created with threaded=False so that the workers here bound the concurrency.
+        url (str): The public HTTPS URL Telegram should post to.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        secret (str): The secret token; a random one is generated if empty.
+        queue_size (int): The maximum number of updates waiting for a worker.
+        workers (int): The number of worker threads.
+        dispatch (Callable[[telebot.types.Update], None] | None): Where the workers hand updates,
+            e.g. WorkerPool.dispatch; by default they are processed by `bot` in this process.
+    """
+    path: str = "/" + url.split("://", 1)[-1].partition("/")[2]
+    server: WebhookServer = WebhookServer(
+        dispatch or (lambda update: bot.process_new_updates([update])),
+        host, port, path, secret, queue_size, workers,
+    )
+    bot.remove_webhook()
+    bot.set_webhook(url=url, secret_token=server.secret, drop_pending_updates=False)
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
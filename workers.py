@@ -0,0 +1,104 @@
+import multiprocessing
+import threading
+from loguru import logger
+import telebot
+from typing import Any, Callable, Dict, List, Tuple
+
+# Обновление, как его передают воркеру: (update_id, JSON сообщения) — это в десятки раз
+# дешевле, чем pickle объекта telebot.types.Update
+RoutedUpdate = Tuple[int, Dict[str, Any]]
+
+def update_owner(update: telebot.types.Update) -> int:
+    """Returns the key an update is routed by: its sender, or its chat if there is no sender,
+    or the update itself if it is not a message.
+
+    Args:
+        update (telebot.types.Update): The update.
+
+    Returns:
+        int: The routing key.
+    """
+    message: telebot.types.Message | None = update.message
+    if message is None:
+        return update.update_id
+    if message.from_user is not None:
+        return message.from_user.id
+    return message.chat.id
+
+def decode_update(routed: RoutedUpdate) -> telebot.types.Update:
+    """Rebuilds the telebot Update in the worker process.
+
+    Args:
+        routed (RoutedUpdate): The (update_id, message JSON) pair sent by WorkerPool.
+
+    Returns:
+        telebot.types.Update: The update.
+    """
+    update_id, message = routed
+    return telebot.types.Update.de_json({"update_id": update_id, "message": message})
+
+class WorkerPool:
+    """Spreads updates over worker processes, each update by a hash of its sender.
+
+    All updates of one user go to the same worker and are handled there one at a time and
+    in order, so a user's commands never race each other; different users are handled in
+    parallel by different processes. Workers are started with the spawn method, so they do
+    not inherit this process's threads, and a worker that has died is restarted on the
+    next update routed to it.
+    """
+
+    def __init__(self, target: Callable[[multiprocessing.Queue], None], workers: int, queue_size: int) -> None:
+        """Args:
+            target (Callable[[multiprocessing.Queue], None]): The worker's main function; it reads
+                RoutedUpdate items from the queue until it gets None. Must be importable by name.
+            workers (int): The number of worker processes.
+            queue_size (int): How many updates may wait for each worker.
+        """
+        self._context = multiprocessing.get_context("spawn")
+        self._target: Callable[[multiprocessing.Queue], None] = target
+        self._queues: List[multiprocessing.Queue] = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes: List[multiprocessing.Process | None] = [None] * workers
+        self._lock: threading.Lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts every worker process."""
+        with self._lock:
+            for index in range(len(self._queues)):
+                self._start(index)
+
+    def dispatch(self, update: telebot.types.Update) -> None:
+        """Hands an update to its worker, waiting if that worker's queue is full.
+
+        Args:
+            update (telebot.types.Update): The update.
+        """
+        if update.message is None:
+            return  # Бот обрабатывает только сообщения
+        index: int = update_owner(update) % len(self._queues)
+        process: multiprocessing.Process | None = self._processes[index]
+        if process is None or not process.is_alive():
+            with self._lock:
+                process = self._processes[index]
+                if process is None or not process.is_alive():
+                    logger.error("Воркер {worker} не работает (код {exitcode}), перезапуск.", worker=index,
+                                 exitcode=process.exitcode if process is not None else None)
+                    self._start(index)
+        self._queues[index].put((update.update_id, update.message.json))
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Lets every worker finish its queue and waits for the processes to exit."""
+        with self._lock:
+            for queue, process in zip(self._queues, self._processes):
+                if process is not None and process.is_alive():
+                    queue.put(None)
+            for process in self._processes:
+                if process is not None:
+                    process.join(timeout)
+
+    def _start(self, index: int) -> None:
+        process: multiprocessing.Process = self._context.Process(
+            target=self._target, args=(self._queues[index],), name=f"worker-{index}", daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info("Воркер {worker} запущен, pid {pid}.", worker=index, pid=process.pid)
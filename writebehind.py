@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from loguru import logger
+from typing import List, Tuple
+from config import WRITE_BEHIND, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_DELAY_MS
+from db import apply_stitch_delta, apply_stitch_deltas, StitchDeltaResult
+
+StitchDelta = Tuple[int, int, str, int, int, int, int | None]  # аргументы apply_stitch_delta
+_STOP: object = object()
+
+class StitchWriter:
+    """Write-behind stage for /add.
+
+    When enabled, operations from handler threads are queued and a background thread
+    commits them in batches: one transaction per `max_batch` operations or per
+    `max_delay_ms` milliseconds, whichever comes first. Each caller still waits for its
+    own StitchDeltaResult, so replies always show the committed totals.
+    When disabled, apply() simply calls db.apply_stitch_delta.
+    """
+
+    def __init__(self, enabled: bool, max_batch: int, max_delay_ms: int) -> None:
+        """Args:
+            enabled (bool): Whether to batch writes at all.
+            max_batch (int): The maximum number of operations per transaction.
+            max_delay_ms (int): How long to wait for more operations after the first one.
+        """
+        self._enabled: bool = enabled
+        self._max_batch: int = max_batch
+        self._max_delay: float = max_delay_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._closed: bool = False
+        self._lock: threading.Lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def apply(self, chat_id: int, user_id: int, name: str, amount: int, penalty: int,
+              flower_threshold: int, message_id: int | None = None) -> StitchDeltaResult | None:
+        """Applies one /add and waits until it is committed.
+
+        Args:
+            chat_id (int): The ID of the chat whose garden is updated.
+            user_id (int): The ID of the user.
+            name (str): The name of the user.
+            amount (int): The amount of stitches to add.
+            penalty (int): Stitches to subtract before adding.
+            flower_threshold (int): Number of stitches per flower.
+            message_id (int | None): The ID of the /add message, to record as processed in the same transaction.
+
+        Returns:
+            StitchDeltaResult | None: The committed result of this operation, or None if the
+                message had already been processed.
+        """
+        delta: StitchDelta = (chat_id, user_id, name, amount, penalty, flower_threshold, message_id)
+        with self._lock:
+            if not self._enabled or self._closed:
+                queued: bool = False
+            else:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="stitch-writer", daemon=True)
+                    self._thread.start()
+                future: Future = Future()
+                self._queue.put((delta, future))
+                queued = True
+        if not queued:
+            return apply_stitch_delta(*delta)
+        return future.result()
+
+    def close(self) -> None:
+        """Commits everything still queued and stops the background thread."""
+        with self._lock:
+            self._closed = True
+            thread: threading.Thread | None = self._thread
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+    def _run(self) -> None:
+        """Background loop: collects a batch and commits it."""
+        stop: bool = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch: List[Tuple[StitchDelta, Future]] = [first]
+            deadline: float = time.monotonic() + self._max_delay
+            while len(batch) < self._max_batch:
+                timeout: float = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[StitchDelta, Future]]) -> None:
+        """Commits a batch in one transaction; if that fails, retries the operations one by one
+        so that a single bad operation does not fail the others.
+
+        Args:
+            batch (List[Tuple[StitchDelta, Future]]): The operations and their futures.
+        """
+        try:
+            results: List[StitchDeltaResult | None] = apply_stitch_deltas([delta for delta, _ in batch])
+        except Exception as e:
+            logger.warning("Пакет из {size} записей не применился ({error}), применяем по одной.", size=len(batch), error=e)
+            for delta, future in batch:
+                try:
+                    future.set_result(apply_stitch_delta(*delta))
+                except Exception as single_error:
+                    future.set_exception(single_error)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+STITCH_WRITER: StitchWriter = StitchWriter(WRITE_BEHIND, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_DELAY_MS)